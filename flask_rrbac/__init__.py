@@ -5,14 +5,15 @@
     Adds Role-Route-based Access Control modules to application
 """
 
+from contextlib import contextmanager
+from datetime import datetime
 from functools import wraps
+import os
+import sys
+import threading
+from types import ModuleType
 
-from flask import request, abort, _request_ctx_stack
-
-try:
-    from flask import _app_ctx_stack
-except ImportError:
-    _app_ctx_stack = None
+from flask import abort, current_app, has_app_context, request
 
 try:
     from flask_login import (
@@ -21,16 +22,29 @@ try:
 except ImportError:
     current_user, anonymous_model = None, None
 
-from .models import (
-    ACLRoleMixin, ACLRoleRouteMapMixin, ACLRouteMixin, ACLUserMixin,
-    ACLUserRoleMapMixin
-)
 from .messages import INIIALIZATION_ERRORS
-import re
+from .policy import (
+    CompiledPolicy, RouteMatrix, drop_expired_rules, role_closure,
+    shared_policy, reset_shared_policy_lock
+)
+from .cache import RoleCache
+from .invalidation import InvalidationLog
+from .matching import (
+    is_werkzeug_rule, match_werkzeug_rule, sample_paths,
+    reset_compiled_rules_lock as reset_werkzeug_rules_lock
+)
+from .middleware import RoleRouteBasedACLMiddleware
+from .document import read_policy_document, write_policy_document
+from .safe_regex import (
+    RULE_ENGINES, RULE_GUARDS, check_rule, compile_rule_cached,
+    reset_compiled_rules_lock as reset_regex_rules_lock
+)
+from .tenants import TenantPolicyCache, tenant_policy_path
 from .defaults import *
 
 __all__ = [
     'RoleRouteBasedACL',
+    'RoleRouteBasedACLMiddleware',
     'ACLRoleMixin',
     'ACLRoleRouteMapMixin',
     'ACLRouteMixin',
@@ -38,7 +52,64 @@ __all__ = [
     'ACLUserRoleMapMixin'
 ]
 
-connection_stack = _app_ctx_stack or _request_ctx_stack
+
+def _current_app():
+    """Return the app of the current application context, or None."""
+    if has_app_context():
+        return current_app._get_current_object()
+    return None
+
+
+def _is_authenticated(user):
+    """Return whether the user is authenticated: is_authenticated is a
+    method before Flask-Login 0.3 and a property since.
+    """
+    is_authenticated = user.is_authenticated
+    if callable(is_authenticated):
+        return is_authenticated()
+    return is_authenticated
+
+# The model mixins depend on SQLAlchemy. They are imported on first access
+# so that config-only deployments neither import nor install it.
+_lazy_objects = {
+    'ACLRoleMixin': 'flask_rrbac.models',
+    'ACLRoleRouteMapMixin': 'flask_rrbac.models',
+    'ACLRouteMixin': 'flask_rrbac.models',
+    'ACLUserMixin': 'flask_rrbac.models',
+    'ACLUserRoleMapMixin': 'flask_rrbac.models'
+}
+
+
+def __getattr__(name):
+    """Import the model mixins when they are first accessed (PEP 562)."""
+    if name in _lazy_objects:
+        module = __import__(_lazy_objects[name], None, None, [name])
+        value = globals()[name] = getattr(module, name)
+        return value
+    raise AttributeError(
+        "module {0!r} has no attribute {1!r}".format(__name__, name)
+    )
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_objects))
+
+
+_module_getattr, _module_dir = __getattr__, __dir__
+
+
+class _LazyModule(ModuleType):
+    """Module type of flask_rrbac before Python 3.7, whose modules have no
+    __getattr__ (PEP 562): it calls the module level one instead.
+    """
+
+    def __getattr__(self, name):
+        value = _module_getattr(name)
+        setattr(self, name, value)
+        return value
+
+    def __dir__(self):
+        return sorted(set(self.__dict__) | set(_module_dir()))
 
 
 class _RoleRouteBasedACLState(object):
@@ -46,6 +117,106 @@ class _RoleRouteBasedACLState(object):
     def __init__(self, acl, app):
         self.acl = acl
         self.app = app
+        self.role_route_config = app.config.get(
+            'RRBAC_ROLE_ROUTE_MAP', RRBAC_ROLE_ROUTE_MAP
+        )
+        self.allow_static = app.config.get(
+            'RRBAC_ALLOW_STATIC', RRBAC_ALLOW_STATIC
+        )
+        self.anonymous_role_name = app.config.get(
+            'RRBAC_ANONYMOUS_ROLE', RRBAC_ANONYMOUS_ROLE
+        )
+        self.method_alternates = app.config.get(
+            'RRACL_METHOD_ALTERNATES', RRACL_METHOD_ALTERNATES
+        )
+        self.cache_db_policy = app.config.get(
+            'RRBAC_CACHE_DB_POLICY', RRBAC_CACHE_DB_POLICY
+        )
+        self.lazy_compile = app.config.get(
+            'RRBAC_LAZY_COMPILE', RRBAC_LAZY_COMPILE
+        )
+        self.rule_engine = app.config.get(
+            'RRBAC_RULE_ENGINE', RRBAC_RULE_ENGINE
+        )
+        self.unsafe_rules = app.config.get(
+            'RRBAC_UNSAFE_RULES', RRBAC_UNSAFE_RULES
+        )
+        self.minimize_policy = app.config.get(
+            'RRBAC_MINIMIZE_POLICY', RRBAC_MINIMIZE_POLICY
+        )
+        self.rule_stats_sample_rate = app.config.get(
+            'RRBAC_RULE_STATS_SAMPLE_RATE', RRBAC_RULE_STATS_SAMPLE_RATE
+        )
+        self.role_hierarchy = app.config.get(
+            'RRBAC_ROLE_HIERARCHY', RRBAC_ROLE_HIERARCHY
+        )
+        self.tenant_policy_dir = app.config.get(
+            'RRBAC_TENANT_POLICY_DIR', RRBAC_TENANT_POLICY_DIR
+        )
+        self.role_loads = None
+        self.tenant_policies = TenantPolicyCache(
+            app.config.get('RRBAC_TENANT_CACHE_SIZE', RRBAC_TENANT_CACHE_SIZE),
+            app.config.get(
+                'RRBAC_TENANT_CACHE_MAX_BYTES', RRBAC_TENANT_CACHE_MAX_BYTES
+            )
+        )
+        store_path = app.config.get(
+            'RRBAC_POLICY_STORE_PATH', RRBAC_POLICY_STORE_PATH
+        )
+        self.policy_store = None
+        if store_path:
+            from .mmap_store import MmapPolicyStore
+
+            self.policy_store = MmapPolicyStore(
+                store_path,
+                check_interval=app.config.get(
+                    'RRBAC_POLICY_STORE_CHECK_INTERVAL',
+                    RRBAC_POLICY_STORE_CHECK_INTERVAL
+                )
+            )
+        self.role_cache = None
+        role_cache_ttl = app.config.get(
+            'RRBAC_ROLE_CACHE_TTL', RRBAC_ROLE_CACHE_TTL
+        )
+        if role_cache_ttl:
+            self.role_cache = RoleCache(
+                role_cache_ttl,
+                app.config.get('RRBAC_ROLE_CACHE_SIZE', RRBAC_ROLE_CACHE_SIZE)
+            )
+        self.invalidation_log = None
+        invalidation_log_path = app.config.get(
+            'RRBAC_INVALIDATION_LOG_PATH', RRBAC_INVALIDATION_LOG_PATH
+        )
+        if invalidation_log_path:
+            self.invalidation_log = InvalidationLog(
+                invalidation_log_path,
+                check_interval=app.config.get(
+                    'RRBAC_INVALIDATION_CHECK_INTERVAL',
+                    RRBAC_INVALIDATION_CHECK_INTERVAL
+                )
+            )
+        self.lock = threading.Lock()
+        self.policy_version = 0
+        self.policy_document_hash = None
+        self.policy = None
+        self.policy_expires_at = None
+        self.tenant_policy_expiries = {}
+        self.role_closure = None
+        self.endpoint_table = {}
+        self.anonymous_decisions = frozenset()
+        self.route_matrix = None
+        self.static_endpoints = None
+        self.endpoint_roles = None
+        self.enforce = app.config.get('RRBAC_ENFORCE', RRBAC_ENFORCE)
+        self.validated = False
+
+    @property
+    def uses_compiled_policy(self):
+        """False in DB mode, unless the DB policy is cached."""
+        return bool(
+            self.policy_store is not None or self.role_route_config or
+            self.cache_db_policy
+        )
 
 
 class RoleRouteBasedACL(object):
@@ -66,6 +237,14 @@ class RoleRouteBasedACL(object):
     :param role_route_map_model: custom role route map model
     :param user_role_map_model: custom user role map model
     :param user_loader: custom user loader, used to load current user
+    :param role_loader: custom role loader, used to load the role names of a
+    user without the role and user role map models
+    :param tenant_resolver: custom tenant resolver, used to select the policy
+    of the tenant of the current request
+    :param async_user_loader: custom user loader returning an awaitable, used
+    by the async checks
+    :param async_role_loader: custom role loader returning an awaitable, used
+    by the async checks
     :param auth_failed_hook: called when authorization fails.
     """
 
@@ -83,292 +262,1933 @@ class RoleRouteBasedACL(object):
         self.set_user_loader(
             kwargs.get('user_loader', lambda: current_user)
         )
+        self.set_role_loader(kwargs.get('role_loader'))
+        self.set_tenant_resolver(kwargs.get('tenant_resolver'))
+        self.set_async_user_loader(kwargs.get('async_user_loader'))
+        self.set_async_role_loader(kwargs.get('async_role_loader'))
         self._auth_fail_hook = kwargs.get('auth_failed_hook')
 
-        if app is not None:
-            self.app = app
-            self.init_app(app)
-        else:
-            self.app = None
+        if app is not None:
+            self.app = app
+            self.init_app(app)
+        else:
+            self.app = None
+
+    def init_app(self, app):
+        """Initialize application in Flask-RRBAC.
+        Adds (RRBAC, app) to flask extensions.
+        Adds hook to authenticate permission before request.
+        :param app: Flask object
+        """
+        if self.app is None:
+            self.app = app
+        state = _RoleRouteBasedACLState(self, app)
+        if state.rule_engine not in RULE_ENGINES:
+            raise ValueError(INIIALIZATION_ERRORS['rule_engine'].format(
+                state.rule_engine, RULE_ENGINES
+            ))
+        if state.unsafe_rules not in RULE_GUARDS:
+            raise ValueError(INIIALIZATION_ERRORS['unsafe_rules'].format(
+                state.unsafe_rules, RULE_GUARDS
+            ))
+        app.extensions['rrbac'] = state
+        app.add_template_global(self.allowed_links, 'rrbac_allowed_links')
+        if hasattr(app, 'cli'):
+            # Flask 0.11+
+            from .cli import rrbac_cli
+            app.cli.add_command(rrbac_cli)
+        if app.extensions['rrbac'].enforce:
+            app.before_request(self._enforce_request)
+
+    def warmup(self, app=None, compile_all=True):
+        """Eagerly build everything the extension derives from the policy.
+
+        The compiled policy, the endpoint permission table and the set of
+        anonymous decisions are otherwise built on the first request. When the
+        application is preloaded in a forking server (gunicorn `preload_app`),
+        call this in the master process so that every worker inherits the same
+        structures copy-on-write::
+
+            app = create_app()
+            rrbac.warmup(app)
+
+        Returns the state of the app (app.extensions['rrbac']).
+        :param app: Flask object
+        :param compile_all: compile the rules of every role, even when
+        RRBAC_LAZY_COMPILE is set
+        """
+        state = self._get_state(app)
+        self.validate(state.app)
+        with state.lock:
+            state.static_endpoints = self.get_static_endpoints(state.app)
+            state.endpoint_roles = self.get_endpoint_roles(state.app)
+            policy = self._build_policy(state, compile_all=compile_all)
+            if policy is not None and compile_all:
+                self._build_route_matrix(state, policy)
+        return state
+
+    def post_fork(self, app=None):
+        """Reset per-process resources in a freshly forked worker.
+
+        Locks (of the app, of its policy and caches, and the module level
+        locks of the shared policies and compiled rules) and database
+        connections must not be shared with the master process. The compiled
+        policy is kept, so the data inherited from
+        warmup is not rebuilt. With gunicorn::
+
+            def post_fork(server, worker):
+                rrbac.post_fork(app)
+
+        :param app: Flask object
+        """
+        state = self._get_state(app)
+        state.lock = threading.Lock()
+        if state.policy is not None:
+            state.policy.reset_locks()
+        if state.role_cache is not None:
+            state.role_cache.reset_lock()
+        if state.invalidation_log is not None:
+            state.invalidation_log.reset_lock()
+        state.tenant_policies.reset_lock()
+        reset_shared_policy_lock()
+        reset_regex_rules_lock()
+        reset_werkzeug_rules_lock()
+        self._dispose_connections(state.app)
+
+    def _dispose_connections(self, app):
+        """Drop the pooled connections of the engine the models are bound
+        to, so that a forked worker opens its own.
+        """
+        with app.app_context():
+            query = getattr(self._role_model, 'query', None)
+            if query is not None:
+                query.session.get_bind().dispose()
+
+    def _get_state(self, app=None):
+        """Return the state recorded by init_app for the app."""
+        app = self.get_app(app)
+        assert 'rrbac' in app.extensions, INIIALIZATION_ERRORS['app']
+        return app.extensions['rrbac']
+
+    def _build_policy(self, state, compile_all=False):
+        """Build the compiled policy of the app along with its endpoint
+        permission table and anonymous decisions, and record them in the
+        state. Apps with identical policies share one compiled policy.
+
+        With RRBAC_LAZY_COMPILE, roles are compiled on first use and the
+        endpoint permission table (which needs every role) is only built when
+        compile_all is set.
+
+        Rules granted until a time (deleted_at of the role or of the role
+        route mapping) are left out once it has passed, and the policy is
+        rebuilt at the next such time.
+        """
+        app = state.app
+        role_hierarchy = state.role_hierarchy
+        rule_expiries = {}
+        if state.policy_store is not None:
+            role_route_map = state.policy_store.role_route_map
+            rule_expiries = state.policy_store.rule_expiries
+        elif state.role_route_config:
+            role_route_map = state.role_route_config
+        elif state.cache_db_policy:
+            with app.app_context():
+                role_route_map = self._load_role_route_map_from_db(
+                    rule_expiries=rule_expiries
+                )
+                role_hierarchy = self._get_role_hierarchy(state)
+        else:
+            return None
+        state.policy_expires_at = None
+        if rule_expiries:
+            role_route_map, state.policy_expires_at = drop_expired_rules(
+                role_route_map, rule_expiries, datetime.utcnow()
+            )
+        policy = shared_policy(
+            role_route_map, state.anonymous_role_name, lazy=state.lazy_compile,
+            engine=state.rule_engine, guard=state.unsafe_rules,
+            minimize=state.minimize_policy,
+            sample_rate=state.rule_stats_sample_rate,
+            role_hierarchy=role_hierarchy
+        )
+        endpoint_table = {}
+        if not state.lazy_compile or compile_all:
+            policy.compile_all()
+            endpoint_table = policy.build_endpoint_table(
+                app.url_map.iter_rules(), state.method_alternates
+            )
+        state.route_matrix = None
+        state.endpoint_table = endpoint_table
+        state.anonymous_decisions = frozenset(
+            key for key, mask in endpoint_table.items()
+            if mask & policy.anonymous_mask
+        )
+        state.policy = policy
+        return policy
+
+    def _build_route_matrix(self, state, policy):
+        """Build the role x (rule, method) matrix of the app's url map."""
+        state.route_matrix = RouteMatrix(
+            policy, self.get_app_routes(state.app)
+        )
+        return state.route_matrix
+
+    def policy_stats(self, app=None):
+        """Return the compile statistics of the app's policy (see
+        CompiledPolicy.compile_stats), or None when no policy is compiled.
+        :param app: Flask object
+        """
+        policy = self._get_policy(self._get_state(app))
+        if policy is None:
+            return None
+        return policy.compile_stats()
+
+    def rule_usage(self, app=None, reset=False):
+        """Return the rule usage statistics of the app's policy in this
+        process (see CompiledPolicy.rule_usage), or None when no policy is
+        compiled. Statistics are only gathered with
+        RRBAC_RULE_STATS_SAMPLE_RATE.
+        :param app: Flask object
+        :param reset: start a new window
+        """
+        policy = self._get_policy(self._get_state(app))
+        if policy is None:
+            return None
+        return policy.rule_usage(reset)
+
+    def _get_policy(self, state):
+        """Return the compiled policy of the app, building it on first use.
+        The policy is rebuilt when the policy store file has been replaced,
+        when another process changed it, or when the access granted by one
+        of its rules has ended.
+        """
+        self._poll_invalidations(state)
+        if state.policy_store is not None and state.policy_store.refresh():
+            state.policy = None
+        if self._policy_expired(state):
+            self.refresh_policy(state.app)
+        policy = state.policy
+        if policy is None and state.uses_compiled_policy:
+            with state.lock:
+                if state.policy is None:
+                    self._build_policy(state)
+                policy = state.policy
+        return policy
+
+    def _get_store_role_route_map(self, state):
+        """Return the role route map of the policy store of the app, without
+        the rules whose access has ended.
+        """
+        store = state.policy_store
+        return drop_expired_rules(
+            store.role_route_map, store.rule_expiries, datetime.utcnow()
+        )[0]
+
+    def _policy_expired(self, state):
+        """Return whether the access granted by a rule of the compiled policy
+        of the app has ended since the policy was built.
+        """
+        expires_at = state.policy_expires_at
+        return (
+            state.policy is not None and expires_at is not None and
+            datetime.utcnow() >= expires_at
+        )
+
+    def write_policy_store(self, path, app=None):
+        """
+        Write the current policy and the user role map of every user into a
+        policy store file (see RRBAC_POLICY_STORE_PATH). The file is replaced
+        atomically, so workers reading it pick up the new version within
+        RRBAC_POLICY_STORE_CHECK_INTERVAL seconds.
+
+        Input:
+            :param path: (type: str) Destination of the store file
+            :param app: (type: Flask) Flask object
+        """
+        from .mmap_store import write_policy_store
+
+        state = self._get_state(app)
+        rule_expiries = {}
+        with state.app.app_context():
+            if state.role_route_config:
+                role_route_map = state.role_route_config
+            else:
+                role_route_map = self._load_role_route_map_from_db(
+                    rule_expiries=rule_expiries
+                )
+            user_roles = self._role_model.query.filter(
+                self._role_model.is_deleted == (False)
+            ).join(
+                self._user_role_map_model
+            ).filter(
+                self._user_role_map_model.is_deleted == (False)
+            ).join(
+                self._user_model
+            ).with_entities(
+                self._user_model.get_id, self._role_model.name
+            ).yield_per(10000)
+            write_policy_store(
+                path, role_route_map, user_roles, state.anonymous_role_name,
+                rule_expiries
+            )
+
+    def refresh_policy(self, app=None):
+        """
+        Drop the compiled policy of the app (and what is derived from it) and
+        bump its policy version, so that the policy is rebuilt from its
+        source on next use. Call it after changing the DB policy.
+        :param app: Flask object
+        """
+        state = self._get_state(app)
+        with state.lock:
+            state.policy = None
+            state.policy_expires_at = None
+            state.role_closure = None
+            state.route_matrix = None
+            state.endpoint_table = {}
+            state.anonymous_decisions = frozenset()
+            state.policy_version += 1
+        state.tenant_policies.invalidate()
+        return state.policy_version
+
+    def get_tenant_policy(self, tenant, app=None):
+        """
+        Return the compiled policy of a tenant, from the tenant policy cache
+        of the app or loaded on demand: from the policy document
+        `<RRBAC_TENANT_POLICY_DIR>/<tenant>.json` when the directory is set,
+        otherwise from the DB, restricted to the roles whose tenant_id column
+        is the tenant. A tenant without a policy gets an empty one. A DB
+        policy is loaded again once the access granted by one of its rules
+        has ended.
+        :param tenant: id of the tenant
+        :param app: Flask object
+        """
+        state = self._get_state(app)
+        expires_at = state.tenant_policy_expiries.get(tenant)
+        if expires_at is not None and datetime.utcnow() >= expires_at:
+            state.tenant_policy_expiries.pop(tenant, None)
+            state.tenant_policies.invalidate(tenant)
+        return state.tenant_policies.get(
+            tenant, lambda tenant: self._load_tenant_policy(state, tenant)
+        )
+
+    def _load_tenant_policy(self, state, tenant):
+        """Load and compile the policy of a tenant. Its roles are compiled on
+        first use, and tenants with identical policies share one.
+        """
+        if state.tenant_policy_dir:
+            path = tenant_policy_path(state.tenant_policy_dir, tenant)
+            role_route_map = {}
+            if os.path.exists(path):
+                role_route_map = read_policy_document(
+                    path, anonymous_role_name=state.anonymous_role_name
+                )['role_route_map']
+        else:
+            rule_expiries = {}
+            with self._app_context(state.app):
+                role_route_map = self._load_role_route_map_from_db(
+                    tenant, rule_expiries
+                )
+            if rule_expiries:
+                role_route_map, expires_at = drop_expired_rules(
+                    role_route_map, rule_expiries, datetime.utcnow()
+                )
+                if expires_at is not None:
+                    state.tenant_policy_expiries[tenant] = expires_at
+        return shared_policy(
+            role_route_map, state.anonymous_role_name, lazy=True,
+            engine=state.rule_engine, guard=state.unsafe_rules,
+            minimize=state.minimize_policy,
+            role_hierarchy=state.role_hierarchy
+        )
+
+    def refresh_tenant_policy(self, tenant=None, app=None):
+        """
+        Drop the cached policy of a tenant, or of every tenant, so that it is
+        loaded again on next use. Call it after changing the policy of a
+        tenant.
+        :param tenant: id of the tenant, None for every tenant
+        :param app: Flask object
+        """
+        self._get_state(app).tenant_policies.invalidate(tenant)
+
+    def tenant_stats(self, app=None):
+        """Return the statistics of the tenant policy cache of the app (see
+        TenantPolicyCache.stats).
+        :param app: Flask object
+        """
+        return self._get_state(app).tenant_policies.stats()
+
+    def _poll_invalidations(self, state):
+        """Apply the invalidations published by other processes."""
+        if state.invalidation_log is None:
+            return
+        invalidations = state.invalidation_log.poll()
+        if invalidations is None:
+            return
+        user_ids, policy_changed, everything = invalidations
+        if state.role_cache is not None:
+            if everything:
+                state.role_cache.invalidate()
+            else:
+                for user_id in user_ids:
+                    state.role_cache.invalidate(user_id)
+        if policy_changed:
+            self.refresh_policy(state.app)
+
+    def _invalidate(self, state, user_ids=(), policy=False):
+        """Invalidate the cached roles of the users and/or the compiled
+        policy, in this process and, through RRBAC_INVALIDATION_LOG_PATH, in
+        the others.
+        """
+        if state.role_cache is not None:
+            for user_id in user_ids:
+                state.role_cache.invalidate(user_id)
+        if policy:
+            self.refresh_policy(state.app)
+        if state.invalidation_log is not None:
+            state.invalidation_log.publish(user_ids, policy)
+
+    def _write_policy_change(self, state, write):
+        """Call write(session) in a session of its own, bound to the engine
+        of the models, and commit it. The session of the caller is left
+        untouched: its pending changes are not committed and its objects are
+        not expired.
+        """
+        from sqlalchemy.orm import Session
+
+        with self._app_context(state.app):
+            session = Session(bind=self._role_model.query.session.get_bind(
+                self._role_model.__mapper__
+            ))
+            try:
+                changed = write(session)
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+            finally:
+                session.close()
+        return changed
+
+    def grant_role(self, users, role_name, expires_at=None, app=None):
+        """
+        Grant a role to users, until expires_at when given. Only the missing
+        user role mappings are inserted, in batches, and only the cached
+        roles of these users are invalidated, in every process using
+        RRBAC_INVALIDATION_LOG_PATH.
+        Example::
+            rrbac.grant_role([alice, bob], 'admin')
+
+        :param users: a user or a list of users
+        :param role_name: name of the role
+        :param expires_at: end of the grant (deleted_at of the mappings)
+        :param app: Flask object
+        Output:
+            list of the ids of the users whose roles changed
+        """
+        return self._set_user_roles(users, role_name, True, expires_at, app)
+
+    def revoke_role(self, users, role_name, expires_at=None, app=None):
+        """
+        Revoke a role of users, now or at expires_at. See grant_role.
+        :param users: a user or a list of users
+        :param role_name: name of the role
+        :param expires_at: time of the revocation (deleted_at of the
+        mappings), now by default
+        :param app: Flask object
+        Output:
+            list of the ids of the users whose roles changed
+        """
+        return self._set_user_roles(users, role_name, False, expires_at, app)
+
+    def _set_user_roles(self, users, role_name, active, expires_at, app):
+        from .bulk import set_user_roles
+
+        state = self._get_state(app)
+        if not isinstance(users, (list, tuple, set)):
+            users = [users]
+        user_ids = [user.id for user in users]
+        changed = self._write_policy_change(state, lambda session: (
+            set_user_roles(
+                session, self._role_model, self._user_model,
+                self._user_role_map_model, user_ids, role_name, active,
+                expires_at
+            )
+        ))
+        self._invalidate(state, user_ids=changed)
+        return changed
+
+    def attach_route(
+        self, role_name, method, rules, expires_at=None, app=None
+    ):
+        """
+        Give a role access to rules with a method, until expires_at when
+        given. Missing routes are created. The compiled policy is rebuilt, in
+        every process using RRBAC_INVALIDATION_LOG_PATH.
+        Example::
+            rrbac.attach_route('admin', 'GET', ['/orders', '/orders/[0-9]+'])
+
+        :param role_name: name of the role
+        :param method: Http method
+        :param rules: a rule or a list of rules
+        :param expires_at: end of the access (deleted_at of the mappings)
+        :param app: Flask object
+        Output:
+            list of the ids of the routes whose mapping changed
+        """
+        return self._set_role_routes(
+            role_name, method, rules, True, expires_at, app
+        )
+
+    def detach_route(
+        self, role_name, method, rules, expires_at=None, app=None
+    ):
+        """
+        Remove the access of a role to rules with a method, now or at
+        expires_at. See attach_route.
+        :param role_name: name of the role
+        :param method: Http method
+        :param rules: a rule or a list of rules
+        :param expires_at: time of the removal (deleted_at of the mappings),
+        now by default
+        :param app: Flask object
+        Output:
+            list of the ids of the routes whose mapping changed
+        """
+        return self._set_role_routes(
+            role_name, method, rules, False, expires_at, app
+        )
+
+    def _set_role_routes(
+        self, role_name, method, rules, active, expires_at, app
+    ):
+        from .bulk import set_role_routes
+
+        state = self._get_state(app)
+        if not isinstance(rules, (list, tuple, set, frozenset)):
+            rules = [rules]
+        if active:
+            self._check_rules(state, rules)
+        changed = self._write_policy_change(state, lambda session: (
+            set_role_routes(
+                session, self._role_model, self._route_model,
+                self._role_route_map_model, role_name, method.upper(),
+                set(rules), active, expires_at
+            )
+        ))
+        if changed:
+            self._invalidate(state, policy=True)
+        return changed
+
+    def _check_rules(self, state, rules):
+        """Apply RRBAC_UNSAFE_RULES to regex rules before they are written.
+        """
+        for rule in rules:
+            if not is_werkzeug_rule(rule):
+                check_rule(rule, state.unsafe_rules)
+
+    def import_policy(
+        self, role_route_map, app=None, chunk_size=1000, prune=False
+    ):
+        """
+        Load a policy document, in the format of RRBAC_ROLE_ROUTE_MAP, into
+        the role, route and role route map models, e.g. to seed a new
+        environment. With Flask 0.11+ it is also available as
+        `flask rrbac import-policy`.
+
+        The document is diffed against the DB and only the missing rows are
+        written, with batched Core inserts of chunk_size rows, in a single
+        transaction. The policy version is bumped once, after the commit.
+        Example::
+            rrbac.import_policy(json.load(open('policy.json')), app)
+
+        :param role_route_map: dict of role -> method -> rules
+        :param app: Flask object
+        :param chunk_size: number of rows per statement
+        :param prune: remove the role route mappings which are not in the
+        document (soft deleted when the model has deleted_at)
+        Output:
+            dict of the number of roles, routes and role_routes inserted and
+            of role_routes removed
+        """
+        from .bulk import import_role_route_map
+
+        state = self._get_state(app)
+        for method_map in role_route_map.values():
+            for rules in (method_map or {}).values():
+                self._check_rules(state, rules or ())
+        counts = self._write_policy_change(state, lambda session: (
+            import_role_route_map(
+                session, self._role_model, self._route_model,
+                self._role_route_map_model, role_route_map, chunk_size, prune
+            )
+        ))
+        self._invalidate(state, policy=True)
+        return counts
+
+    def export_policy_document(self, output, app=None):
+        """
+        Write the policy of the app as a policy document: canonical JSON
+        usable as RRBAC_ROLE_ROUTE_MAP, with a content hash (see
+        write_policy_document). With Flask 0.11+ it is also available as
+        `flask rrbac export-policy`.
+
+        In DB mode the roles are read and written one at a time, so only the
+        rules of one role are held in memory.
+        Example::
+            with open('policy.json', 'w') as output:
+                rrbac.export_policy_document(output, app)
+
+        :param output: text file to write to
+        :param app: Flask object
+        Output:
+            Content hash of the policy
+        """
+        state = self._get_state(app)
+        if state.policy_store is not None:
+            role_route_map = self._get_store_role_route_map(state)
+        elif state.role_route_config:
+            role_route_map = state.role_route_config
+        else:
+            with self._app_context(state.app):
+                return write_policy_document(
+                    output, self._iter_role_route_map_from_db(),
+                    state.anonymous_role_name
+                )
+        return write_policy_document(
+            output, sorted(role_route_map.items()), state.anonymous_role_name
+        )
+
+    def _iter_role_route_map_from_db(self):
+        """Generate the (role, method -> rules) pairs of the active role route
+        mapping in the DB, sorted by role name, one query per role.
+        """
+        def active_rules():
+            return self._route_model.query.join(
+                self._role_route_map_model
+            ).filter(
+                self._role_route_map_model.is_deleted == (False)
+            ).join(
+                self._role_model
+            ).filter(
+                self._role_model.is_deleted == (False)
+            )
+
+        role_names = sorted(set(
+            role_name for (role_name,) in active_rules().with_entities(
+                self._role_model.name
+            ).distinct()
+        ))
+        for role_name in role_names:
+            rules_by_method = {}
+            for method, rule in active_rules().filter(
+                self._role_model.name == role_name
+            ).with_entities(
+                self._route_model.get_method, self._route_model.get_rule
+            ).distinct():
+                rules_by_method.setdefault(method, set()).add(rule)
+            yield role_name, rules_by_method
+
+    def import_policy_document(
+        self, path, app=None, chunk_size=1000, prune=False
+    ):
+        """
+        Check the content hash and the Anonymous Role of a policy document
+        file and import its role route map into the DB (see import_policy).
+        :param path: path of the policy document
+        :param app: Flask object
+        :param chunk_size: number of rows per statement
+        :param prune: remove the role route mappings which are not in the
+        document
+        """
+        document = read_policy_document(
+            path, anonymous_role_name=self._get_state(app).anonymous_role_name
+        )
+        return self.import_policy(
+            document['role_route_map'], app, chunk_size, prune
+        )
+
+    def load_policy_document(self, path, app=None):
+        """
+        Use the role route map of a policy document file as the
+        RRBAC_ROLE_ROUTE_MAP of the app, e.g. on edge services without a DB.
+        The document has to be written for the RRBAC_ANONYMOUS_ROLE of the
+        app (ValueError otherwise). When the document has the content hash of
+        the policy already loaded, the file is not parsed. Returns True when a
+        new policy was loaded.
+        :param path: path of the policy document
+        :param app: Flask object
+        """
+        state = self._get_state(app)
+        document = read_policy_document(
+            path, state.policy_document_hash, state.anonymous_role_name
+        )
+        if document is None:
+            return False
+        state.role_route_config = document['role_route_map']
+        state.policy_document_hash = document['sha1']
+        self.refresh_policy(state.app)
+        return True
+
+    def _load_role_route_map_from_db(self, tenant=None, rule_expiries=None):
+        """
+        Load the active role route mapping from the DB in the format of
+        RRBAC_ROLE_ROUTE_MAP.
+
+        Input:
+            :param tenant: id of a tenant, to only load the roles whose
+            tenant_id column is the tenant
+            :param rule_expiries: dict filled with (role, method, rule) ->
+            datetime at which the access granted by the rule ends, for the
+            rules granted until a time (deleted_at in the future)
+        Output:
+            dict of role -> method -> set of rules
+        """
+        rows = self._route_model.query.join(
+            self._role_route_map_model
+        ).filter(
+            self._role_route_map_model.is_deleted == (False)
+        ).join(
+            self._role_model
+        ).filter(
+            self._role_model.is_deleted == (False)
+        )
+        if tenant is not None:
+            rows = rows.filter(self._role_model.tenant_id == tenant)
+        expiry_columns = [
+            model.deleted_at for model in (
+                self._role_model, self._role_route_map_model
+            ) if hasattr(model, 'deleted_at')
+        ]
+        rows = rows.with_entities(
+            self._role_model.name,
+            self._route_model.get_method,
+            self._route_model.get_rule,
+            *expiry_columns
+        ).distinct()
+        role_route_map = {}
+        permanent = set()
+        for row in rows:
+            role_name, method, rule = row[:3]
+            role_route_map.setdefault(role_name, {}).setdefault(
+                method, set()
+            ).add(rule)
+            if rule_expiries is None:
+                continue
+            key = (role_name, method, rule)
+            ends = [end for end in row[3:] if end is not None]
+            if not ends:
+                permanent.add(key)
+                rule_expiries.pop(key, None)
+            elif key not in permanent:
+                # The latest of the grants of a rule ends its access
+                rule_expiries[key] = max(
+                    rule_expiries.get(key, min(ends)), min(ends)
+                )
+        return role_route_map
+
+    def _get_role_hierarchy(self, state):
+        """
+        Return the role hierarchy of the app: RRBAC_ROLE_HIERARCHY, or in DB
+        mode the parent_id column of the role model when it has one.
+
+        Output:
+            dict of role -> set of the roles it includes, or None
+        """
+        if state.role_hierarchy is not None:
+            return state.role_hierarchy
+        if state.policy_store is not None or state.role_route_config or \
+                getattr(self._role_model, 'parent_id', None) is None:
+            return None
+        return self._load_role_hierarchy_from_db()
+
+    def _load_role_hierarchy_from_db(self):
+        """
+        Load the role hierarchy from the parent_id column of the role model:
+        a role includes its parent role.
+
+        Output:
+            dict of role -> set of the roles it includes
+        """
+        from sqlalchemy.orm import aliased
+
+        parent_model = aliased(self._role_model)
+        rows = self._role_model.query.join(
+            parent_model, self._role_model.parent_id == parent_model.id
+        ).filter(
+            self._role_model.is_deleted == (False)
+        ).filter(
+            parent_model.is_deleted == (False)
+        ).with_entities(self._role_model.name, parent_model.name)
+        role_hierarchy = {}
+        for role_name, parent_name in rows:
+            role_hierarchy.setdefault(role_name, set()).add(parent_name)
+        return role_hierarchy
+
+    def _get_role_closure(self, state):
+        """Return the transitive closure of the role hierarchy of the app
+        (see policy.role_closure), from the compiled policy when there is one.
+        Otherwise it is computed on first use and kept in the state until
+        refresh_policy.
+        """
+        if state.uses_compiled_policy:
+            policy = self._get_policy(state)
+            if policy is not None:
+                return policy.role_closure
+        self._poll_invalidations(state)
+        closure = state.role_closure
+        if closure is None:
+            closure = state.role_closure = role_closure(
+                self._get_role_hierarchy(state)
+            )
+        return closure
+
+    def _expand_roles(self, closure, roles):
+        """Return the roles along with the roles they include."""
+        if not closure:
+            return roles
+        expanded = set(roles)
+        for role in roles:
+            expanded.update(closure.get(role, ()))
+        return expanded
+
+    def as_role_model(self, model_cls):
+        """A decorator to set custom model or role.
+        :param model_cls: Model of role.
+        """
+        self._role_model = model_cls
+        return model_cls
+
+    def as_route_model(self, model_cls):
+        """A decorator to set custom model or route.
+        :param model_cls: Model of route.
+        """
+        self._route_model = model_cls
+        return model_cls
+
+    def as_user_model(self, model_cls):
+        """A decorator to set custom model or user.
+        :param model_cls: Model of user.
+        """
+        self._user_model = model_cls
+        return model_cls
+
+    def as_user_role_map_model(self, model_cls):
+        """A decorator to set custom model or user_role_map.
+        :param model_cls: Model of user_role_map.
+        """
+        self._user_role_map_model = model_cls
+        return model_cls
+
+    def as_role_route_map_model(self, model_cls):
+        """A decorator to set custom model or role_route_map.
+        :param model_cls: Model of role_route_map.
+        """
+        self._role_route_map_model = model_cls
+        return model_cls
+
+    def set_role_model(self, model_class):
+        """Decorator to set a custom model for roles.
+        :param model_class: Model of role.
+        """
+        self._role_model = model_class
+
+    def set_route_model(self, model_class):
+        """Decorator to set a custom model for routes.
+        :param model_class: Model of route.
+        """
+        self._route_model = model_class
+
+    def set_user_model(self, model_class):
+        """Decorator to set a custom model for users.
+        :param model_class: Model of user.
+        """
+        self._user_model = model_class
+
+    def set_user_role_map_model(self, model_class):
+        """Decorator to set a custom model for user_role_map.
+        :param model_class: Model of user_role_map.
+        """
+        self._user_role_map_model = model_class
+
+    def set_role_route_map_model(self, model_class):
+        """Decorator to set a custom model for role_route_map.
+        :param model_class: Model of role_route_map.
+        """
+        self._role_route_map_model = model_class
+
+    def set_user_loader(self, loader):
+        """
+        Set the function used to load the user in context.
+        E.g.
+            from flask_login import current_user
+            rrbac.set_user_loader(lambda: current_user)
+        :param loader: Current user function.
+        """
+        self._user_loader = loader
+
+    def set_role_loader(self, loader):
+        """
+        Set the function used to load the names of the roles of a user. When
+        set, the role and user role map models are not needed, which allows
+        config mode (RRBAC_ROLE_ROUTE_MAP) without any ORM.
+        E.g.
+            rrbac.set_role_loader(lambda user: user.role_names)
+
+        With a tenant resolver, requests of a tenant call it with the tenant
+        as second argument, and it returns the roles of the user in that
+        tenant.
+        :param loader: Function taking a user and returning role names.
+        """
+        self._role_loader = loader
+
+    def set_tenant_resolver(self, resolver):
+        """
+        Set the function returning the id of the tenant of the current
+        request, or None to use the policy of the app. Requests of a tenant
+        are checked against the policy of the tenant (see get_tenant_policy)
+        and the roles of the user in the tenant: with a tenant_id column on
+        the role model, only the roles of the tenant are loaded.
+        E.g.
+            rrbac.set_tenant_resolver(lambda: request.headers.get('X-Tenant'))
+        :param resolver: Function without arguments returning a tenant id.
+        """
+        self._tenant_resolver = resolver
+
+    def set_async_user_loader(self, loader):
+        """
+        Set the function used by the async checks to load the current user.
+        It returns an awaitable of the user (or the user). The user loader is
+        used when it is not set.
+        :param loader: Function without arguments returning an awaitable.
+        """
+        self._async_user_loader = loader
+
+    def set_async_role_loader(self, loader):
+        """
+        Set the function used by the async checks to load the names of the
+        roles of a user, e.g. with an async SQLAlchemy session. Concurrent
+        loads of the roles of a user are coalesced into one, whose result
+        goes to the role cache when RRBAC_ROLE_CACHE_TTL is set. When it is
+        not set, the roles are loaded as in the sync checks (see
+        set_role_loader) in the executor of the event loop.
+        E.g.
+            async def load_roles(user):
+                result = await session.execute(roles_of(user.id))
+                return result.scalars().all()
+            rrbac.set_async_role_loader(load_roles)
+        :param loader: Function taking a user and returning an awaitable of
+        role names.
+        """
+        self._async_role_loader = loader
+
+    def set_auth_fail_hook(self, auth_fail_hook):
+        """Set auth_fail_hook which called when Authorization fails
+        If you haven't set any hook, Flask-RBACL will call::
+            abort(403)
+        :param auth_fail_hook: Hook function
+        """
+        self._auth_fail_hook = auth_fail_hook
+
+    def get_app(self, reference_app=None):
+        """Helper method that implements the logic to look up an application.
+        The application bound to the current context wins over the one the
+        extension was initialized with, so that one extension can serve
+        several applications.
+        """
+        if reference_app is not None:
+            return reference_app
+        app = _current_app()
+        if app is not None:
+            return app
+        if self.app is not None:
+            return self.app
+        raise RuntimeError('application not registered on rrbac '
+                           'instance and no application bound '
+                           'to current context')
+
+    def _load_current_user(self):
+        """Load the current user with the user loader."""
+        return self._unwrap_user(self._user_loader())
+
+    def _unwrap_user(self, current_user):
+        """Return the object behind a flask-login current_user proxy."""
+        # Compatible with flask-login anonymous user
+        if current_user and hasattr(current_user, '_get_current_object'):
+            current_user = current_user._get_current_object()
+        return current_user
+
+    def authenticate_async(self, f):
+        """
+        Async counterpart of _authenticate, for views run by an event loop
+        (`async def` views of Flask 2+, Quart). The decorated function is a
+        coroutine function, which Flask runs with its async support (the
+        `async` extra of Flask); the view itself may be a coroutine function
+        or a plain function. Routes open to the Anonymous Role and users
+        whose roles are in the role cache are decided without leaving the
+        event loop. Other roles are loaded with the async role loader, or
+        in the executor of the loop.
+        Example::
+            @app.route('/reports')
+            @rrbac.authenticate_async
+            async def reports():
+                ...
+
+        :param f: Decorated Function
+        """
+        from .aio import authenticate
+        return authenticate(self, f)
+
+    def is_request_allowed_async(self, app=None):
+        """
+        Return a coroutine of whether the current user can access the current
+        request, for async views. Call warmup beforehand so that a compiled
+        policy is not built on the first request.
+        :param app: Flask object
+        """
+        from .aio import is_request_allowed
+        return is_request_allowed(self, self._get_state(app))
+
+    def check_permission_async(
+        self, user, method, path, app=None, roles=None, tenant=None
+    ):
+        """
+        Async counterpart of can: return a coroutine of whether the user can
+        access the path with the method::
+
+            if await rrbac.check_permission_async(user, 'POST', '/orders'):
+                ...
+
+        :param user: user to check, None for an anonymous user
+        :param method: Http method
+        :param path: Path to check
+        :param app: Flask object
+        :param roles: role names of the user, when already known
+        :param tenant: id of a tenant whose policy is used instead of the
+        policy of the app
+        """
+        from .aio import check_permission
+        state = self._get_state(app)
+        user = self._unwrap_user(user)
+        if user is not None and not _is_authenticated(user):
+            user = None
+        method = state.method_alternates.get(method, method)
+        return check_permission(
+            self, state, method, path, lambda: user, roles, tenant
+        )
+
+    def _authenticate(self, f):
+        """
+        Decorator to perform the checks for whether the user has access to the
+        specific endpoint or not.
+
+        If the user has the access, then he can proceed to the view function.
+        Otherwise, the auth_fail_hook is called.
+
+        To add the decorator on each endpoint, instead of manually attaching
+        the signature everywhere, the following can be done:
+
+            for mod, func in app.view_functions.items():
+                app.view_functions[mod] = rrbac._authenticate(func)
+
+        The above two lines decorate all the view functions with the
+        _authenticate decorator. Please note that if this approach is adopted,
+        then make sure to add the above snippet AFTER all the view functions
+        have been attached to the application. Alternatively, set
+        RRBAC_ENFORCE to check every request, including the ones of
+        blueprints registered later, in which case this decorator does
+        nothing.
+
+        :param f: Decorated Function
+        """
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            state = self._get_state()
+            if not state.enforce:
+                if not state.validated:
+                    self.validate(state.app)
+                if not self._is_request_allowed(state):
+                    return self._auth_fail_hook_caller()
+            return f(*args, **kwargs)
+        return decorated_function
+
+    def _enforce_request(self):
+        """before_request hook installed by init_app when RRBAC_ENFORCE is
+        set. Requests matching no url rule are left to Flask (404/405).
+        """
+        if request.url_rule is None:
+            return None
+        state = self._get_state()
+        if not state.validated:
+            self.validate(state.app)
+        if not self._is_request_allowed(state):
+            return self._auth_fail_hook_caller()
+        return None
+
+    def validate(self, app=None):
+        """
+        Check that everything the app's configuration needs has been set
+        (models, loaders). It runs once, on the first checked request or in
+        warmup, so that requests do not repeat these checks.
+        :param app: Flask object
+        """
+        state = self._get_state(app)
+        assert self._user_model, INIIALIZATION_ERRORS['user']
+        if state.policy_store is None:
+            if not state.role_route_config:
+                assert self._route_model, INIIALIZATION_ERRORS['route']
+                assert self._role_route_map_model, \
+                    INIIALIZATION_ERRORS['role_route_map']
+            if self._role_loader is None:
+                assert self._role_model, INIIALIZATION_ERRORS['role']
+                assert self._user_role_map_model, \
+                    INIIALIZATION_ERRORS['user_role_map']
+        assert self._user_loader, INIIALIZATION_ERRORS['user_loader']
+        if self._tenant_resolver is not None and \
+                not state.tenant_policy_dir:
+            assert getattr(self._role_model, 'tenant_id', None) is not None, \
+                INIIALIZATION_ERRORS['tenant']
+        state.validated = True
+
+    def _get_declared_access(self, state):
+        """Return True when the current request is allowed without a user
+        (static file, allow_anonymous), the roles declared with allow_roles
+        for its endpoint, or None when it is decided by the policy.
+        """
+        return self._get_endpoint_access(
+            state, request.method, request.endpoint
+        )
+
+    def _get_endpoint_access(self, state, method, endpoint):
+        """Return True when requests to the endpoint with the method are
+        allowed without a user, the roles declared with allow_roles for the
+        endpoint, or None when they are decided by the policy.
+        """
+        if state.allow_static and method in ('GET', 'HEAD'):
+            static_endpoints = state.static_endpoints
+            if static_endpoints is None:
+                static_endpoints = state.static_endpoints = \
+                    self.get_static_endpoints(state.app)
+            if endpoint in static_endpoints:
+                return True
+        return self._get_endpoint_roles(state).get(endpoint)
+
+    def _get_endpoint_roles(self, state):
+        """Return the roles declared for the endpoints of the app (see
+        get_endpoint_roles), computed on first use.
+        """
+        endpoint_roles = state.endpoint_roles
+        if endpoint_roles is None:
+            endpoint_roles = state.endpoint_roles = \
+                self.get_endpoint_roles(state.app)
+        return endpoint_roles
+
+    def _check_user(self, current_user):
+        """Check the type of a loaded user and return it, or None for an
+        anonymous user.
+        """
+        if current_user is not None and not isinstance(
+            current_user, (self._user_model, anonymous_model)
+        ):
+            raise TypeError("{user} is not an instance of {model}".format(
+                user=current_user, model=self._user_model
+            ))
+        if not current_user or not _is_authenticated(current_user):
+            return None
+        return current_user
+
+    def _is_request_allowed(self, state):
+        """Return whether the current user can access the current request.
+        """
+        declared_roles = self._get_declared_access(state)
+        if declared_roles is True:
+            return True
+
+        current_user = self._check_user(self._load_current_user())
+        tenant = None
+        if self._tenant_resolver is not None:
+            tenant = self._tenant_resolver()
+        if declared_roles is not None:
+            return not declared_roles.isdisjoint(self._expand_roles(
+                self._get_role_closure(state),
+                self._get_user_roles(
+                    current_user, state.anonymous_role_name, state, tenant
+                )
+            ))
+        method = state.method_alternates.get(request.method, request.method)
+        if tenant is not None:
+            return self._check_permission_against_policy(
+                state, self.get_tenant_policy(tenant, state.app), method,
+                request.path, current_user, state.anonymous_role_name, tenant
+            )
+        return self._check_permission(
+            method,
+            request.path,
+            current_user,
+            state.role_route_config,
+            anonymous_role_name=state.anonymous_role_name
+        )
+
+    def allow_roles(self, *role_names):
+        """
+        Decorator declaring the roles which can access a view, whatever the
+        path and method. Requests to its endpoint are then decided by
+        intersecting these roles with the roles of the user, without matching
+        the rules of the policy. The Anonymous Role can be one of them.
+        Example::
+            @app.route('/reports/<int:report_id>')
+            @rrbac.allow_roles('admin', 'super_admin')
+            def report(report_id):
+                ...
+
+        :param role_names: names of the roles
+        """
+        def decorator(f):
+            f.rrbac_roles = frozenset(role_names)
+            return f
+        return decorator
+
+    def allow_anonymous(self, f):
+        """
+        Decorator declaring a view every user can access. Requests to its
+        endpoint are allowed without loading the user.
+        Example::
+            @app.route('/health')
+            @rrbac.allow_anonymous
+            def health():
+                ...
+
+        :param f: view function
+        """
+        f.rrbac_roles = True
+        return f
+
+    def get_endpoint_roles(self, app):
+        """
+        Return the roles declared with allow_roles (a frozenset) or
+        allow_anonymous (True) for the endpoints of the app.
+        :param app: Flask object
+        """
+        endpoint_roles = {}
+        for endpoint, view in app.view_functions.items():
+            roles = getattr(view, 'rrbac_roles', None)
+            if roles is not None:
+                endpoint_roles[endpoint] = roles
+        return endpoint_roles
+
+    def get_static_endpoints(self, app):
+        """
+        Return the endpoints serving the static folders of the app and of its
+        blueprints (`static` and `<blueprint>.static`).
+        :param app: Flask object
+        """
+        return frozenset(
+            rule.endpoint for rule in app.url_map.iter_rules()
+            if rule.endpoint == 'static' or
+            rule.endpoint.endswith('.static')
+        )
+
+    def is_rule_matched(self, path, rule_to_match, engine='re', guard=None):
+        """
+        This function matches the incoming path against the user's rules.
+
+        This funtion determines whether the rule selected matches the incoming
+        url. If the url matches the specified pattern, the function evaluates
+        to True. Else False. Rules in the Werkzeug rule syntax
+        (`/orders/<int:order_id>`) are matched with Werkzeug's router.
+
+        Inputs:
+            :param path: (type: str) the url hit
+            :param rule_to_match: (type: str)
+            the pattern which the user has access to
+            :param engine: (type: str) regex rule engine (see
+            RRBAC_RULE_ENGINE)
+            :param guard: (type: str) what to do with rules prone to
+            catastrophic backtracking (see RRBAC_UNSAFE_RULES)
+        Output:
+            Boolean
+        """
+        if is_werkzeug_rule(rule_to_match):
+            return match_werkzeug_rule(rule_to_match, path)
+        regex_object = compile_rule_cached(
+            rule_to_match, engine, guard
+        ).match(path)
+        if not regex_object:
+            return False
+        return regex_object.group() == path
+
+    def _check_permission_against_config(
+        self, method, path, user, role_route_config, anonymous_role_name
+    ):
+        """
+        This function checks whether the user is allowed to access the incoming
+        request.
+
+        The following things are evaluated when checking the user mapping:
+        1. user role map entry is valid
+        2. there is at least 1 route in user role map entries whose regex
+        matches the incoming path
+        3. the match rule entry and the method of the path are the same
+
+        Returns True when the user is allowed to access that request.
+        False otherwise.
+
+        Input:
+            :param method: (type: str) Http method of the incoming request
+            :param path: (type: str) Path of the incoming request
+            :param user: (type: UserMixin) Current user
+            :param role_route_config: (type: dict) Dict for role route mapping
+            :param anonymous_role_name: (type: str) Name of the Anonymous Role
+
+        Output:
+            Boolean
+        """
+        state = self._get_state()
+        if role_route_config is state.role_route_config and \
+                anonymous_role_name == state.anonymous_role_name:
+            policy = self._get_policy(state)
+        else:
+            policy = shared_policy(
+                role_route_config, anonymous_role_name, lazy=True,
+                engine=state.rule_engine, guard=state.unsafe_rules,
+                minimize=state.minimize_policy,
+                role_hierarchy=state.role_hierarchy
+            )
+        return self._check_permission_against_policy(
+            state, policy, method, path, user, anonymous_role_name
+        )
+
+    def _check_permission_against_policy(
+        self, state, policy, method, path, user, anonymous_role_name,
+        tenant=None
+    ):
+        """
+        This function checks whether the user is allowed to access the incoming
+        request, according to a compiled policy.
+
+        Input:
+            :param state: (type: _RoleRouteBasedACLState) State of the app
+            :param policy: (type: CompiledPolicy) Compiled policy
+            :param method: (type: str) Http method of the incoming request
+            :param path: (type: str) Path of the incoming request
+            :param user: (type: UserMixin) Current user
+            :param anonymous_role_name: (type: str) Name of the Anonymous Role
+            :param tenant: (type: str) Tenant whose roles the user has
+
+        Output:
+            Boolean
+        """
+        return self._check_many_against_policy(
+            state, policy, [(method, path)], user, anonymous_role_name,
+            tenant=tenant
+        )[0]
+
+    def _check_many_against_policy(
+        self, state, policy, checks, user, anonymous_role_name, roles=None,
+        tenant=None
+    ):
+        """
+        This function checks whether the user is allowed to access each of
+        the (method, path) pairs, according to a compiled policy.
+
+        When the app's endpoint permission table has an entry for a pair, the
+        decision is a single mask intersection. The roles of the user are
+        loaded at most once, and not at all when the Anonymous Role is allowed
+        everywhere.
+        Otherwise the rules of the user's roles are matched against the path.
+
+        Input:
+            :param state: (type: _RoleRouteBasedACLState) State of the app
+            :param policy: (type: CompiledPolicy) Compiled policy
+            :param checks: (type: list) (method, path) pairs
+            :param user: (type: UserMixin) Current user
+            :param anonymous_role_name: (type: str) Name of the Anonymous Role
+            :param roles: (type: iterable) Role names of the user, loaded from
+            the user when None
+            :param tenant: (type: str) Tenant whose roles the user has
+
+        Output:
+            list of Boolean
+        """
+        endpoint_table = state.endpoint_table if policy is state.policy else {}
+        results = []
+        mask = None
+        for method, path in checks:
+            allowed_mask = endpoint_table.get((method, path))
+            if allowed_mask is not None and \
+                    allowed_mask & policy.anonymous_mask:
+                if policy.sample_rate:
+                    policy.sample(policy.anonymous_mask, method, path)
+                results.append(True)
+                continue
+            if mask is None:
+                if roles is None:
+                    roles = self._get_user_roles(
+                        user, anonymous_role_name, state, tenant
+                    )
+                mask = policy.role_mask(roles)
+            if allowed_mask is not None:
+                if policy.sample_rate:
+                    policy.sample(mask, method, path)
+                results.append(bool(mask & allowed_mask))
+            else:
+                results.append(policy.is_allowed(mask, method, path))
+        return results
+
+    def _check_many_against_db(
+        self, checks, user, anonymous_role_name, roles=None
+    ):
+        """
+        This function checks whether the user is allowed to access each of
+        the (method, path) pairs, with a single query for the rules of the
+        user for all of them.
+
+        Input:
+            :param checks: (type: list) (method, path) pairs
+            :param user: (type: UserMixin) Current user
+            :param anonymous_role_name: (type: str) Name of the Anonymous Role
+            :param roles: (type: iterable) Role names of the user, the roles
+            of the user are joined in the query when None
 
-    def init_app(self, app):
-        """Initialize application in Flask-RRBAC.
-        Adds (RRBAC, app) to flask extensions.
-        Adds hook to authenticate permission before request.
+        Output:
+            list of Boolean
+        """
+        state = self._get_state()
+        rules_by_method = {}
+        for method, rule in self._get_user_rules_from_db(
+            list(set(method for method, _ in checks)), user,
+            anonymous_role_name, roles
+        ):
+            rules_by_method.setdefault(method, []).append(rule)
+        return [
+            any(
+                self.is_rule_matched(
+                    path, rule, state.rule_engine, state.unsafe_rules
+                )
+                for rule in rules_by_method.get(method, ())
+            )
+            for method, path in checks
+        ]
+
+    def check_many(self, user, checks, app=None, roles=None):
+        """
+        Return whether the user can access each of the (method, path) pairs,
+        e.g. to render only the links of a menu the user can follow.
+
+        The roles of the user are loaded once for all the pairs, and in DB
+        mode the rules of the user are fetched with a single query.
+        It does not need a request context and is safe to call from any
+        thread.
+        Example::
+            can_view, can_edit = rrbac.check_many(
+                current_user, [('GET', '/orders'), ('POST', '/orders')]
+            )
+
+        :param user: user to check, None for an anonymous user
+        :param checks: iterable of (method, path) pairs
         :param app: Flask object
+        :param roles: role names of the user, when already known. The user is
+        then not used at all.
+        Output:
+            list of Boolean, in the order of checks
         """
-        
-        self.app = app
-        self.role_route_config = app.config.get(
-            'RRBAC_ROLE_ROUTE_MAP', RRBAC_ROLE_ROUTE_MAP
-        )
-        # self.allow_static = app.config.get(
-        #     'RRBAC_ALLOW_STATIC', RRBAC_ALLOW_STATIC
-        # )
-        self.anonymous_role_name = app.config.get(
-            'RRBAC_ANONYMOUS_ROLE', RRBAC_ANONYMOUS_ROLE
-        )
-        self.method_alternates = self.app.config.get(
-            'RRACL_METHOD_ALTERNATES', RRACL_METHOD_ALTERNATES
+        state = self._get_state(app)
+        checks = [
+            (state.method_alternates.get(method, method), path)
+            for method, path in checks
+        ]
+        if not checks:
+            return []
+        if roles is None and user is not None and \
+                not _is_authenticated(user):
+            user = None
+        return self._call_in_app_context(
+            state.app, self._check_many, state, checks, user, roles
         )
-        # self.static_rules = self.get_static_rules(app.url_map.iter_rules())
-        # app.before_request(self._authenticate)
 
-    def as_role_model(self, model_cls):
-        """A decorator to set custom model or role.
-        :param model_cls: Model of role.
+    def _call_in_app_context(self, app, function, *args):
+        """Call the function in an application context of the app, pushing
+        one only when the app is not the current one.
         """
-        self._role_model = model_cls
-        return model_cls
+        if _current_app() is app:
+            return function(*args)
+        with app.app_context():
+            return function(*args)
 
-    def as_route_model(self, model_cls):
-        """A decorator to set custom model or route.
-        :param model_cls: Model of route.
+    @contextmanager
+    def _app_context(self, app):
+        """Push an application context of the app for the duration of the
+        block, unless the app is the current one.
         """
-        self._route_model = model_cls
-        return model_cls
+        if _current_app() is app:
+            yield
+        else:
+            with app.app_context():
+                yield
 
-    def as_user_model(self, model_cls):
-        """A decorator to set custom model or user.
-        :param model_cls: Model of user.
-        """
-        self._user_model = model_cls
-        return model_cls
+    def _check_many(self, state, checks, user, roles):
+        """Dispatch check_many to the compiled policy or the DB."""
+        anonymous_role_name = state.anonymous_role_name
+        policy = self._get_policy(state)
+        if policy is None:
+            return self._check_many_against_db(
+                checks, user, anonymous_role_name, roles
+            )
+        return self._check_many_against_policy(
+            state, policy, checks, user, anonymous_role_name, roles
+        )
 
-    def as_user_role_map_model(self, model_cls):
-        """A decorator to set custom model or user_role_map.
-        :param model_cls: Model of user_role_map.
+    def can(self, user, method, path, app=None, roles=None):
         """
-        self._user_role_map_model = model_cls
-        return model_cls
+        Return whether the user can access the path with the method.
 
-    def as_role_route_map_model(self, model_cls):
-        """A decorator to set custom model or role_route_map.
-        :param model_cls: Model of role_route_map.
+        Unlike _authenticate, it needs neither a request nor an application
+        context, so it can be used from background workers and scripts. It
+        shares the compiled policy and the role cache of the app.
+        Example::
+            if rrbac.can(user, 'POST', '/payments/42', app=app):
+                ...
+
+        :param user: user to check, None for an anonymous user
+        :param method: Http method
+        :param path: Path to check
+        :param app: Flask object
+        :param roles: role names of the user, when already known (e.g. for
+        batch jobs). The user is then not loaded at all.
         """
-        self._role_route_map_model = model_cls
-        return model_cls
+        return self.check_many(user, [(method, path)], app, roles)[0]
 
-    def set_role_model(self, model_class):
-        """Decorator to set a custom model for roles.
-        :param model_class: Model of role.
+    def accessible_routes(self, user, app=None, roles=None):
         """
-        self._role_model = model_class
+        Return the rules of the app the user can access, with their methods.
+        Like can, it needs no request context.
 
-    def set_route_model(self, model_class):
-        """Decorator to set a custom model for routes.
-        :param model_class: Model of route.
+        With a compiled policy, the result is read from a role x (rule,
+        method) matrix built once from the app's url map (by warmup, or on
+        first use), and cached per distinct set of roles. In DB mode, all the
+        routes are checked with check_many. A rule with variables is
+        accessible when one of its sample paths is (see
+        matching.sample_paths).
+
+        :param user: user to check, None for an anonymous user
+        :param app: Flask object
+        :param roles: role names of the user, when already known
+        Output:
+            dict of rule -> set of methods
         """
-        self._route_model = model_class
+        state = self._get_state(app)
+        policy = self._get_policy(state)
+        if policy is None:
+            checks = [
+                (rule, method, path)
+                for rule, methods in self.get_app_routes(state.app).items()
+                for method in methods
+                for path in set([rule] + sample_paths(rule))
+            ]
+            allowed = {}
+            for (rule, method, _), result in zip(checks, self.check_many(
+                user, [(method, path) for _, method, path in checks],
+                state.app, roles
+            )):
+                if result:
+                    allowed.setdefault(rule, set()).add(method)
+            return allowed
+        route_matrix = state.route_matrix
+        if route_matrix is None or route_matrix.policy is not policy:
+            with state.lock:
+                route_matrix = self._build_route_matrix(state, policy)
+        if roles is None:
+            if user is not None and not _is_authenticated(user):
+                user = None
+            roles = self._call_in_app_context(
+                state.app, self._get_user_roles, user,
+                state.anonymous_role_name, state
+            )
+        return dict(
+            (rule, set(methods)) for rule, methods in
+            route_matrix.accessible_routes(policy.role_mask(roles)).items()
+        )
 
-    def set_user_model(self, model_class):
-        """Decorator to set a custom model for users.
-        :param model_class: Model of user.
+    def allowed_routes(self, user, app=None, roles=None):
         """
-        self._user_model = model_class
+        Same as accessible_routes.
+        """
+        return self.accessible_routes(user, app, roles)
 
-    def set_user_role_map_model(self, model_class):
-        """Decorator to set a custom model for user_role_map.
-        :param model_class: Model of user_role_map.
+    def roles_for_route(self, method, path, app=None):
         """
-        self._user_role_map_model = model_class
+        Return the names of the roles which can access the path with the
+        method. When the Anonymous Role is one of them, every user can.
 
-    def set_role_route_map_model(self, model_class):
-        """Decorator to set a custom model for role_route_map.
-        :param model_class: Model of role_route_map.
+        With a compiled policy, the endpoint permission table or the reverse
+        index of the policy (rule -> roles having it) is used. In DB mode, the
+        rules of the method are fetched and matched.
+
+        :param method: Http method
+        :param path: Path to check
+        :param app: Flask object
+        Output:
+            set of role names
         """
-        self._role_route_map_model = model_class
+        state = self._get_state(app)
+        method = state.method_alternates.get(method, method)
+        policy = self._get_policy(state)
+        if policy is not None:
+            mask = state.endpoint_table.get((method, path))
+            if mask is None:
+                mask = policy.match_mask(method, path)
+            return policy.roles_granted(mask)
+        return self._call_in_app_context(
+            state.app, self._roles_for_route_from_db, method, path
+        )
 
-    def set_user_loader(self, loader):
+    def _roles_for_route_from_db(self, method, path):
+        """Return the names of the roles having a rule matching the path in
+        the DB.
         """
-        Set the function used to load the user in context.
-        E.g.
-            from flask_login import current_user
-            rrbac.set_user_loader(lambda: current_user)
-        :param loader: Current user function.
+        rows = self._route_model.query.filter(
+            self._route_model.get_method == method
+        ).join(
+            self._role_route_map_model
+        ).filter(
+            self._role_route_map_model.is_deleted == (False)
+        ).join(
+            self._role_model
+        ).filter(
+            self._role_model.is_deleted == (False)
+        ).with_entities(
+            self._role_model.name, self._route_model.get_rule
+        ).distinct()
+        state = self._get_state()
+        roles = set(
+            role_name for role_name, rule in rows
+            if self.is_rule_matched(
+                path, rule, state.rule_engine, state.unsafe_rules
+            )
+        )
+        # Add the roles including one of them
+        for role_name, included in self._get_role_closure(state).items():
+            if not included.isdisjoint(roles):
+                roles.add(role_name)
+        return roles
+
+    def users_for_route(self, method, path, app=None, chunk_size=1000):
         """
-        self._user_loader = loader
+        Generate the users who can access the path with the method, i.e. the
+        users holding any of the roles of roles_for_route (every user when
+        the Anonymous Role can access it).
 
-    def set_auth_fail_hook(self, auth_fail_hook):
-        """Set auth_fail_hook which called when Authorization fails
-        If you haven't set any hook, Flask-RBACL will call::
-            abort(403)
-        :param auth_fail_hook: Hook function
+        Users are streamed from the user role map model chunk_size at a time,
+        so the whole result is never held in memory. The generator pushes an
+        application context when needed; consume it in a single thread.
+        Example::
+            for user in rrbac.users_for_route('POST', '/payments/1', app):
+                print(user.id)
+
+        :param method: Http method
+        :param path: Path to check
+        :param app: Flask object
+        :param chunk_size: number of users fetched per round trip
         """
-        self._auth_fail_hook = auth_fail_hook
+        state = self._get_state(app)
+        roles = self.roles_for_route(method, path, state.app)
+        if not roles:
+            return
+        with self._app_context(state.app):
+            users = self._user_model.query
+            if state.anonymous_role_name not in roles:
+                users = users.join(
+                    self._user_role_map_model
+                ).filter(
+                    self._user_role_map_model.is_deleted == (False)
+                ).join(
+                    self._role_model
+                ).filter(
+                    self._role_model.is_deleted == (False)
+                ).filter(
+                    self._role_model.name.in_(list(roles))
+                ).distinct()
+            for user in users.yield_per(chunk_size):
+                yield user
 
-    def get_app(self, reference_app=None):
-        """Helper method that implements the logic to look up an application.
+    def check_batch(
+        self, checks, app=None, processes=None, chunk_size=10000,
+        with_roles=False
+    ):
         """
-        if reference_app is not None:
-            return reference_app
-        if self.app is not None:
-            return self.app
-        ctx = connection_stack.top
-        if ctx is not None:
-            return ctx.app
-        raise RuntimeError('application not registered on rrbac '
-                           'instance and no application bound '
-                           'to current context')
+        Generate the result of each (user, method, path) check, in order, for
+        offline audits of large batches.
 
-    def _authenticate(self, f):
+        Checks are evaluated against the compiled policy chunk_size at a time,
+        grouped by set of roles. With processes, chunks are evaluated in a
+        process pool whose workers compile the policy once, and results are
+        still generated in order (see evaluate_batch). In DB mode without a
+        cached policy, a policy is compiled from the DB for the batch.
+        Roles are resolved in this process; for very large batches pass role
+        names instead of users (with_roles), e.g. from a dump of the user role
+        map.
+        Example::
+            checks = ((user, 'GET', path) for user, path in audit_rows())
+            for allowed in rrbac.check_batch(checks, app, processes=8):
+                ...
+
+        :param checks: iterable of (user, method, path), or of (role names,
+        method, path) with with_roles
+        :param app: Flask object
+        :param processes: number of worker processes, None for none
+        :param chunk_size: number of checks per chunk
+        :param with_roles: checks carry role names instead of users
         """
-        Decorator to perform the checks for whether the user has access to the
-        specific endpoint or not.
+        from .batch import evaluate_batch
 
-        If the user has the access, then he can proceed to the view function.
-        Otherwise, the auth_fail_hook is called.
+        state = self._get_state(app)
+        anonymous_role_name = state.anonymous_role_name
+        method_alternates = state.method_alternates
+        with self._app_context(state.app):
+            policy = self._get_policy(state)
+            if policy is None:
+                policy = CompiledPolicy(
+                    self._load_role_route_map_from_db(), anonymous_role_name,
+                    engine=state.rule_engine, guard=state.unsafe_rules,
+                    minimize=state.minimize_policy,
+                    role_hierarchy=self._get_role_hierarchy(state)
+                )
+                endpoint_table = {}
+            else:
+                endpoint_table = state.endpoint_table
 
-        To add the decorator on each endpoint, instead of manually attaching
-        the signature everywhere, the following can be done:
+            def role_checks():
+                for subject, method, path in checks:
+                    if not with_roles:
+                        if subject is not None and \
+                                not _is_authenticated(subject):
+                            subject = None
+                        subject = self._get_user_roles(
+                            subject, anonymous_role_name, state
+                        )
+                    yield subject, method_alternates.get(method, method), path
 
-            for mod, func in app.view_functions.iteritems():
-                app.view_functions[mod] = rrbac._authenticate(func)
+            for result in evaluate_batch(
+                role_checks(), policy, endpoint_table, processes, chunk_size
+            ):
+                yield result
 
-        The above two lines decorate all the view functions with the
-        _authenticate decorator. Please note that if this approach is adopted,
-        then make sure to add the above snippet AFTER all the view functions
-        have been attached to the application.
+    def export_matrix(
+        self, output, app=None, output_format='jsonl', chunk_size=1000,
+        processes=None
+    ):
+        """
+        Write the effective access matrix (user x rule x method) of every
+        user of the app, e.g. for access reviews. With Flask 0.11+ it is
+        also available as `flask rrbac export-matrix`.
 
-        :param f: Decorated Function
+        Users are streamed chunk_size at a time and grouped by identical set
+        of roles, so each distinct set is evaluated once, against a policy
+        compiled from the current role route map (see write_access_matrix
+        for the formats).
+        Example::
+            with open('matrix.jsonl', 'w') as output:
+                rrbac.export_matrix(output, app)
+
+        :param output: text file to write to
+        :param app: Flask object
+        :param output_format: jsonl or csv
+        :param chunk_size: number of users fetched per round trip
+        :param processes: evaluate the role sets in a pool of that many
+        processes
+        Output:
+            Number of users written
         """
-        @wraps(f)
-        def decorated_function(*args, **kwargs):
-            app = self.get_app()
-            assert app, INIIALIZATION_ERRORS['app']
-            assert self._role_model, INIIALIZATION_ERRORS['role']
-            assert self._user_model, INIIALIZATION_ERRORS['user']
-            if not self.role_route_config:
-                assert self._route_model, INIIALIZATION_ERRORS['route']
-                assert self._role_route_map_model, \
-                    INIIALIZATION_ERRORS['role_route_map']
-            assert self._user_role_map_model, \
-                INIIALIZATION_ERRORS['user_role_map']
-            assert self._user_loader, INIIALIZATION_ERRORS['user_loader']
+        state = self._get_state(app)
+        return self._call_in_app_context(
+            state.app, self._export_matrix, state, output, output_format,
+            chunk_size, processes
+        )
 
-            current_user = self._user_loader()
+    def _export_matrix(
+        self, state, output, output_format, chunk_size, processes
+    ):
+        from .export import write_access_matrix
 
-            # Compatible with flask-login anonymous user
-            if current_user and hasattr(current_user, '_get_current_object'):
-                current_user = current_user._get_current_object()
+        if state.policy_store is not None:
+            role_route_map = self._get_store_role_route_map(state)
+        elif state.role_route_config:
+            role_route_map = state.role_route_config
+        else:
+            role_route_map = self._load_role_route_map_from_db()
+        return write_access_matrix(
+            output, self._iter_user_role_sets(state, chunk_size),
+            role_route_map, state.anonymous_role_name,
+            self.get_app_routes(state.app), output_format, processes,
+            state.rule_engine, self._get_role_hierarchy(state),
+            state.unsafe_rules
+        )
 
-            if current_user is not None and not isinstance(
-                current_user, (self._user_model, anonymous_model)
-            ):
-                raise TypeError("{user} is not an instance of {model}".format(
-                    current_user, self._user_model.__class__
-                ))
-            method = self.method_alternates.get(request.method, request.method)
-            # if self.allow_static and self.is_static_fetch_endpoint(
-            #     method,
-            #     request.url_rule.rule
-            # ):
-            #     result = True
-            if current_user and current_user.is_authenticated():
-                result = self._check_permission(
-                    method,
-                    request.path,
-                    current_user,
-                    self.role_route_config,
-                    anonymous_role_name=self.anonymous_role_name
+    def _iter_user_role_sets(self, state, chunk_size):
+        """
+        Generate chunks of (user id, frozenset of role names) of every user,
+        ordered by user id. Users are paged by id rather than with a server
+        side cursor, so that the roles of each page can be queried on the
+        same connection.
+        """
+        anonymous_roles = frozenset([state.anonymous_role_name])
+        user_id = self._user_model.get_id
+        last_id = None
+        while True:
+            users = self._user_model.query.order_by(user_id)
+            if last_id is not None:
+                users = users.filter(user_id > last_id)
+            users = users.limit(chunk_size).all()
+            if not users:
+                return
+            last_id = users[-1].id
+            if self._role_loader is None and state.policy_store is None:
+                user_roles = self._load_roles_of_users(
+                    [user.id for user in users]
                 )
             else:
-                result = self._check_permission(
-                    method,
-                    request.path,
-                    None,
-                    self.role_route_config,
-                    anonymous_role_name=self.anonymous_role_name
+                user_roles = dict(
+                    (user.id, self._load_user_roles(user, state))
+                    for user in users
                 )
-            if not result:
-                return self._auth_fail_hook_caller()
-            else:
-                return f(*args, **kwargs)
-        return decorated_function
-
-    # def get_static_rules(rules_iterable):
-    #     return [
-    #         item.rule for item in rules_iterable
-    #         if not item.methods - {'GET', 'HEAD', 'OPTIONS'} and
-    #         re.match('.*static*<path:filename>$', item.rule)
-    #     ]
+            yield [
+                (user.id, frozenset(user_roles.get(user.id, ())) |
+                 anonymous_roles)
+                for user in users
+            ]
 
-    # def is_static_fetch_endpoint(self, method, requested_rule):
-    #     if method != 'GET':
-    #         return False
-    #     for rule in self.static_rules:
-    #         if requested_rule == rule:
-    #             return True
-    #     return False
-
-    def is_rule_matched(self, path, rule_to_match):
+    def _load_roles_of_users(self, user_ids):
+        """Return user id -> names of the active roles of the users, with a
+        single query.
         """
-        This function matches the incoming path against the user's rules.
+        rows = self._role_model.query.filter(
+            self._role_model.is_deleted == (False)
+        ).join(
+            self._user_role_map_model
+        ).filter(
+            self._user_role_map_model.is_deleted == (False)
+        ).join(
+            self._user_model
+        ).filter(
+            self._user_model.get_id.in_(user_ids)
+        ).with_entities(
+            self._user_model.get_id, self._role_model.name
+        ).distinct()
+        user_roles = {}
+        for user_id, role_name in rows:
+            user_roles.setdefault(user_id, set()).add(role_name)
+        return user_roles
 
-        This funtion determines whether the rule selected matches the incoming
-        url. If the url matches the specified pattern, the function evaluates
-        to True. Else False.
+    def allowed_links(self, links, user=None):
+        """
+        Template helper, available as `rrbac_allowed_links`, which checks all
+        the links of a page at once. Links are either paths (for GET) or
+        (method, path) pairs.
+        Example::
+            {% set allowed = rrbac_allowed_links(['/orders', '/users']) %}
+            {% if allowed['/orders'] %}<a href="/orders">Orders</a>{% endif %}
 
-        Inputs:
-            :param path: (type: str) the url hit
-            :param rule_to_match: (type: str)
-            the pattern which the user has access to
+        :param links: iterable of paths or (method, path) pairs
+        :param user: user to check, the current user by default
         Output:
-            Boolean
+            dict of link -> Boolean
         """
-        regex_object = re.match(rule_to_match, path)
-        if not regex_object:
-            return False
-        return regex_object.group() == path
+        links = [
+            tuple(link) if isinstance(link, (tuple, list)) else link
+            for link in links
+        ]
+        if user is None:
+            user = self._load_current_user()
+        results = self.check_many(user, [
+            link if isinstance(link, tuple) else ('GET', link)
+            for link in links
+        ])
+        return dict(zip(links, results))
 
-    def _check_permission_against_config(
-        self, method, path, user, role_route_config, anonymous_role_name
+    def _get_user_roles(
+        self, user, anonymous_role_name, state=None, tenant=None
     ):
         """
-        This function checks whether the user is allowed to access the incoming
-        request.
+        Return the names of the active roles of the user, along with the
+        Anonymous Role which every user has. The roles are served from the
+        role cache of the app when RRBAC_ROLE_CACHE_TTL is set.
 
-        The following things are evaluated when checking the user mapping:
-        1. user role map entry is valid
-        2. there is at least 1 route in user role map entries whose regex
-        matches the incoming path
-        3. the match rule entry and the method of the path are the same
+        Input:
+            :param user: (type: UserMixin) Current user
+            :param anonymous_role_name: (type: str) Name of the Anonymous Role
+            :param state: (type: _RoleRouteBasedACLState) State of the app
+            :param tenant: (type: str) Tenant to load the roles of, None
+            outside of per-tenant policies
 
-        Returns True when the user is allowed to access that request.
-        False otherwise.
+        Output:
+            set of role names
+        """
+        if not user:
+            return set([anonymous_role_name])
+        if state is None:
+            state = self._get_state()
+        role_cache = state.role_cache
+        if role_cache is not None:
+            self._poll_invalidations(state)
+        if role_cache is None or (
+            state.policy_store is not None and tenant is None
+        ):
+            roles = set(self._load_user_roles(user, state, tenant))
+        else:
+            cached_roles = role_cache.get(user.id, tenant)
+            if cached_roles is None:
+                cached_roles = frozenset(
+                    self._load_user_roles(user, state, tenant)
+                )
+                role_cache.set(user.id, cached_roles, tenant)
+            roles = set(cached_roles)
+        roles.add(anonymous_role_name)
+        return roles
+
+    def _load_user_roles(self, user, state, tenant=None):
+        """
+        Load the names of the active roles of the user from the role loader,
+        the policy store or the DB.
+
+        With a tenant, the role loader is called with the tenant as second
+        argument, and in the DB only the roles whose tenant_id column is the
+        tenant are loaded, so that the roles a user holds in a tenant grant
+        nothing in the others. Role models without a tenant_id column (with
+        RRBAC_TENANT_POLICY_DIR) hold roles shared by every tenant.
 
         Input:
-            :param method: (type: str) Http method of the incoming request
-            :param path: (type: str) Path of the incoming request
             :param user: (type: UserMixin) Current user
-            :param role_route_config: (type: dict) Dict for role route mapping
-            :param anonymous_role_name: (type: str) Name of the Anonymous Role
+            :param state: (type: _RoleRouteBasedACLState) State of the app
+            :param tenant: (type: str) Tenant to load the roles of
 
         Output:
-            Boolean
+            iterable of role names
         """
-        user_roles = []
-        if user:
-            user_roles = self._role_model.query.filter(
-                self._role_model.is_deleted == (False)
-            ).join(
-                self._user_role_map_model
-            ).filter(
-                self._user_role_map_model.is_deleted == (False)
-            ).join(
-                self._user_model
-            ).filter(
-                self._user_model.get_id == user.id
-            ).with_entities(self._role_model.name).distinct().all()
-        user_roles += [(anonymous_role_name,)]
-        roles = set([r[0] for r in user_roles])
-
-        for user_role in roles:
-            regexes = role_route_config.get(user_role, {}).get(method, [])
-            for regex in regexes:
-                if self.is_rule_matched(path, regex):
-                    return True
-        return False
+        if self._role_loader is not None:
+            if tenant is not None:
+                return self._role_loader(user, tenant)
+            return self._role_loader(user)
+        tenant_column = None
+        if tenant is not None:
+            tenant_column = getattr(self._role_model, 'tenant_id', None)
+        if state.policy_store is not None and tenant_column is None:
+            return state.policy_store.get_roles(user.id)
+        user_roles = self._role_model.query.filter(
+            self._role_model.is_deleted == (False)
+        )
+        if tenant_column is not None:
+            user_roles = user_roles.filter(tenant_column == tenant)
+        user_roles = user_roles.join(
+            self._user_role_map_model
+        ).filter(
+            self._user_role_map_model.is_deleted == (False)
+        ).join(
+            self._user_model
+        ).filter(
+            self._user_model.get_id == user.id
+        ).with_entities(self._role_model.name).distinct().all()
+        return [r[0] for r in user_roles]
 
     def _check_permission_against_db(
         self, method, path, user, anonymous_role_name
@@ -395,8 +2215,49 @@ class RoleRouteBasedACL(object):
         Output:
             Boolean
         """
+        state = self._get_state()
+        if state.cache_db_policy and \
+                anonymous_role_name == state.anonymous_role_name:
+            return self._check_permission_against_policy(
+                state, self._get_policy(state), method, path, user,
+                anonymous_role_name
+            )
+
+        user_rules = self._get_user_rules_from_db(
+            [method], user, anonymous_role_name
+        )
+        for _, user_rule in user_rules:
+            if self.is_rule_matched(
+                path, user_rule, state.rule_engine, state.unsafe_rules
+            ):
+                return True
+        return False
+
+    def _get_user_rules_from_db(
+        self, methods, user, anonymous_role_name, roles=None
+    ):
+        """
+        Build the query of the distinct (method, rule) pairs the user (and the
+        Anonymous Role) has access to, for the given methods.
+
+        Input:
+            :param methods: (type: list) Http methods to fetch the rules of
+            :param user: (type: UserMixin) Current user
+            :param anonymous_role_name: (type: str) Name of the Anonymous Role
+            :param roles: (type: iterable) Role names to fetch the rules of
+            instead of the roles of the user
+
+        Output:
+            Query of (method, rule) rows
+        """
+        state = self._get_state()
+        closure = self._get_role_closure(state)
+        if closure:
+            if roles is None:
+                roles = self._get_user_roles(user, anonymous_role_name, state)
+            roles = self._expand_roles(closure, roles)
         all_rules = self._route_model.query.filter(
-            self._route_model.get_method == method
+            self._route_model.get_method.in_(methods)
         ).join(
             self._role_route_map_model
         ).filter(
@@ -406,6 +2267,15 @@ class RoleRouteBasedACL(object):
         ).filter(
             self._role_model.is_deleted == (False)
         )
+        if roles is not None:
+            user_rules = all_rules.filter(
+                self._role_model.name.in_(
+                    list(set(roles) | set([anonymous_role_name]))
+                )
+            )
+            return user_rules.with_entities(
+                self._route_model.get_method, self._route_model.get_rule
+            ).distinct()
         user_rules = all_rules.filter(
             self._role_model.name == anonymous_role_name
         )
@@ -419,15 +2289,13 @@ class RoleRouteBasedACL(object):
             ).filter(
                 self._user_model.get_id == user.id
             ).union(user_rules)
-        user_rules = \
-            user_rules.with_entities(self._route_model.get_rule).distinct()
-        for user_rule in user_rules:
-            if self.is_rule_matched(path, user_rule[0]):
-                return True
-        return False
+        return user_rules.with_entities(
+            self._route_model.get_method, self._route_model.get_rule
+        ).distinct()
 
     def _check_permission(
-        self, method, path, user, role_route_config={}, anonymous_role_name=''
+        self, method, path, user, role_route_config=None,
+        anonymous_role_name=''
     ):
         """Return does the current user can access the resource.
         Example::
@@ -443,6 +2311,12 @@ class RoleRouteBasedACL(object):
         :param anonymous_role_name: Role for anonymous users. This should be
         the same as the name of the corresponding role in db/config
         """
+        state = self._get_state()
+        if state.policy_store is not None:
+            return self._check_permission_against_policy(
+                state, self._get_policy(state), method, path, user,
+                anonymous_role_name
+            )
         if role_route_config:
             return self._check_permission_against_config(
                 method, path, user, role_route_config, anonymous_role_name
@@ -454,12 +2328,13 @@ class RoleRouteBasedACL(object):
         return False
 
     def get_app_routes(self, app):
+        method_alternates = self._get_state(app).method_alternates
         rule_dict = {}
         for rule in app.url_map.iter_rules():
             rule_dict[rule.rule] = set()
             for method in rule.methods:
                 rule_dict[rule.rule].add(
-                    self.method_alternates.get(method, method)
+                    method_alternates.get(method, method)
                 )
         return rule_dict
 
@@ -470,3 +2345,11 @@ class RoleRouteBasedACL(object):
             return self._auth_fail_hook()
         else:
             abort(403)
+
+
+if sys.version_info < (3, 7):
+    # Keep a reference to the original module, its globals are used by the
+    # functions defined above.
+    _original_module = sys.modules[__name__]
+    _lazy_module = sys.modules[__name__] = _LazyModule(__name__)
+    _lazy_module.__dict__.update(_original_module.__dict__)
@@ -0,0 +1,218 @@
+# -*-coding: utf-8
+"""
+    flask_rrbac.aio
+    ~~~~~~~~~~~~~
+    The asyncio authorization path: coroutines behind the async methods of
+    RoleRouteBasedACL. The module needs Python 3.7+ and is only imported by
+    those methods. Blocking work (DB queries, sync loaders, policy builds)
+    runs in the default executor of the running loop.
+"""
+
+import asyncio
+import contextvars
+import inspect
+from functools import partial, wraps
+
+from flask import request
+
+
+async def maybe_await(value):
+    """Return value, awaiting it first when it is awaitable."""
+    if inspect.isawaitable(value):
+        return await value
+    return value
+
+
+async def run_blocking(function, *args):
+    """
+    Run a blocking function in the default executor of the running loop,
+    with the context variables (Flask contexts) of the caller.
+    :param function: function to run
+    """
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        None, partial(context.run, function, *args)
+    )
+
+
+async def run_in_app(acl, state, function, *args):
+    """Run a blocking function in the executor within an application context
+    of the app of the state.
+    """
+    return await run_blocking(
+        acl._call_in_app_context, state.app, function, *args
+    )
+
+
+class InFlight(object):
+    """Loads in progress by key, so that the tasks of an event loop missing
+    the same key at the same time await a single load.
+    """
+
+    def __init__(self):
+        self._pending = {}
+
+    def get(self, key, load):
+        """
+        Return the task of the load of key, starting it with load() when
+        none is in progress in the running loop.
+        :param key: hashable key, e.g. a user id
+        :param load: coroutine function
+        """
+        loop = asyncio.get_running_loop()
+        pending_key = (loop, key)
+        task = self._pending.get(pending_key)
+        if task is None:
+            task = self._pending[pending_key] = loop.create_task(load())
+            task.add_done_callback(
+                lambda _: self._pending.pop(pending_key, None)
+            )
+        return task
+
+
+def authenticate(acl, f):
+    """Wrap a view in a coroutine function which checks the current request
+    before awaiting the view (see RoleRouteBasedACL.authenticate_async).
+    """
+    @wraps(f)
+    async def decorated_function(*args, **kwargs):
+        state = acl._get_state()
+        if not state.enforce and not await is_request_allowed(acl, state):
+            return await maybe_await(acl._auth_fail_hook_caller())
+        return await maybe_await(f(*args, **kwargs))
+    return decorated_function
+
+
+async def load_current_user(acl):
+    """Load the current user with the async user loader, or with the user
+    loader in the executor. Return None for an anonymous user.
+    """
+    if acl._async_user_loader is None:
+        current_user = await run_blocking(acl._load_current_user)
+    else:
+        # A current_user proxy passes for an awaitable: unwrap it first
+        current_user = await maybe_await(
+            acl._unwrap_user(acl._async_user_loader())
+        )
+    return acl._check_user(acl._unwrap_user(current_user))
+
+
+async def is_request_allowed(acl, state):
+    """Return whether the current user can access the current request."""
+    if not state.validated:
+        acl.validate(state.app)
+    declared_roles = acl._get_declared_access(state)
+    if declared_roles is True:
+        return True
+    tenant = None
+    if acl._tenant_resolver is not None:
+        tenant = acl._tenant_resolver()
+    if declared_roles is not None:
+        roles = await get_user_roles(
+            acl, state, await load_current_user(acl), tenant
+        )
+        if state.uses_compiled_policy:
+            closure = (await get_policy(acl, state)).role_closure
+        else:
+            acl._poll_invalidations(state)
+            closure = state.role_closure
+            if closure is None:
+                closure = await run_in_app(
+                    acl, state, acl._get_role_closure, state
+                )
+        return not declared_roles.isdisjoint(
+            acl._expand_roles(closure, roles)
+        )
+    method = state.method_alternates.get(request.method, request.method)
+    return await check_permission(
+        acl, state, method, request.path, partial(load_current_user, acl),
+        tenant=tenant
+    )
+
+
+async def get_policy(acl, state, tenant=None):
+    """Return the policy deciding a check: the policy of the tenant, the
+    compiled policy of the app, or None in DB mode without a cached policy.
+    Policies which are not built yet are built in the executor.
+    """
+    if tenant is not None:
+        return await run_blocking(acl.get_tenant_policy, tenant, state.app)
+    if not state.uses_compiled_policy:
+        return None
+    acl._poll_invalidations(state)
+    if state.policy is not None and state.policy_store is None and \
+            not acl._policy_expired(state):
+        return state.policy
+    return await run_in_app(acl, state, acl._get_policy, state)
+
+
+async def check_permission(
+    acl, state, method, path, load_user, roles=None, tenant=None
+):
+    """
+    Decide a check, calling load_user (which may return an awaitable) only
+    when the decision needs the roles of the user. Without a compiled
+    policy the rules of the user are queried from the DB in the executor.
+    """
+    anonymous_role_name = state.anonymous_role_name
+    policy = await get_policy(acl, state, tenant)
+    if policy is not None and policy is state.policy:
+        allowed_mask = state.endpoint_table.get((method, path))
+        if allowed_mask is not None and \
+                allowed_mask & policy.anonymous_mask:
+            return True
+    if roles is None:
+        user = await maybe_await(load_user())
+        if policy is None and acl._async_role_loader is None:
+            # The roles of the user are joined in the query of the rules
+            return (await run_in_app(
+                acl, state, acl._check_many_against_db, [(method, path)],
+                user, anonymous_role_name
+            ))[0]
+        roles = await get_user_roles(acl, state, user, tenant)
+    if policy is None:
+        return (await run_in_app(
+            acl, state, acl._check_many_against_db, [(method, path)], None,
+            anonymous_role_name, roles
+        ))[0]
+    return acl._check_many_against_policy(
+        state, policy, [(method, path)], None, anonymous_role_name, roles
+    )[0]
+
+
+async def get_user_roles(acl, state, user, tenant=None):
+    """
+    Return the names of the roles of the user in the tenant, along with the
+    Anonymous Role. Cached roles are returned without leaving the loop.
+    Otherwise the roles are loaded with the async role loader (called with
+    the tenant as second argument when there is one), once for all the
+    tasks missing the same user, or with the sync loaders in the executor.
+    """
+    anonymous_role_name = state.anonymous_role_name
+    if not user:
+        return set([anonymous_role_name])
+    role_cache = state.role_cache
+    if role_cache is not None:
+        acl._poll_invalidations(state)
+        cached_roles = role_cache.get(user.id, tenant)
+        if cached_roles is not None:
+            return set(cached_roles) | set([anonymous_role_name])
+    if acl._async_role_loader is None:
+        return await run_in_app(
+            acl, state, acl._get_user_roles, user, anonymous_role_name,
+            state, tenant
+        )
+    if state.role_loads is None:
+        state.role_loads = InFlight()
+
+    async def load():
+        if tenant is not None:
+            role_names = acl._async_role_loader(user, tenant)
+        else:
+            role_names = acl._async_role_loader(user)
+        role_names = frozenset(await maybe_await(role_names))
+        if role_cache is not None:
+            role_cache.set(user.id, role_names, tenant)
+        return role_names
+    role_names = await state.role_loads.get((tenant, user.id), load)
+    return set(role_names) | set([anonymous_role_name])
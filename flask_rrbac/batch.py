@@ -0,0 +1,122 @@
+# -*-coding: utf-8
+"""
+    flask_rrbac.batch
+    ~~~~~~~~~~~~~
+    Evaluation of large batches of checks, optionally in a process pool
+"""
+
+from collections import deque
+from itertools import islice
+from multiprocessing import Pool
+
+from .policy import CompiledPolicy
+
+# Compiled policy and endpoint permission table of a worker process, set by
+# _init_worker
+_worker_policy = None
+
+
+def _init_worker(
+    role_route_map, anonymous_role_name, endpoint_table, engine,
+    role_hierarchy
+):
+    global _worker_policy
+    _worker_policy = (
+        CompiledPolicy(
+            role_route_map, anonymous_role_name, engine=engine,
+            role_hierarchy=dict(role_hierarchy)
+        ),
+        endpoint_table
+    )
+
+
+def _partition(chunk):
+    """Group the checks of a chunk by set of roles, as a list of (role
+    names, [(position, method, path)]).
+    """
+    partitions = {}
+    for position, (role_names, method, path) in enumerate(chunk):
+        partitions.setdefault(frozenset(role_names), []).append(
+            (position, method, path)
+        )
+    return list(partitions.items())
+
+
+def _evaluate_partitions(partitions, size, policy=None, endpoint_table=None):
+    """Return the results of a partitioned chunk, in the order of the chunk.
+    The role mask is computed once per partition.
+    """
+    if policy is None:
+        policy, endpoint_table = _worker_policy
+    results = [False] * size
+    for role_names, checks in partitions:
+        mask = policy.role_mask(role_names)
+        for position, method, path in checks:
+            allowed_mask = endpoint_table.get((method, path))
+            if allowed_mask is not None:
+                results[position] = bool(mask & allowed_mask)
+            else:
+                results[position] = policy.is_allowed(mask, method, path)
+    return results
+
+
+def _chunks(iterable, chunk_size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def evaluate_batch(
+    checks, policy, endpoint_table=None, processes=None, chunk_size=10000
+):
+    """
+    Generate the result of each check, in the order of checks.
+
+    Checks are read chunk_size at a time and every chunk is partitioned by
+    set of roles, so the role mask of a set is computed once per chunk. With
+    processes, chunks are evaluated in a pool whose workers compile the
+    policy once, in their initializer. At most two chunks per process are in
+    flight, so memory does not grow with the size of the batch.
+
+    Input:
+        :param checks: (type: iterable) (role names, method, path) tuples,
+        methods already mapped with RRACL_METHOD_ALTERNATES
+        :param policy: (type: CompiledPolicy) Compiled policy
+        :param endpoint_table: (type: dict) (method, path) -> role mask (see
+        CompiledPolicy.build_endpoint_table)
+        :param processes: (type: int) Number of worker processes. None
+        evaluates the checks in this process.
+        :param chunk_size: (type: int) Number of checks per chunk
+    Output:
+        generator of Boolean
+    """
+    endpoint_table = endpoint_table or {}
+    if not processes:
+        for chunk in _chunks(checks, chunk_size):
+            for result in _evaluate_partitions(
+                _partition(chunk), len(chunk), policy, endpoint_table
+            ):
+                yield result
+        return
+    pool = Pool(processes, _init_worker, (
+        policy.role_route_map, policy.anonymous_role_name, endpoint_table,
+        policy.engine, policy.role_hierarchy
+    ))
+    try:
+        pending = deque()
+        for chunk in _chunks(checks, chunk_size):
+            pending.append(pool.apply_async(
+                _evaluate_partitions, (_partition(chunk), len(chunk))
+            ))
+            if len(pending) >= 2 * processes:
+                for result in pending.popleft().get():
+                    yield result
+        while pending:
+            for result in pending.popleft().get():
+                yield result
+    finally:
+        pool.terminate()
+        pool.join()
@@ -0,0 +1,350 @@
+# -*-coding: utf-8
+"""
+    flask_rrbac.bulk
+    ~~~~~~~~~~~~~
+    Bulk writes of the policy and of the user role map with Core statements.
+    Depends on SQLAlchemy, so it is only imported by the methods using it.
+"""
+
+from sqlalchemy import func, inspect
+from sqlalchemy.orm.interfaces import MANYTOONE
+
+from .policy import canonicalize_role_route_map
+
+
+def column_name(model, key):
+    """Return the name of the table column of a mapped attribute."""
+    return inspect(model).get_property(key).columns[0].name
+
+
+def foreign_key_name(model, target_model):
+    """Return the name of the column of model referencing target_model,
+    found through the relationship between them (e.g. `role` of the role
+    route map model).
+    """
+    for relationship in inspect(model).relationships:
+        if relationship.mapper.class_ is target_model and \
+                relationship.direction is MANYTOONE:
+            return list(relationship.local_columns)[0].name
+    raise ValueError('{0} has no relationship to {1}'.format(
+        model.__name__, target_model.__name__
+    ))
+
+
+def _chunks(items, chunk_size):
+    for start in range(0, len(items), chunk_size):
+        yield items[start:start + chunk_size]
+
+
+def _insert(session, model, rows, chunk_size):
+    for chunk in _chunks(rows, chunk_size):
+        session.execute(model.__table__.insert(), chunk)
+
+
+def _remove(session, model, ids, chunk_size):
+    """Soft delete the rows (set deleted_at to the time of the DB, which
+    is_deleted compares it to), or delete them when the model has no
+    deleted_at column.
+    """
+    table = model.__table__
+    id_column = table.c[column_name(model, 'id')]
+    for chunk in _chunks(ids, chunk_size):
+        if hasattr(model, 'deleted_at'):
+            statement = table.update().where(id_column.in_(chunk)).values({
+                column_name(model, 'deleted_at'): func.now()
+            })
+        else:
+            statement = table.delete().where(id_column.in_(chunk))
+        session.execute(statement)
+
+
+def import_role_route_map(
+    session, role_model, route_model, role_route_map_model, role_route_map,
+    chunk_size=1000, prune=False
+):
+    """
+    Write a role route map (in the format of RRBAC_ROLE_ROUTE_MAP) into the
+    role, route and role route map models.
+
+    The document is diffed against the active rows, and only the missing
+    roles, routes and mappings are inserted, chunk_size rows per executemany.
+    With prune, the active mappings absent from the document are removed.
+    Nothing is committed; the caller owns the transaction.
+
+    Input:
+        :param session: (type: Session) SQLAlchemy session
+        :param role_model: (type: class) Role model
+        :param route_model: (type: class) Route model
+        :param role_route_map_model: (type: class) Role route map model
+        :param role_route_map: (type: dict) role -> method -> rules
+        :param chunk_size: (type: int) Number of rows per statement
+        :param prune: (type: Boolean) Remove the mappings absent from the
+        document
+    Output:
+        dict of the number of roles, routes and role_routes inserted and of
+        role_routes removed
+    """
+    role_route_map = canonicalize_role_route_map(role_route_map)
+    role_fk = foreign_key_name(role_route_map_model, role_model)
+    route_fk = foreign_key_name(role_route_map_model, route_model)
+
+    def role_ids():
+        rows = session.query(role_model.id, role_model.name).filter(
+            role_model.is_deleted == (False)
+        )
+        return dict((name, role_id) for role_id, name in rows)
+
+    def route_ids():
+        rows = session.query(
+            route_model.id, route_model.get_method, route_model.get_rule
+        )
+        return dict(
+            ((method, rule), route_id) for route_id, method, rule in rows
+        )
+
+    wanted_routes = set(
+        (method, rule)
+        for rules_by_method in role_route_map.values()
+        for method, rules in rules_by_method.items()
+        for rule in rules
+    )
+
+    roles = role_ids()
+    new_roles = sorted(set(role_route_map) - set(roles))
+    _insert(session, role_model, [
+        {column_name(role_model, 'name'): name} for name in new_roles
+    ], chunk_size)
+    if new_roles:
+        roles = role_ids()
+
+    routes = route_ids()
+    new_routes = sorted(wanted_routes - set(routes))
+    _insert(session, route_model, [
+        {
+            column_name(route_model, 'method'): method,
+            column_name(route_model, 'rule'): rule
+        }
+        for method, rule in new_routes
+    ], chunk_size)
+    if new_routes:
+        routes = route_ids()
+
+    wanted_pairs = set(
+        (roles[role], routes[(method, rule)])
+        for role, rules_by_method in role_route_map.items()
+        for method, rules in rules_by_method.items()
+        for rule in rules
+    )
+    table = role_route_map_model.__table__
+    existing = {}
+    for map_id, role_id, route_id in session.query(
+        table.c[column_name(role_route_map_model, 'id')],
+        table.c[role_fk], table.c[route_fk]
+    ).filter(role_route_map_model.is_deleted == (False)):
+        existing.setdefault((role_id, route_id), []).append(map_id)
+
+    _insert(session, role_route_map_model, [
+        {role_fk: role_id, route_fk: route_id}
+        for role_id, route_id in sorted(wanted_pairs - set(existing))
+    ], chunk_size)
+    removed = []
+    if prune:
+        removed = sorted(
+            map_id for pair, map_ids in existing.items()
+            if pair not in wanted_pairs for map_id in map_ids
+        )
+        _remove(session, role_route_map_model, removed, chunk_size)
+    return {
+        'roles': len(new_roles),
+        'routes': len(new_routes),
+        'role_routes': len(wanted_pairs - set(existing)),
+        'removed_role_routes': len(removed)
+    }
+
+
+def _role_id(session, role_model, role_name):
+    row = session.query(role_model.id).filter(
+        role_model.name == role_name
+    ).filter(role_model.is_deleted == (False)).first()
+    if row is None:
+        raise ValueError('Unknown role {0!r}'.format(role_name))
+    return row[0]
+
+
+def _route_ids(session, route_model, method, rules, chunk_size):
+    """Return rule -> id of the routes of the method, inserting the missing
+    ones.
+    """
+    def select():
+        route_ids = {}
+        for chunk in _chunks(sorted(rules), chunk_size):
+            for route_id, rule in session.query(
+                route_model.id, route_model.get_rule
+            ).filter(route_model.get_method == method).filter(
+                route_model.get_rule.in_(chunk)
+            ):
+                route_ids.setdefault(rule, route_id)
+        return route_ids
+
+    route_ids = select()
+    missing = [rule for rule in sorted(rules) if rule not in route_ids]
+    if missing:
+        _insert(session, route_model, [
+            {
+                column_name(route_model, 'method'): method,
+                column_name(route_model, 'rule'): rule
+            }
+            for rule in missing
+        ], chunk_size)
+        route_ids = select()
+    return route_ids
+
+
+def _set_mappings(
+    session, map_model, owner_fk, owner_id, target_fk, target_ids, active,
+    expires_at, chunk_size
+):
+    """Make the mappings of owner_id to target_ids active (until expires_at)
+    or inactive (from expires_at, now when None), writing only the rows
+    which change. Returns the target ids whose mapping changed.
+    """
+    table = map_model.__table__
+    id_column = table.c[column_name(map_model, 'id')]
+    has_deleted_at = hasattr(map_model, 'deleted_at')
+    columns = [id_column, table.c[target_fk]]
+    if has_deleted_at:
+        columns.append(table.c[column_name(map_model, 'deleted_at')])
+    existing = {}
+    expiries = {}
+    for chunk in _chunks(sorted(target_ids), chunk_size):
+        for row in session.query(*columns).filter(
+            table.c[owner_fk] == owner_id
+        ).filter(
+            table.c[target_fk].in_(chunk)
+        ).filter(map_model.is_deleted == (False)):
+            existing.setdefault(row[1], []).append(row[0])
+            if has_deleted_at:
+                expiries[row[0]] = row[2]
+
+    if active:
+        changed = set(target_ids) - set(existing)
+        row = {owner_fk: owner_id}
+        if has_deleted_at and expires_at is not None:
+            row[column_name(map_model, 'deleted_at')] = expires_at
+        _insert(session, map_model, [
+            dict(row, **{target_fk: target_id})
+            for target_id in sorted(changed)
+        ], chunk_size)
+        if has_deleted_at:
+            # Existing grants take the new expiry, or become permanent when
+            # expires_at is None
+            updated = [
+                (target_id, map_id)
+                for target_id, map_ids in existing.items()
+                for map_id in map_ids if expiries[map_id] != expires_at
+            ]
+            changed.update(target_id for target_id, _ in updated)
+            for chunk in _chunks(
+                sorted(map_id for _, map_id in updated), chunk_size
+            ):
+                session.execute(
+                    table.update().where(id_column.in_(chunk)).values({
+                        column_name(map_model, 'deleted_at'): expires_at
+                    })
+                )
+        return sorted(changed)
+
+    if expires_at is not None and has_deleted_at:
+        # A revocation only shortens the access: mappings ending before
+        # expires_at are left alone
+        ending = [
+            (target_id, map_id)
+            for target_id, map_ids in existing.items()
+            for map_id in map_ids
+            if expiries[map_id] is None or expiries[map_id] > expires_at
+        ]
+        for chunk in _chunks(
+            sorted(map_id for _, map_id in ending), chunk_size
+        ):
+            session.execute(
+                table.update().where(id_column.in_(chunk)).values({
+                    column_name(map_model, 'deleted_at'): expires_at
+                })
+            )
+        return sorted(set(target_id for target_id, _ in ending))
+    _remove(session, map_model, sorted(
+        map_id for map_ids in existing.values() for map_id in map_ids
+    ), chunk_size)
+    return sorted(existing)
+
+
+def set_user_roles(
+    session, role_model, user_model, user_role_map_model, user_ids,
+    role_name, active, expires_at=None, chunk_size=1000
+):
+    """
+    Grant (active) or revoke a role of users.
+
+    Input:
+        :param session: (type: Session) SQLAlchemy session
+        :param role_model: (type: class) Role model
+        :param user_model: (type: class) User model
+        :param user_role_map_model: (type: class) User role map model
+        :param user_ids: (type: list) Ids of the users
+        :param role_name: (type: str) Name of the role
+        :param active: (type: Boolean) Grant the role, revoke it otherwise
+        :param expires_at: (type: datetime) deleted_at of the mappings: the
+        end of a grant, or the time of a revocation
+        :param chunk_size: (type: int) Number of rows per statement
+    Output:
+        list of the ids of the users whose roles changed
+    """
+    return _set_mappings(
+        session, user_role_map_model,
+        foreign_key_name(user_role_map_model, role_model),
+        _role_id(session, role_model, role_name),
+        foreign_key_name(user_role_map_model, user_model),
+        user_ids, active, expires_at, chunk_size
+    )
+
+
+def set_role_routes(
+    session, role_model, route_model, role_route_map_model, role_name,
+    method, rules, active, expires_at=None, chunk_size=1000
+):
+    """
+    Attach (active) or detach rules of a method to a role. Missing routes
+    are created when attaching.
+
+    Input:
+        :param session: (type: Session) SQLAlchemy session
+        :param role_model: (type: class) Role model
+        :param route_model: (type: class) Route model
+        :param role_route_map_model: (type: class) Role route map model
+        :param role_name: (type: str) Name of the role
+        :param method: (type: str) Http method
+        :param rules: (type: list) Rules
+        :param active: (type: Boolean) Attach the rules, detach them otherwise
+        :param expires_at: (type: datetime) deleted_at of the mappings
+        :param chunk_size: (type: int) Number of rows per statement
+    Output:
+        list of the ids of the routes whose mapping changed
+    """
+    role_id = _role_id(session, role_model, role_name)
+    if active:
+        route_ids = _route_ids(
+            session, route_model, method, rules, chunk_size
+        ).values()
+    else:
+        route_ids = [
+            route_id for chunk in _chunks(sorted(rules), chunk_size)
+            for (route_id,) in session.query(route_model.id).filter(
+                route_model.get_method == method
+            ).filter(route_model.get_rule.in_(chunk))
+        ]
+    return _set_mappings(
+        session, role_route_map_model,
+        foreign_key_name(role_route_map_model, role_model), role_id,
+        foreign_key_name(role_route_map_model, route_model), route_ids,
+        active, expires_at, chunk_size
+    )
@@ -0,0 +1,89 @@
+# -*-coding: utf-8
+"""
+    flask_rrbac.cache
+    ~~~~~~~~~~~~~
+    Thread-safe cache of the roles of users
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class RoleCache(object):
+    """Least recently used cache of (tenant, user id) -> role names, whose
+    entries expire after ttl seconds. The tenant is None outside of
+    per-tenant policies.
+
+    It is shared by all the threads of a process, so every access is made
+    under a lock.
+    :param ttl: seconds an entry is valid for
+    :param max_size: maximum number of users kept
+    """
+
+    def __init__(self, ttl, max_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._tenants = set([None])
+        self.reset_lock()
+
+    def reset_lock(self):
+        """Create a new lock, e.g. in a forked worker."""
+        self._lock = threading.Lock()
+
+    def get(self, user_id, tenant=None):
+        """
+        Return the cached role names of the user, or None.
+        :param user_id: id of the user
+        :param tenant: id of the tenant the roles are of
+        """
+        key = (tenant, user_id)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[0] < time.time():
+                self.misses += 1
+                return None
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def set(self, user_id, role_names, tenant=None):
+        """
+        Cache the role names of the user.
+        :param user_id: id of the user
+        :param role_names: iterable of role names
+        :param tenant: id of the tenant the roles are of
+        """
+        key = (tenant, user_id)
+        entry = (time.time() + self.ttl, frozenset(role_names))
+        with self._lock:
+            self._tenants.add(tenant)
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id=None):
+        """
+        Drop the cached roles of a user in every tenant, or of every user.
+        :param user_id: id of the user, None for every user
+        """
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+                self._tenants = set([None])
+            else:
+                for tenant in self._tenants:
+                    self._entries.pop((tenant, user_id), None)
+
+    def stats(self):
+        """Return the number of entries, hits and misses."""
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses
+            }
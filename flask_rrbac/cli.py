@@ -0,0 +1,95 @@
+# -*-coding: utf-8
+"""
+    flask_rrbac.cli
+    ~~~~~~~~~~~~~
+    `flask rrbac` commands, registered by init_app on Flask 0.11+
+"""
+
+import json
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from .document import check_policy_document
+from .export import EXPORT_FORMATS
+
+
+@click.group('rrbac')
+def rrbac_cli():
+    """Flask-RRBAC commands."""
+
+
+@rrbac_cli.command('export-matrix')
+@click.option(
+    '--output', '-o', type=click.File('w'), default='-',
+    help='File to write to, stdout by default.'
+)
+@click.option(
+    '--format', 'output_format', type=click.Choice(EXPORT_FORMATS),
+    default='jsonl', help='Output format.'
+)
+@click.option(
+    '--chunk-size', type=int, default=1000,
+    help='Number of users fetched per round trip.'
+)
+@click.option(
+    '--processes', type=int, default=0,
+    help='Evaluate the role sets in a pool of that many processes.'
+)
+@with_appcontext
+def export_matrix_command(output, output_format, chunk_size, processes):
+    """Export the access matrix (user x rule x method) of every user."""
+    acl = current_app.extensions['rrbac'].acl
+    count = acl.export_matrix(
+        output, current_app._get_current_object(), output_format,
+        chunk_size, processes or None
+    )
+    click.echo('Exported {0} users'.format(count), err=True)
+
+
+@rrbac_cli.command('import-policy')
+@click.argument('document', type=click.File('r'))
+@click.option(
+    '--chunk-size', type=int, default=1000,
+    help='Number of rows per insert statement.'
+)
+@click.option(
+    '--prune', is_flag=True,
+    help='Remove the role route mappings which are not in the document.'
+)
+@with_appcontext
+def import_policy_command(document, chunk_size, prune):
+    """Import a policy document (or RRBAC_ROLE_ROUTE_MAP as JSON) into the
+    DB.
+    """
+    state = current_app.extensions['rrbac']
+    acl = state.acl
+    role_route_map = json.load(document)
+    if 'sha1' in role_route_map and 'role_route_map' in role_route_map:
+        try:
+            check_policy_document(
+                role_route_map, document.name, state.anonymous_role_name
+            )
+        except ValueError as error:
+            raise click.ClickException(str(error))
+        role_route_map = role_route_map['role_route_map']
+    counts = acl.import_policy(
+        role_route_map, current_app._get_current_object(), chunk_size, prune
+    )
+    click.echo(json.dumps(counts, sort_keys=True))
+
+
+@rrbac_cli.command('export-policy')
+@click.option(
+    '--output', '-o', type=click.File('w'), default='-',
+    help='File to write to, stdout by default.'
+)
+@with_appcontext
+def export_policy_command(output):
+    """Export the policy as a document usable as RRBAC_ROLE_ROUTE_MAP."""
+    acl = current_app.extensions['rrbac'].acl
+    content_hash = acl.export_policy_document(
+        output, current_app._get_current_object()
+    )
+    click.echo('Exported policy {0}'.format(content_hash), err=True)
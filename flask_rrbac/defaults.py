@@ -19,13 +19,14 @@ Example:
 RRBAC_ROLE_ROUTE_MAP = {}
 
 """
-Determines if static files should be mapped to Anonymous user role or not.
-If True, they will be mapped by default.
+Determines if the static files of the app and of its blueprints can be
+fetched (GET/HEAD) by everyone. If True, these requests are allowed without
+loading the user or checking the role-route mapping.
 
 Example:
     app.config['RRBAC_ALLOW_STATIC'] = True
 """
-# RRBAC_ALLOW_STATIC = True
+RRBAC_ALLOW_STATIC = False
 
 """
 Determines the name of the Anonymous role. This name will be matched in the
@@ -52,3 +53,187 @@ RRACL_METHOD_ALTERNATES = {
     'HEAD': 'GET',
     'OPTIONS': 'GET'
 }
+
+"""
+Determines if the role-route mapping read from the DB should be compiled once
+and kept in memory. When False, the DB is queried on every request.
+Call `rrbac.refresh_policy(app)` after editing the policy in the DB directly;
+attach_route, detach_route and import_policy refresh it themselves.
+
+Example:
+    app.config['RRBAC_CACHE_DB_POLICY'] = True
+"""
+RRBAC_CACHE_DB_POLICY = False
+
+"""
+Path of a policy store file written with `rrbac.write_policy_store(path)`.
+When set, the role-route mapping and the user-role mapping are read from this
+memory mapped file instead of the config/DB, so that all the worker processes
+of a host share one copy of them. User ids have to be integers.
+
+Example:
+    app.config['RRBAC_POLICY_STORE_PATH'] = '/var/lib/myapp/rrbac.store'
+"""
+RRBAC_POLICY_STORE_PATH = None
+
+"""
+Seconds between two checks for a new version of the policy store file.
+
+Example:
+    app.config['RRBAC_POLICY_STORE_CHECK_INTERVAL'] = 30
+"""
+RRBAC_POLICY_STORE_CHECK_INTERVAL = 5
+
+"""
+Determines if the rules of a role should only be compiled when the role is
+first used. Speeds up the start of services using a small part of a very large
+policy. `rrbac.warmup(app)` still compiles every role at startup.
+
+Example:
+    app.config['RRBAC_LAZY_COMPILE'] = True
+"""
+RRBAC_LAZY_COMPILE = False
+
+"""
+Engine matching the regex rules. 're' uses Python's backtracking regex
+engine. 'dfa' matches them in time linear in the length of the path whatever
+the rule; it supports literals, `.`, character classes, groups, alternation
+and quantifiers, and rules using anything else (back references, lookarounds)
+are matched with re, with a warning. Other values raise ValueError in
+init_app.
+
+Example:
+    app.config['RRBAC_RULE_ENGINE'] = 'dfa'
+"""
+RRBAC_RULE_ENGINE = 're'
+
+"""
+What to do with regex rules prone to catastrophic backtracking (e.g.
+`(a+)+`) when they are compiled, and when they are written with
+`attach_route` or `import_policy`: None accepts them, 'warn' emits an
+UnsafeRuleWarning, 'reject' raises UnsafeRuleError. It also applies to the
+rules read from the DB on each request when the DB policy is not cached.
+Other values raise ValueError in init_app. The check is opt-in; 'warn' or
+'reject' is recommended.
+
+Example:
+    app.config['RRBAC_UNSAFE_RULES'] = 'reject'
+"""
+RRBAC_UNSAFE_RULES = None
+
+"""
+Determines if the rules which cannot change a decision are removed when the
+policy is compiled: literal rules (`/orders`) matched by another rule of the
+same role and method, and rules a role shares with the Anonymous Role, which
+every user holds. Decisions are unchanged, but `roles_for_route` no longer
+lists a role for a route it only reaches through a removed rule. What was
+removed is reported in `app.extensions['rrbac'].policy.minimize_report`.
+
+Example:
+    app.config['RRBAC_MINIMIZE_POLICY'] = True
+"""
+RRBAC_MINIMIZE_POLICY = False
+
+"""
+Counts the rules matching one decision in that many (0 disables it). The
+counts drive the order in which roles and rules are tried, most matched
+first, and are reported by `rrbac.rule_usage(app)` along with the rules never
+matched since the start of the window. Counting writes to the compiled
+policy, so pages shared copy-on-write with a preloading master get copied.
+
+Example:
+    app.config['RRBAC_RULE_STATS_SAMPLE_RATE'] = 100
+"""
+RRBAC_RULE_STATS_SAMPLE_RATE = 0
+
+"""
+Role inheritance: role -> roles it includes. A role carries the rules of the
+roles it includes, transitively. The closure is expanded once, when the
+policy is compiled, so inherited rules cost nothing extra per decision. In
+DB mode the hierarchy can instead be read from a `parent_id` column of the
+role model (a role includes its parent), when this is None.
+
+Example:
+    app.config['RRBAC_ROLE_HIERARCHY'] = {
+        'super_admin': ['admin'],
+        'admin': ['base']
+    }
+"""
+RRBAC_ROLE_HIERARCHY = None
+
+"""
+Directory of the policy documents of the tenants (`<tenant>.json`, written
+with `rrbac.export_policy_document`), used with `rrbac.set_tenant_resolver`.
+When None, the policy of a tenant is loaded from the DB, restricted to the
+roles whose `tenant_id` column is the tenant.
+
+Example:
+    app.config['RRBAC_TENANT_POLICY_DIR'] = '/var/lib/myapp/policies'
+"""
+RRBAC_TENANT_POLICY_DIR = None
+
+"""
+Maximum number of tenants whose compiled policy is kept in memory. The least
+recently used ones are dropped first and loaded again when needed.
+
+Example:
+    app.config['RRBAC_TENANT_CACHE_SIZE'] = 500
+"""
+RRBAC_TENANT_CACHE_SIZE = 100
+
+"""
+Maximum estimated memory, in bytes, of the compiled tenant policies kept in
+memory, None for no limit besides RRBAC_TENANT_CACHE_SIZE.
+
+Example:
+    app.config['RRBAC_TENANT_CACHE_MAX_BYTES'] = 64 * 1024 * 1024
+"""
+RRBAC_TENANT_CACHE_MAX_BYTES = None
+
+"""
+Seconds the roles of a user are cached for. The cache is shared by all the
+threads of a process and used by `_authenticate`, `check_many` and `can`.
+0 disables the cache.
+
+Example:
+    app.config['RRBAC_ROLE_CACHE_TTL'] = 60
+"""
+RRBAC_ROLE_CACHE_TTL = 0
+
+"""
+Maximum number of users whose roles are cached. The least recently used
+entries are dropped first.
+
+Example:
+    app.config['RRBAC_ROLE_CACHE_SIZE'] = 100000
+"""
+RRBAC_ROLE_CACHE_SIZE = 10000
+
+"""
+Path of a log file shared by the processes of a deployment, through which the
+changes made with `grant_role`, `revoke_role`, `attach_route`, `detach_route`
+and `import_policy` invalidate the cached roles and compiled policies of the
+other processes. Keep it on a local disk, or on one all the processes see.
+
+Example:
+    app.config['RRBAC_INVALIDATION_LOG_PATH'] = '/var/lib/myapp/rrbac.log'
+"""
+RRBAC_INVALIDATION_LOG_PATH = None
+
+"""
+Seconds between two reads of the invalidation log.
+
+Example:
+    app.config['RRBAC_INVALIDATION_CHECK_INTERVAL'] = 1
+"""
+RRBAC_INVALIDATION_CHECK_INTERVAL = 5
+
+"""
+Determines if every request of the app should be checked by a `before_request`
+hook installed by `init_app`, instead of decorating the view functions with
+`rrbac._authenticate`. Requests matching no route are left to Flask.
+
+Example:
+    app.config['RRBAC_ENFORCE'] = True
+"""
+RRBAC_ENFORCE = False
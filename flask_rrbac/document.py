@@ -0,0 +1,154 @@
+# -*-coding: utf-8
+"""
+    flask_rrbac.document
+    ~~~~~~~~~~~~~
+    Policy documents: a role route map as canonical JSON with a content hash
+"""
+
+import json
+import os
+import re
+from hashlib import sha1
+
+from .policy import canonicalize_role_route_map
+
+_HASH_TAIL = re.compile(r'"sha1": "([0-9a-f]{40})"}\s*$')
+
+
+def _role_json(role, rules_by_method):
+    """Return the canonical JSON of one role of a role route map, as
+    json.dumps(..., sort_keys=True) writes it.
+    """
+    rules_by_method = canonicalize_role_route_map({role: rules_by_method})
+    return '{0}: {1}'.format(
+        json.dumps(role), json.dumps(rules_by_method[role], sort_keys=True)
+    )
+
+
+def _document_head(anonymous_role_name):
+    """Return the beginning of a policy document, up to its role route
+    map.
+    """
+    return '{{"anonymous_role": {0}, "role_route_map": '.format(
+        json.dumps(anonymous_role_name)
+    )
+
+
+def policy_document_hash(role_route_map, anonymous_role_name):
+    """
+    Return the content hash of a policy document, i.e. the sha1 of its
+    canonical JSON up to the hash: the Anonymous Role and the role route
+    map.
+    :param role_route_map: dict of role -> method -> rules
+    :param anonymous_role_name: Name of the Anonymous Role
+    """
+    canonical = canonicalize_role_route_map(role_route_map)
+    return sha1((
+        _document_head(anonymous_role_name) +
+        json.dumps(canonical, sort_keys=True)
+    ).encode('utf-8')).hexdigest()
+
+
+def check_policy_document(document, name, anonymous_role_name=None):
+    """
+    Check the content hash of a parsed policy document, and that it was
+    written for the Anonymous Role of the app loading it: its rules for the
+    Anonymous Role would otherwise apply to no one. Raises ValueError.
+
+    Input:
+        :param document: (type: dict) Parsed policy document
+        :param name: (type: str) Name of the document in the errors
+        :param anonymous_role_name: (type: str) Name of the Anonymous Role of
+        the app, None to accept any
+    """
+    if policy_document_hash(
+        document['role_route_map'], document['anonymous_role']
+    ) != document['sha1']:
+        raise ValueError(
+            '{0} does not match its content hash'.format(name)
+        )
+    if anonymous_role_name is not None and \
+            document['anonymous_role'] != anonymous_role_name:
+        raise ValueError(
+            '{0} is written for the Anonymous Role {1}, not {2}'.format(
+                name, document['anonymous_role'], anonymous_role_name
+            )
+        )
+
+
+def write_policy_document(output, roles, anonymous_role_name):
+    """
+    Write a policy document, one role at a time.
+
+    The document is the JSON object {"anonymous_role": ..., "role_route_map":
+    ..., "sha1": ...}, written exactly as json.dumps(..., sort_keys=True)
+    would, where role_route_map is canonical (see
+    canonicalize_role_route_map) and usable as RRBAC_ROLE_ROUTE_MAP. The
+    hash comes last, so it can be read from the tail of the file (see
+    read_policy_document_hash). The hash covers everything before it (see
+    policy_document_hash).
+
+    Input:
+        :param output: (type: file) Text file to write to
+        :param roles: (type: iterable) (role, method -> rules) pairs, sorted
+        by role name
+        :param anonymous_role_name: (type: str) Name of the Anonymous Role
+    Output:
+        Content hash of the document
+    """
+    content_hash = sha1()
+
+    def write(text):
+        content_hash.update(text.encode('utf-8'))
+        output.write(text)
+
+    write(_document_head(anonymous_role_name))
+    write('{')
+    previous_role = None
+    for role, rules_by_method in roles:
+        if previous_role is not None:
+            if role <= previous_role:
+                raise ValueError('Roles are not sorted by name')
+            write(', ')
+        write(_role_json(role, rules_by_method))
+        previous_role = role
+    write('}')
+    hexdigest = content_hash.hexdigest()
+    output.write(', "sha1": "{0}"}}\n'.format(hexdigest))
+    return hexdigest
+
+
+def read_policy_document_hash(path):
+    """
+    Return the content hash of a policy document file, reading only its
+    tail, or None when it has none.
+    :param path: path of the policy document
+    """
+    with open(path, 'rb') as document_file:
+        document_file.seek(0, os.SEEK_END)
+        document_file.seek(max(0, document_file.tell() - 64))
+        match = _HASH_TAIL.search(document_file.read().decode('utf-8'))
+    return match.group(1) if match else None
+
+
+def read_policy_document(path, known_hash=None, anonymous_role_name=None):
+    """
+    Read a policy document file and check it (see check_policy_document).
+
+    Input:
+        :param path: (type: str) Path of the policy document
+        :param known_hash: (type: str) Hash of the policy already loaded. When
+        the document has the same hash, it is not parsed and None is returned.
+        :param anonymous_role_name: (type: str) Name of the Anonymous Role of
+        the app, None to accept any
+    Output:
+        dict with the anonymous_role, role_route_map and sha1 of the document,
+        or None
+    """
+    if known_hash is not None and \
+            read_policy_document_hash(path) == known_hash:
+        return None
+    with open(path) as document_file:
+        document = json.load(document_file)
+    check_policy_document(document, path, anonymous_role_name)
+    return document
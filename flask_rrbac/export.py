@@ -0,0 +1,132 @@
+# -*-coding: utf-8
+"""
+    flask_rrbac.export
+    ~~~~~~~~~~~~~
+    Streaming export of the effective access matrix
+"""
+
+import csv
+import json
+from multiprocessing import Pool
+
+from .policy import CompiledPolicy, RouteMatrix
+
+EXPORT_FORMATS = ('jsonl', 'csv')
+
+# Route matrix of a pool worker process, set by _init_worker
+_worker_route_matrix = None
+
+
+def _build_route_matrix(
+    role_route_map, anonymous_role_name, app_routes, engine, role_hierarchy,
+    guard
+):
+    return RouteMatrix(
+        CompiledPolicy(
+            role_route_map, anonymous_role_name, engine=engine, guard=guard,
+            role_hierarchy=role_hierarchy
+        ),
+        app_routes
+    )
+
+
+def _init_worker(*args):
+    global _worker_route_matrix
+    _worker_route_matrix = _build_route_matrix(*args)
+
+
+def _evaluate_role_set(role_names, route_matrix=None):
+    """Return the accessible (rule, methods) of a set of roles, sorted. The
+    route matrix of the worker process is used when route_matrix is None.
+    """
+    if route_matrix is None:
+        route_matrix = _worker_route_matrix
+    routes = route_matrix.accessible_routes(
+        route_matrix.policy.role_mask(role_names)
+    )
+    return role_names, [
+        (rule, sorted(methods)) for rule, methods in sorted(routes.items())
+    ]
+
+
+def write_access_matrix(
+    output, user_role_sets, role_route_map, anonymous_role_name, app_routes,
+    output_format='jsonl', processes=None, engine='re', role_hierarchy=None,
+    guard=None
+):
+    """
+    Write the effective access matrix (user x rule x method) of users.
+
+    Users are grouped by identical set of roles, so that every distinct set
+    is evaluated once. Rows are written as the chunks of users come in, so
+    memory only grows with the number of distinct role sets. Rules with
+    variables are reported as in RoleRouteBasedACL.accessible_routes.
+
+    Formats:
+        jsonl: one {"user_id": ..., "routes": {rule: [methods]}} per line
+        csv: one user_id,rule,method row per allowed method
+
+    Input:
+        :param output: (type: file) Text file to write to
+        :param user_role_sets: (type: iterable) chunks (lists) of
+        (user id, frozenset of role names)
+        :param role_route_map: (type: dict) role -> method -> rules
+        :param anonymous_role_name: (type: str) Name of the Anonymous Role
+        :param app_routes: (type: dict) rule -> methods (see get_app_routes)
+        :param output_format: (type: str) jsonl or csv
+        :param processes: (type: int) Evaluate the role sets in a pool of
+        that many processes. None evaluates them in this process.
+        :param engine: (type: str) regex rule engine, 're' or 'dfa'
+        :param role_hierarchy: (type: dict) role -> roles it includes
+        :param guard: (type: str) RRBAC_UNSAFE_RULES of the app
+    Output:
+        Number of users written
+    """
+    if output_format not in EXPORT_FORMATS:
+        raise ValueError('Unknown export format {0!r}'.format(output_format))
+    matrix_args = (
+        role_route_map, anonymous_role_name, app_routes, engine,
+        role_hierarchy, guard
+    )
+    pool = None
+    if processes:
+        pool = Pool(processes, _init_worker, matrix_args)
+
+        def evaluate(role_sets):
+            return pool.map(_evaluate_role_set, role_sets)
+    else:
+        # Evaluated in this process: the matrix is local to this export
+        route_matrix = _build_route_matrix(*matrix_args)
+
+        def evaluate(role_sets):
+            return [
+                _evaluate_role_set(role_names, route_matrix)
+                for role_names in role_sets
+            ]
+    writer = csv.writer(output) if output_format == 'csv' else None
+    routes_by_role_set = {}
+    user_count = 0
+    try:
+        for chunk in user_role_sets:
+            new_role_sets = list(set(
+                role_names for _, role_names in chunk
+                if role_names not in routes_by_role_set
+            ))
+            routes_by_role_set.update(evaluate(new_role_sets))
+            for user_id, role_names in chunk:
+                routes = routes_by_role_set[role_names]
+                if writer is None:
+                    output.write(json.dumps({
+                        'user_id': user_id,
+                        'routes': dict(routes)
+                    }, sort_keys=True) + '\n')
+                else:
+                    for rule, methods in routes:
+                        for method in methods:
+                            writer.writerow([user_id, rule, method])
+            user_count += len(chunk)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return user_count
@@ -0,0 +1,97 @@
+# -*-coding: utf-8
+"""
+    flask_rrbac.invalidation
+    ~~~~~~~~~~~~~
+    Invalidation of cached roles and policies across worker processes
+"""
+
+import json
+import os
+import threading
+import time
+
+
+class InvalidationLog(object):
+    """Append-only file through which the processes of a deployment tell
+    each other which cached data is stale.
+
+    Every change appends lines to the file: `policy` when the role route
+    mapping changed, `user <id>` when the roles of a user changed. Each
+    process remembers how far it has read and, every check_interval seconds,
+    reads the lines appended since. A file which shrank (e.g. truncated by log
+    rotation) invalidates everything.
+    :param path: path of the log file, shared by the processes
+    :param check_interval: seconds between two reads of the file
+    """
+
+    def __init__(self, path, check_interval=5):
+        self.path = path
+        self.check_interval = check_interval
+        self._offset = self._size()
+        self._checked_at = time.time()
+        self.reset_lock()
+
+    def reset_lock(self):
+        """Create a new lock, e.g. in a forked worker."""
+        self._lock = threading.Lock()
+
+    def _size(self):
+        try:
+            return os.stat(self.path).st_size
+        except OSError:
+            return 0
+
+    def publish(self, user_ids=(), policy=False):
+        """
+        Append invalidations to the log. The lines are written with a single
+        write on a file opened in append mode, so writers do not interleave.
+        :param user_ids: ids of the users whose roles changed
+        :param policy: the role route mapping changed
+        """
+        lines = ['policy\n'] if policy else []
+        lines.extend(
+            'user {0}\n'.format(json.dumps(user_id)) for user_id in user_ids
+        )
+        if not lines:
+            return
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, ''.join(lines).encode('utf-8'))
+        finally:
+            os.close(fd)
+
+    def poll(self, force=False):
+        """
+        Read the invalidations appended since the last poll.
+        :param force: read the file even if check_interval has not elapsed
+        Output:
+            None when there is nothing to invalidate, otherwise a tuple of
+            (set of user ids, policy changed, everything is stale)
+        """
+        now = time.time()
+        if not force and now - self._checked_at < self.check_interval:
+            return None
+        with self._lock:
+            self._checked_at = now
+            size = self._size()
+            if size == self._offset:
+                return None
+            if size < self._offset:
+                self._offset = size
+                return set(), True, True
+            with open(self.path, 'rb') as log_file:
+                log_file.seek(self._offset)
+                data = log_file.read(size - self._offset)
+            # Only complete lines, a writer may be half way
+            data = data[:data.rfind(b'\n') + 1]
+            self._offset += len(data)
+        user_ids = set()
+        policy = False
+        for line in data.decode('utf-8').splitlines():
+            if line == 'policy':
+                policy = True
+            elif line.startswith('user '):
+                user_ids.add(json.loads(line[5:]))
+        if not user_ids and not policy:
+            return None
+        return user_ids, policy, False
@@ -0,0 +1,134 @@
+# -*-coding: utf-8
+"""
+    flask_rrbac.matching
+    ~~~~~~~~~~~~~
+    Rules written with the Werkzeug rule syntax (`/orders/<int:order_id>`)
+"""
+
+import re
+import threading
+
+from werkzeug.exceptions import HTTPException
+from werkzeug.routing import Map, Rule
+
+# A variable part of a Werkzeug rule: <name> or <converter(args):name>
+_VARIABLE = re.compile(
+    r'<(?:([a-zA-Z_][a-zA-Z0-9_]*)(?:\(([^)]*)\))?:)?[a-zA-Z_][a-zA-Z0-9_]*>'
+)
+
+# Values of the variables of the paths generated by sample_paths, by
+# converter; the other converters (string, path) take each default value
+_SAMPLE_VALUES = {
+    'int': ('1',),
+    'float': ('1.0',),
+    'uuid': ('00000000-0000-0000-0000-000000000000',)
+}
+_DEFAULT_SAMPLE_VALUES = ('1', 'x')
+
+# Compiled single rules used by match_werkzeug_rule
+_compiled_rules = {}
+_compiled_rules_lock = threading.Lock()
+_MAX_COMPILED_RULES = 10000
+
+
+def is_werkzeug_rule(rule):
+    """
+    Return whether a rule is written with the Werkzeug rule syntax rather
+    than as a regex: it starts with a slash and has a variable part, and no
+    named regex group.
+    :param rule: rule of the policy
+    """
+    return rule.startswith('/') and '(?P<' not in rule and \
+        _VARIABLE.search(rule) is not None
+
+
+def sample_paths(rule):
+    """
+    Return paths matched by a url rule of the app, with a value of the
+    converter of each variable (a number and a word for string variables,
+    every item of an any converter), e.g. ['/orders/1', '/orders/x'] for
+    `/orders/<order_id>`. A rule without variables is its only path.
+    :param rule: Werkzeug rule of the url map
+    """
+    variables = []
+    for match in _VARIABLE.finditer(rule):
+        converter, arguments = match.group(1), match.group(2)
+        if converter == 'any' and arguments:
+            variables.append(tuple(
+                item.strip().strip('\'"') for item in arguments.split(',')
+            ))
+        else:
+            variables.append(
+                _SAMPLE_VALUES.get(converter, _DEFAULT_SAMPLE_VALUES)
+            )
+    if not variables:
+        return [rule]
+    paths = []
+    for index in range(max(len(values) for values in variables)):
+        path_values = iter([
+            values[min(index, len(values) - 1)] for values in variables
+        ])
+        paths.append(_VARIABLE.sub(lambda _: next(path_values), rule))
+    return paths
+
+
+class WerkzeugRules(object):
+    """Werkzeug rules compiled into one werkzeug.routing.Map, so they are
+    matched with the converters used for routing. The whole path has to
+    match, as with regex rules; trailing slash redirects do not match.
+    :param rules_by_method: dict of method -> iterable of Werkzeug rules
+    """
+
+    def __init__(self, rules_by_method):
+        self.map = Map([
+            Rule(rule, methods=[method], endpoint=rule)
+            for method, rules in sorted(rules_by_method.items())
+            for rule in sorted(rules)
+        ])
+        self.adapter = self.map.bind('localhost')
+        # Sort the rules now rather than on the first match, from any thread
+        self.map.update()
+
+    def match(self, method, path):
+        """
+        Return whether one of the rules of the method matches the path.
+        :param method: Http method
+        :param path: Path to match
+        """
+        return self.match_rule(method, path) is not None
+
+    def match_rule(self, method, path):
+        """
+        Return the rule of the method matching the path (the first one in
+        Werkzeug's order when several do), or None.
+        :param method: Http method
+        :param path: Path to match
+        """
+        try:
+            rule, _ = self.adapter.match(path, method=method)
+        except HTTPException:
+            return None
+        return rule
+
+
+def reset_compiled_rules_lock():
+    """Create a new lock for the compiled rules, e.g. in a forked worker."""
+    global _compiled_rules_lock
+    _compiled_rules_lock = threading.Lock()
+
+
+def match_werkzeug_rule(rule, path):
+    """
+    Return whether a single Werkzeug rule matches the path, whatever the
+    method. Compiled rules are kept, up to _MAX_COMPILED_RULES.
+    :param rule: Werkzeug rule
+    :param path: Path to match
+    """
+    compiled = _compiled_rules.get(rule)
+    if compiled is None:
+        compiled = WerkzeugRules({'GET': [rule]})
+        with _compiled_rules_lock:
+            if len(_compiled_rules) >= _MAX_COMPILED_RULES:
+                _compiled_rules.clear()
+            _compiled_rules[rule] = compiled
+    return compiled.match('GET', path)
@@ -5,5 +5,9 @@ INIIALIZATION_ERRORS = {
     'route': "Please set route model before authenticate.",
     'role_route_map': "Please set role route map model before authenticate.",
     'user_role_map': "Please set user role map model before authenticate.",
-    'user_loader': "Please set user loader before authenticate."
+    'user_loader': "Please set user loader before authenticate.",
+    'tenant': "Please set RRBAC_TENANT_POLICY_DIR or add a tenant_id column "
+              "to the role model before resolving tenants.",
+    'rule_engine': "Unknown RRBAC_RULE_ENGINE {0!r}, expected one of {1}.",
+    'unsafe_rules': "Unknown RRBAC_UNSAFE_RULES {0!r}, expected one of {1}.",
 }
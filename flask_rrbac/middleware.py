@@ -0,0 +1,161 @@
+# -*-coding: utf-8
+"""
+    flask_rrbac.middleware
+    ~~~~~~~~~~~~~
+    WSGI middleware rejecting requests before they reach the Flask app
+"""
+
+from werkzeug.exceptions import Forbidden, HTTPException
+
+
+def anonymous_identity(
+    session_cookie_name, remember_cookie_name='remember_token'
+):
+    """
+    Return an identify function treating requests without a session cookie,
+    without a Flask-Login remember cookie and without an Authorization
+    header as anonymous.
+    :param session_cookie_name: name of the session cookie of the app
+    :param remember_cookie_name: name of the remember cookie of Flask-Login
+    (REMEMBER_COOKIE_NAME)
+    """
+    cookies = tuple(
+        '{0}='.format(name)
+        for name in (session_cookie_name, remember_cookie_name) if name
+    )
+
+    def identify(environ):
+        if environ.get('HTTP_AUTHORIZATION'):
+            return None
+        cookie_header = environ.get('HTTP_COOKIE', '')
+        if any(cookie in cookie_header for cookie in cookies):
+            return None
+        return ()
+    return identify
+
+
+class RoleRouteBasedACLMiddleware(object):
+    """WSGI middleware which applies the compiled policy of a Flask app to
+    PATH_INFO and REQUEST_METHOD before the app is called, so that denied
+    requests do not go through the dispatch, session loading and user
+    loading of Flask.
+
+    Only callers identify(environ) recognises are decided here: it returns
+    the role names of the caller (an empty iterable for anonymous callers),
+    or None to leave the request to the in-app check. By default, requests
+    without a session cookie, without a remember cookie and without an
+    Authorization header are anonymous, so that Flask-Login can restore a
+    remembered user whose session expired. Requests to views declared with
+    allow_anonymous or allow_roles are decided by their declaration. Denied
+    requests get a plain 403, without the auth fail hook, unless no url rule
+    of the app matches them: those go on to the app, which answers them
+    (404, 405 or a redirect) as it does with RRBAC_ENFORCE. In DB mode
+    without a cached policy every request is passed through.
+    Example::
+        app.wsgi_app = RoleRouteBasedACLMiddleware(
+            app.wsgi_app, rrbac, app, prefixes=['/admin']
+        )
+
+    :param wsgi_app: WSGI application to protect (usually app.wsgi_app)
+    :param acl: RoleRouteBasedACL object
+    :param app: Flask object initialised with acl
+    :param prefixes: only decide requests whose path starts with one of
+    these, None for every path
+    :param identify: function of the WSGI environ returning the role names
+    of the caller, or None when they cannot be known cheaply
+    """
+
+    def __init__(self, wsgi_app, acl, app, prefixes=None, identify=None):
+        self.wsgi_app = wsgi_app
+        self.acl = acl
+        self.app = app
+        self.prefixes = tuple(prefixes) if prefixes else None
+        if identify is None:
+            identify = anonymous_identity(
+                app.config.get('SESSION_COOKIE_NAME', 'session'),
+                app.config.get('REMEMBER_COOKIE_NAME', 'remember_token')
+            )
+        self.identify = identify
+
+    def is_allowed(self, environ):
+        """
+        Return whether the request can go on to the app: True, False, or
+        None when it is left to the in-app check.
+        :param environ: WSGI environ
+        """
+        allowed = self._decide(environ)
+        if allowed is False and self._match_endpoint(environ) is None:
+            # Only matched on denial, so allowed requests are not routed
+            # twice
+            return None
+        return allowed
+
+    def _decide(self, environ):
+        """Decide the request with the policy (see is_allowed)."""
+        path = environ.get('PATH_INFO') or '/'
+        if self.prefixes is not None and not path.startswith(self.prefixes):
+            return None
+        if self.acl._tenant_resolver is not None:
+            # The tenant is resolved from the request, in the app
+            return None
+        state = self.acl._get_state(self.app)
+        policy = self.acl._get_policy(state)
+        if policy is None:
+            return None
+        method = environ.get('REQUEST_METHOD', 'GET')
+        if (state.allow_static and method in ('GET', 'HEAD')) or \
+                self.acl._get_endpoint_roles(state):
+            # Views declared with allow_anonymous / allow_roles, and static
+            # files, are decided by their endpoint
+            declared_roles = self.acl._get_endpoint_access(
+                state, method, self._match_endpoint(environ)
+            )
+            if declared_roles is True:
+                return True
+            if declared_roles is not None:
+                return self._is_declared_allowed(
+                    state, declared_roles, environ
+                )
+        method = state.method_alternates.get(method, method)
+        allowed_mask = state.endpoint_table.get((method, path))
+        if allowed_mask is not None and allowed_mask & policy.anonymous_mask:
+            if policy.sample_rate:
+                policy.sample(policy.anonymous_mask, method, path)
+            return True
+        role_names = self.identify(environ)
+        if role_names is None:
+            return None
+        mask = policy.role_mask(role_names)
+        if allowed_mask is not None:
+            if policy.sample_rate:
+                policy.sample(mask, method, path)
+            return bool(mask & allowed_mask)
+        return policy.is_allowed(mask, method, path)
+
+    def _match_endpoint(self, environ):
+        """Return the endpoint of the request, or None when no url rule of
+        the app matches it.
+        """
+        try:
+            endpoint, _ = self.app.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            return None
+        return endpoint
+
+    def _is_declared_allowed(self, state, declared_roles, environ):
+        """Decide a request to a view declared with allow_roles, or return
+        None when the caller is not identified.
+        """
+        role_names = self.identify(environ)
+        if role_names is None:
+            return None
+        roles = set(role_names)
+        roles.add(state.anonymous_role_name)
+        return not declared_roles.isdisjoint(self.acl._expand_roles(
+            self.acl._get_role_closure(state), roles
+        ))
+
+    def __call__(self, environ, start_response):
+        if self.is_allowed(environ) is False:
+            return Forbidden()(environ, start_response)
+        return self.wsgi_app(environ, start_response)
@@ -0,0 +1,193 @@
+# -*-coding: utf-8
+"""
+    flask_rrbac.minimize
+    ~~~~~~~~~~~~~
+    Removal of the rules of a policy which cannot change a decision
+"""
+
+try:
+    # Python 3.11+, where the sre_* modules are deprecated aliases
+    from re import _constants as sre_constants, _parser as sre_parse
+except ImportError:
+    import sre_constants
+    import sre_parse
+
+from .matching import WerkzeugRules, is_werkzeug_rule
+from .safe_regex import compile_rule
+
+
+def literal_path(rule):
+    """
+    Return the only path a regex rule matches when it is a plain literal
+    (`/orders`, `/orders/new\\.json`), else None.
+    :param rule: rule of the policy
+    """
+    if is_werkzeug_rule(rule):
+        return None
+    try:
+        parsed = sre_parse.parse(rule)
+    except sre_constants.error:
+        return None
+    state = getattr(parsed, 'state', None) or parsed.pattern
+    if state.flags & ~sre_constants.SRE_FLAG_UNICODE:
+        return None
+    if not all(op == sre_constants.LITERAL for op, _ in parsed):
+        return None
+    return u''.join(_unichr(code) for _, code in parsed)
+
+
+try:
+    _unichr = unichr
+except NameError:
+    _unichr = chr
+
+
+class _Rules(object):
+    """Rules of one role and method, matched the way CompiledPolicy matches
+    them.
+    """
+
+    def __init__(self, method, rules, engine):
+        self.method = method
+        self.regexes = [
+            (rule, compile_rule(rule, engine)) for rule in rules
+            if not is_werkzeug_rule(rule)
+        ]
+        werkzeug_rules = [rule for rule in rules if is_werkzeug_rule(rule)]
+        self.werkzeug_rules = WerkzeugRules(
+            {method: werkzeug_rules}
+        ) if werkzeug_rules else None
+
+    def covers(self, path, rule=None):
+        """Return whether one of the rules other than rule matches path."""
+        for other_rule, matcher in self.regexes:
+            if other_rule == rule:
+                continue
+            regex_object = matcher.match(path)
+            if regex_object and regex_object.end() == len(path):
+                return True
+        return self.werkzeug_rules is not None and \
+            self.werkzeug_rules.match(self.method, path)
+
+
+def _average(counts):
+    return float(sum(counts)) / len(counts) if counts else 0.0
+
+
+def minimize_role_route_map(
+    role_route_map, anonymous_role_name, engine='re', duplicate_rules=0,
+    role_closure=None
+):
+    """
+    Remove the rules which cannot change a decision:
+    - literal rules matched by another rule of the same role and method
+    - rules of a role the Anonymous Role also has, since every user holds the
+    Anonymous Role, and literal rules matched by a rule of the Anonymous Role
+    - rules of a role which one of the roles it includes in the hierarchy
+    also has, and literal rules matched by a rule of such a role. Roles of a
+    cycle include each other, so only the roles which do not include the
+    role back count.
+
+    Decisions are unchanged, but roles_for_route (and the role masks of
+    match_mask) no longer list a role for a route it only reaches through a
+    removed rule.
+
+    Input:
+        :param role_route_map: (type: dict) Output of
+        canonicalize_role_route_map
+        :param anonymous_role_name: (type: str) Name of the Anonymous Role
+        :param engine: (type: str) regex rule engine, 're' or 'dfa'
+        :param duplicate_rules: (type: int) Number of duplicate rules already
+        dropped by canonicalize_role_route_map, for the report
+        :param role_closure: (type: dict) Output of policy.role_closure, None
+        without a hierarchy
+    Output:
+        tuple of the minimized map (same roles and methods, tuples of rules)
+        and a report: dict with the number of duplicate_rules,
+        covered_rules, anonymous_rules and inherited_rules removed, the
+        number of rules and the average number of rules per role and method
+        (the number of matches of a decision denied by a role) before and
+        after, and the list of removed (role, method, rule, reason)
+    """
+    role_closure = role_closure or {}
+    matchers = {}
+
+    def role_rules(role, method):
+        """Return the rules of a role and method, and their matcher."""
+        key = (role, method)
+        if key not in matchers:
+            rules = role_route_map.get(role, {}).get(method, ())
+            matchers[key] = (set(rules), _Rules(method, rules, engine))
+        return matchers[key]
+
+    def included_roles(role):
+        return sorted(
+            included for included in role_closure.get(role, ())
+            if role not in role_closure.get(included, ())
+        )
+
+    minimized = {}
+    removed = []
+    for role, method_map in sorted(role_route_map.items()):
+        minimized[role] = {}
+        for method, rules in sorted(method_map.items()):
+            own_rules = _Rules(method, rules, engine)
+            # Roles held along with this one, with the reason of a removal
+            others = []
+            if role != anonymous_role_name:
+                others.append(('anonymous', anonymous_role_name))
+            others.extend(
+                ('inherited', included) for included in included_roles(role)
+            )
+            kept = []
+            for rule in rules:
+                path = literal_path(rule)
+                reason = None
+                for other_reason, other_role in others:
+                    other_set, other_matcher = role_rules(other_role, method)
+                    if rule in other_set or (
+                        path is not None and other_matcher.covers(path)
+                    ):
+                        reason = other_reason
+                        break
+                if reason is None and path is not None and \
+                        own_rules.covers(path, rule):
+                    reason = 'covered'
+                    # A removed rule must not justify removing another one
+                    own_rules.regexes = [
+                        entry for entry in own_rules.regexes
+                        if entry[0] != rule
+                    ]
+                if reason is None:
+                    kept.append(rule)
+                else:
+                    removed.append((role, method, rule, reason))
+            minimized[role][method] = tuple(kept)
+
+    before = [
+        len(rules) for method_map in role_route_map.values()
+        for rules in method_map.values()
+    ]
+    after = [
+        len(rules) for method_map in minimized.values()
+        for rules in method_map.values()
+    ]
+    report = {
+        'duplicate_rules': duplicate_rules,
+        'covered_rules': sum(
+            1 for entry in removed if entry[3] == 'covered'
+        ),
+        'anonymous_rules': sum(
+            1 for entry in removed if entry[3] == 'anonymous'
+        ),
+        'inherited_rules': sum(
+            1 for entry in removed if entry[3] == 'inherited'
+        ),
+        'rules': (sum(before) + duplicate_rules, sum(after)),
+        'rules_per_role_method': (
+            _average(before) + float(duplicate_rules) / (len(before) or 1),
+            _average(after)
+        ),
+        'removed': removed
+    }
+    return minimized, report
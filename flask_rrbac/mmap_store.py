@@ -0,0 +1,216 @@
+# -*-coding: utf-8
+"""
+    flask_rrbac.mmap_store
+    ~~~~~~~~~~~~~
+    Read-only policy store shared by worker processes through mmap
+"""
+
+import binascii
+from datetime import datetime
+import json
+import mmap
+import os
+import struct
+import time
+
+from .policy import canonicalize_role_route_map
+
+MAGIC = b'RRBACMM1'
+
+# magic, mask width, policy offset, policy length, users offset, user count
+_HEADER = struct.Struct('<8sIQQQQ')
+_USER_ID = struct.Struct('<q')
+_EXPIRY_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def _pack_mask(mask, width):
+    return binascii.unhexlify('%0*x' % (width * 2, mask))
+
+
+def _unpack_mask(raw):
+    return int(binascii.hexlify(raw), 16)
+
+
+def write_policy_store(
+    path, role_route_map, user_roles, anonymous_role_name, rule_expiries=None
+):
+    """
+    Write a policy store file.
+
+    The file is written next to the destination and renamed over it, so
+    readers either see the old or the new file, never a partial one.
+
+    File layout (little-endian):
+        header: magic, mask width, policy offset/length, users offset/count
+        policy: utf-8 JSON of the role names (in bit order), the anonymous
+        role name, the canonical role route map and the end of access of
+        its temporary rules
+        users: fixed width records of (int64 user id, role mask), sorted by
+        user id
+
+    Input:
+        :param path: (type: str) Destination of the store file
+        :param role_route_map: (type: dict) role -> method -> rules
+        :param user_roles: (type: iterable) (user id, role name) pairs. User
+        ids have to be integers.
+        :param anonymous_role_name: (type: str) Name of the Anonymous Role
+        :param rule_expiries: (type: dict) (role, method, rule) -> UTC
+        datetime at which the access granted by the rule ends
+    """
+    canonical = canonicalize_role_route_map(role_route_map)
+    role_names = sorted(set(canonical) | set([anonymous_role_name]))
+    role_bits = dict(
+        (name, 1 << index) for index, name in enumerate(role_names)
+    )
+
+    masks = {}
+    for user_id, role_name in user_roles:
+        if role_name not in role_bits:
+            # Roles without rules still get a bit, appended after the others
+            role_bits[role_name] = 1 << len(role_names)
+            role_names.append(role_name)
+        user_id = int(user_id)
+        masks[user_id] = masks.get(user_id, 0) | role_bits[role_name]
+    width = max(1, (len(role_names) + 7) // 8)
+
+    policy = json.dumps({
+        'roles': role_names,
+        'anonymous_role': anonymous_role_name,
+        'role_route_map': canonical,
+        'rule_expiries': sorted(
+            [role, method.upper(), rule, expires_at.strftime(_EXPIRY_FORMAT)]
+            for (role, method, rule), expires_at in (
+                rule_expiries or {}
+            ).items()
+        )
+    }, sort_keys=True).encode('utf-8')
+    policy_offset = _HEADER.size
+    users_offset = policy_offset + len(policy)
+
+    temp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+    with open(temp_path, 'wb') as store_file:
+        store_file.write(_HEADER.pack(
+            MAGIC, width, policy_offset, len(policy), users_offset, len(masks)
+        ))
+        store_file.write(policy)
+        for user_id in sorted(masks):
+            store_file.write(_USER_ID.pack(user_id))
+            store_file.write(_pack_mask(masks[user_id], width))
+        store_file.flush()
+        os.fsync(store_file.fileno())
+    os.rename(temp_path, path)
+
+
+class _MappedFile(object):
+    """One generation of the store file, mapped read-only."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as store_file:
+            self.stat = os.fstat(store_file.fileno())
+            self.buffer = mmap.mmap(
+                store_file.fileno(), 0, access=mmap.ACCESS_READ
+            )
+        (
+            magic, self.mask_width, policy_offset, policy_length,
+            self.users_offset, self.user_count
+        ) = _HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC:
+            raise ValueError('{0} is not a policy store file'.format(path))
+        policy = json.loads(self.buffer[
+            policy_offset:policy_offset + policy_length
+        ].decode('utf-8'))
+        self.role_names = policy['roles']
+        self.anonymous_role_name = policy['anonymous_role']
+        self.role_route_map = policy['role_route_map']
+        self.rule_expiries = dict(
+            ((role, method, rule), datetime.strptime(
+                expires_at, _EXPIRY_FORMAT
+            ))
+            for role, method, rule, expires_at in policy.get(
+                'rule_expiries', ()
+            )
+        )
+        self.record_size = _USER_ID.size + self.mask_width
+
+    def get_mask(self, user_id):
+        low, high = 0, self.user_count
+        while low < high:
+            middle = (low + high) // 2
+            offset = self.users_offset + middle * self.record_size
+            (key,) = _USER_ID.unpack_from(self.buffer, offset)
+            if key < user_id:
+                low = middle + 1
+            elif key > user_id:
+                high = middle
+            else:
+                offset += _USER_ID.size
+                return _unpack_mask(
+                    self.buffer[offset:offset + self.mask_width]
+                )
+        return 0
+
+
+class MmapPolicyStore(object):
+    """Policy and user role map shared between processes through a read-only
+    memory mapped file.
+
+    Every worker maps the same file, so the user role map costs page cache
+    once per host instead of once per worker. The rules are stored in the
+    file as well and compiled by each worker. Updates are published by
+    writing a new file (see write_policy_store) which the readers pick up
+    within check_interval seconds.
+    :param path: path of the store file
+    :param check_interval: seconds between checks for a new store file
+    """
+
+    def __init__(self, path, check_interval=5):
+        self.path = path
+        self.check_interval = check_interval
+        self._mapped = _MappedFile(path)
+        self._checked_at = time.time()
+
+    @property
+    def role_route_map(self):
+        return self._mapped.role_route_map
+
+    @property
+    def rule_expiries(self):
+        """(role, method, rule) -> UTC datetime at which the access granted
+        by the rule ends, for the temporary rules of role_route_map.
+        """
+        return self._mapped.rule_expiries
+
+    @property
+    def anonymous_role_name(self):
+        return self._mapped.anonymous_role_name
+
+    def refresh(self, force=False):
+        """
+        Map the store file again if it has been replaced. Returns True when
+        a new file has been mapped.
+        :param force: check the file even if check_interval has not elapsed
+        """
+        now = time.time()
+        if not force and now - self._checked_at < self.check_interval:
+            return False
+        self._checked_at = now
+        stat = os.stat(self.path)
+        current = self._mapped.stat
+        if (stat.st_ino, stat.st_mtime) == (current.st_ino, current.st_mtime):
+            return False
+        self._mapped = _MappedFile(self.path)
+        return True
+
+    def get_roles(self, user_id):
+        """
+        Return the set of role names of a user, empty when the user is not
+        in the store.
+        :param user_id: integer id of the user (or its string), ValueError
+        otherwise
+        """
+        mapped = self._mapped
+        mask = mapped.get_mask(int(user_id))
+        return set(
+            name for index, name in enumerate(mapped.role_names)
+            if mask & (1 << index)
+        )
@@ -1,8 +1,8 @@
-from acl_role_mixin import ACLRoleMixin
-from acl_role_route_map_mixin import ACLRoleRouteMapMixin
-from acl_route_mixin import ACLRouteMixin
-from acl_user_mixin import ACLUserMixin
-from acl_user_role_map_mixin import ACLUserRoleMapMixin
+from .acl_role_mixin import ACLRoleMixin
+from .acl_role_route_map_mixin import ACLRoleRouteMapMixin
+from .acl_route_mixin import ACLRouteMixin
+from .acl_user_mixin import ACLUserMixin
+from .acl_user_role_map_mixin import ACLUserRoleMapMixin
 
 
 __all__ = [
@@ -1,6 +1,7 @@
 from datetime import datetime
 from sqlalchemy.ext.hybrid import hybrid_property
-from sqlalchemy import func, case
+
+from .expressions import is_deleted_case
 
 
 class ACLRoleMixin(object):
@@ -31,10 +32,7 @@ class ACLRoleMixin(object):
     @is_deleted.expression
     def is_deleted(cls):
         try:
-            return case([
-                (cls.deleted_at == None, False),
-                (cls.deleted_at > func.now(), False)
-            ], else_=True)
+            return is_deleted_case(cls)
         except AttributeError:
             return False
 
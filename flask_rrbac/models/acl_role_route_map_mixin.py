@@ -1,6 +1,7 @@
 from datetime import datetime
 from sqlalchemy.ext.hybrid import hybrid_property
-from sqlalchemy import func, case
+
+from .expressions import is_deleted_case
 
 
 class ACLRoleRouteMapMixin(object):
@@ -63,9 +64,6 @@ class ACLRoleRouteMapMixin(object):
     @is_deleted.expression
     def is_deleted(cls):
         try:
-            return case([
-                (cls.deleted_at == None, False),
-                (cls.deleted_at > func.now(), False)
-            ], else_=True)
+            return is_deleted_case(cls)
         except AttributeError:
             return False
@@ -0,0 +1,22 @@
+from sqlalchemy import __version__ as sqlalchemy_version
+from sqlalchemy import case, func
+
+
+def is_deleted_case(cls):
+    """
+    SQL expression of the ``is_deleted`` hybrid of a model with a
+    ``deleted_at`` column: a row is deleted once ``deleted_at`` has passed
+
+    SQLAlchemy 1.4 takes the ``whens`` of ``case()`` as positional
+    arguments, and 2.0 no longer accepts them as a list.
+
+    :param cls: The model class
+    """
+    whens = [
+        (cls.deleted_at == None, False),
+        (cls.deleted_at > func.now(), False)
+    ]
+    if tuple(int(part) for part in sqlalchemy_version.split('.')[:2]) \
+            < (1, 4):
+        return case(whens, else_=True)
+    return case(*whens, else_=True)
@@ -0,0 +1,614 @@
+# -*-coding: utf-8
+"""
+    flask_rrbac.policy
+    ~~~~~~~~~~~~~
+    Compiled, read-only form of a role-route mapping
+"""
+
+import json
+import threading
+import time
+import weakref
+from hashlib import sha1
+
+from .matching import WerkzeugRules, is_werkzeug_rule, sample_paths
+from .minimize import minimize_role_route_map
+from .safe_regex import compile_rule
+
+# Compiled policies by fingerprint and rule options, so that apps with
+# identical policies share one compiled policy.
+_shared_policies = weakref.WeakValueDictionary()
+_shared_policies_lock = threading.Lock()
+
+# Number of sampled decisions between two reorderings of the rules
+REORDER_INTERVAL = 1000
+
+
+def canonicalize_role_route_map(role_route_map):
+    """
+    Return a canonical copy of a role route map.
+
+    Methods are upper cased and the rules of every role-method combination are
+    de-duplicated and sorted, so that two equivalent maps are always equal.
+
+    Input:
+        :param role_route_map: (type: dict) role -> method -> iterable of rules
+    Output:
+        dict of role -> method -> tuple of rules
+    """
+    canonical = {}
+    for role, method_map in role_route_map.items():
+        canonical[role] = {}
+        for method, rules in (method_map or {}).items():
+            canonical[role][method.upper()] = tuple(sorted(set(rules or ())))
+    return canonical
+
+
+def drop_expired_rules(role_route_map, rule_expiries, now):
+    """
+    Remove the rules whose access has ended from a role route map.
+
+    Input:
+        :param role_route_map: (type: dict) role -> method -> rules
+        :param rule_expiries: (type: dict) (role, method, rule) -> datetime
+        at which the access granted by the rule ends
+        :param now: (type: datetime) current UTC time
+    Output:
+        (role route map, datetime of the next end of access or None)
+    """
+    expired = []
+    next_expiry = None
+    for key, expires_at in rule_expiries.items():
+        if expires_at <= now:
+            expired.append(key)
+        elif next_expiry is None or expires_at < next_expiry:
+            next_expiry = expires_at
+    if expired:
+        role_route_map = dict(
+            (role, dict(
+                (method, set(rules or ()))
+                for method, rules in (method_map or {}).items()
+            ))
+            for role, method_map in role_route_map.items()
+        )
+        for role, method, rule in expired:
+            role_route_map.get(role, {}).get(method, set()).discard(rule)
+    return role_route_map, next_expiry
+
+
+def role_closure(role_hierarchy):
+    """
+    Return the transitive closure of a role hierarchy. Cycles are allowed:
+    the roles of a cycle include each other.
+
+    Input:
+        :param role_hierarchy: (type: dict) role -> iterable of the roles it
+        includes (inherits the rules of)
+    Output:
+        dict of role -> frozenset of the roles it includes, itself included,
+        for every role of the hierarchy
+    """
+    role_hierarchy = role_hierarchy or {}
+    closure = {}
+    roles = set(role_hierarchy)
+    for included in role_hierarchy.values():
+        roles.update(included or ())
+    for role in roles:
+        included = set([role])
+        stack = [role]
+        while stack:
+            for parent in role_hierarchy.get(stack.pop()) or ():
+                if parent not in included:
+                    included.add(parent)
+                    stack.append(parent)
+        closure[role] = frozenset(included)
+    return closure
+
+
+def canonicalize_role_hierarchy(role_hierarchy):
+    """
+    Return a canonical, hashable copy of a role hierarchy: a sorted tuple of
+    (role, sorted tuple of included roles), without the roles including
+    nothing.
+
+    Input:
+        :param role_hierarchy: (type: dict) role -> iterable of roles
+    Output:
+        tuple
+    """
+    return tuple(sorted(
+        (role, tuple(sorted(set(included))))
+        for role, included in (role_hierarchy or {}).items() if included
+    ))
+
+
+def policy_fingerprint(canonical_map, anonymous_role_name):
+    """
+    Return a stable hash of a canonical role route map.
+
+    Input:
+        :param canonical_map: (type: dict) Output of
+        canonicalize_role_route_map
+        :param anonymous_role_name: (type: str) Name of the Anonymous Role
+    Output:
+        str
+    """
+    document = json.dumps(
+        [anonymous_role_name, canonical_map], sort_keys=True
+    )
+    return sha1(document.encode('utf-8')).hexdigest()
+
+
+class CompiledPolicy(object):
+    """Compiled form of a role route map.
+
+    Every role gets a bit in a role mask and every rule is compiled once:
+    regex rules with the rule engine (see safe_regex.compile_rule), and the
+    Werkzeug rules of a role into one Map.
+    Decisions for an application's plain (argument-less) url rules can be
+    precomputed into an endpoint permission table with build_endpoint_table.
+
+    With lazy, the rules of a role are only compiled when the role is first
+    used, under a lock of that role. Otherwise (and after compile_all) the
+    object is only read once it has been built, so it can be shared between
+    threads and inherited copy-on-write by forked workers.
+
+    With minimize, the rules which cannot change a decision are removed
+    before anything is compiled (see minimize.minimize_role_route_map), and
+    what was removed is reported in minimize_report.
+
+    With sample_rate, one decision in sample_rate is matched against every
+    rule of the roles in the mask and the matching rules and roles are
+    counted (see rule_usage). Every REORDER_INTERVAL sampled decisions, the
+    roles and the rules of every role are reordered so that the most
+    matched ones are tried first.
+    :param role_route_map: dict of role -> method -> iterable of rules
+    :param anonymous_role_name: name of the Anonymous Role
+    :param lazy: compile the rules of every role on first use
+    :param engine: 're', or 'dfa' to match regex rules in linear time
+    :param guard: None, 'warn' or 'reject' regex rules prone to catastrophic
+    backtracking, when they are compiled
+    :param minimize: remove the rules which cannot change a decision
+    :param sample_rate: count the matching rules of one decision in that
+    many, 0 for none
+    :param role_hierarchy: dict of role -> iterable of the roles it includes.
+    Its transitive closure is expanded into the masks of role_mask, so a
+    role carries the rules of the roles it includes at no cost per decision.
+    """
+
+    def __init__(
+        self, role_route_map, anonymous_role_name, lazy=False, engine='re',
+        guard=None, minimize=False, sample_rate=0, role_hierarchy=None
+    ):
+        self.anonymous_role_name = anonymous_role_name
+        self.engine = engine
+        self.guard = guard
+        self.role_route_map = canonicalize_role_route_map(role_route_map)
+        self.fingerprint = policy_fingerprint(
+            self.role_route_map, anonymous_role_name
+        )
+        self.role_hierarchy = canonicalize_role_hierarchy(role_hierarchy)
+        self.role_closure = role_closure(dict(self.role_hierarchy))
+        self.minimize_report = None
+        if minimize:
+            duplicate_rules = sum(
+                len(list(rules or ())) - len(set(rules or ()))
+                for method_map in role_route_map.values()
+                for rules in (method_map or {}).values()
+            )
+            self.role_route_map, self.minimize_report = \
+                minimize_role_route_map(
+                    self.role_route_map, anonymous_role_name, engine,
+                    duplicate_rules, self.role_closure
+                )
+
+        role_names = set(self.role_route_map) | set(self.role_closure)
+        role_names.add(anonymous_role_name)
+        self.role_bits = dict(
+            (name, 1 << index) for index, name in enumerate(sorted(role_names))
+        )
+        # Mask of every role with the bits of the roles it includes
+        self.role_masks = dict(self.role_bits)
+        for name, included in self.role_closure.items():
+            for included_name in included:
+                self.role_masks[name] |= self.role_bits[included_name]
+        self.anonymous_mask = self.role_masks[anonymous_role_name]
+        self._role_order = tuple(sorted(self.role_bits.items()))
+
+        self.sample_rate = sample_rate
+        self._decisions = 0
+        self.reset_rule_stats()
+
+        self.lazy = lazy
+        self.lazily_compiled_roles = 0
+        self._matchers = {}
+        self._rule_index = None
+        self.reset_locks()
+        if not lazy:
+            self.compile_all()
+
+    def reset_locks(self):
+        """Create new locks, e.g. in a worker forked while a lock was held.
+        """
+        self._stats_lock = threading.Lock()
+        self._role_locks = dict(
+            (role, threading.Lock()) for role in self.role_bits
+        )
+
+    def compile_all(self):
+        """Compile the rules of every role which has not been compiled yet.
+        """
+        for role in self.role_bits:
+            if role not in self._matchers:
+                self._compile_role(role, lazily=False)
+
+    def compile_stats(self):
+        """Return the number of roles, compiled roles and roles compiled
+        lazily (on first use).
+        """
+        return {
+            'roles': len(self.role_bits),
+            'compiled_roles': len(self._matchers),
+            'lazily_compiled_roles': self.lazily_compiled_roles
+        }
+
+    def _compile_role(self, role, lazily):
+        with self._role_locks[role]:
+            matchers = self._matchers.get(role)
+            if matchers is None:
+                regexes = {}
+                werkzeug_rules = {}
+                for method, rules in self.role_route_map.get(role, {}).items():
+                    regexes[method] = tuple(
+                        (rule, self._compile_rule(rule)) for rule in rules
+                        if not is_werkzeug_rule(rule)
+                    )
+                    rules = [rule for rule in rules if is_werkzeug_rule(rule)]
+                    if rules:
+                        werkzeug_rules[method] = rules
+                matchers = (
+                    regexes,
+                    WerkzeugRules(werkzeug_rules) if werkzeug_rules else None
+                )
+                self._matchers[role] = matchers
+                if lazily:
+                    with self._stats_lock:
+                        self.lazily_compiled_roles += 1
+        return matchers
+
+    def _compile_rule(self, rule):
+        return compile_rule(rule, self.engine, self.guard)
+
+    def _role_matchers(self, role):
+        matchers = self._matchers.get(role)
+        if matchers is None:
+            matchers = self._compile_role(role, lazily=True)
+        return matchers
+
+    def role_mask(self, role_names):
+        """
+        Return the role mask for a set of role names, with the roles they
+        include. The Anonymous Role is always part of the mask. Unknown roles
+        carry no rules and are ignored.
+        :param role_names: iterable of role names
+        """
+        mask = self.anonymous_mask
+        role_masks = self.role_masks
+        for name in role_names:
+            mask |= role_masks.get(name, 0)
+        return mask
+
+    def roles_from_mask(self, mask):
+        """
+        Return the names of the roles in a role mask.
+        :param mask: Role mask
+        """
+        return set(
+            name for name, bit in self.role_bits.items() if mask & bit
+        )
+
+    def roles_granted(self, mask):
+        """
+        Return the names of the roles which have, directly or through the
+        roles they include, one of the roles in a role mask.
+        :param mask: Role mask (e.g. of match_mask)
+        """
+        return set(
+            name for name, role_mask in self.role_masks.items()
+            if mask & role_mask
+        )
+
+    def _get_rule_index(self):
+        """
+        Return the reverse index of the policy: method -> tuple of (compiled
+        rule, mask of the roles having the rule). A rule shared by several
+        roles is matched only once. Werkzeug rules are compiled into a
+        WerkzeugRules of their own.
+        """
+        rule_index = self._rule_index
+        if rule_index is None:
+            masks = {}
+            for role, method_map in self.role_route_map.items():
+                for method, rules in method_map.items():
+                    for rule in rules:
+                        masks[(method, rule)] = masks.get(
+                            (method, rule), 0
+                        ) | self.role_bits[role]
+            rule_index = {}
+            for (method, rule), mask in sorted(masks.items()):
+                if is_werkzeug_rule(rule):
+                    matcher = WerkzeugRules({method: [rule]})
+                else:
+                    matcher = self._compile_rule(rule)
+                rule_index.setdefault(method, []).append((matcher, mask))
+            rule_index = self._rule_index = dict(
+                (method, tuple(entries))
+                for method, entries in rule_index.items()
+            )
+        return rule_index
+
+    def match_mask(self, method, path):
+        """
+        Return the mask of all the roles having a rule that matches the path
+        for the method.
+        :param method: Http method of the request
+        :param path: Path of the request
+        """
+        mask = 0
+        for matcher, rule_mask in self._get_rule_index().get(method, ()):
+            if mask & rule_mask == rule_mask:
+                continue
+            if isinstance(matcher, WerkzeugRules):
+                if matcher.match(method, path):
+                    mask |= rule_mask
+                continue
+            regex_object = matcher.match(path)
+            if regex_object and regex_object.end() == len(path):
+                mask |= rule_mask
+        return mask
+
+    def is_allowed(self, mask, method, path):
+        """
+        Return whether any of the roles in the mask can access the path.
+        :param mask: Role mask of the user (see role_mask)
+        :param method: Http method of the request
+        :param path: Path of the request
+        """
+        if self.sample_rate:
+            self.sample(mask, method, path)
+        for role, bit in self._role_order:
+            if not mask & bit:
+                continue
+            regexes, werkzeug_rules = self._role_matchers(role)
+            for _, matcher in regexes.get(method, ()):
+                regex_object = matcher.match(path)
+                if regex_object and regex_object.end() == len(path):
+                    return True
+            if werkzeug_rules is not None and \
+                    werkzeug_rules.match(method, path):
+                return True
+        return False
+
+    def reset_rule_stats(self):
+        """Start a new window of rule usage statistics."""
+        self._sampled_decisions = 0
+        self._rule_hits = {}
+        self._role_hits = {}
+        self._stats_since = time.time()
+
+    def sample(self, mask, method, path):
+        """
+        Count the rules matching the path for the roles in the mask, for one
+        call in sample_rate. Decisions made without matching (e.g. from an
+        endpoint permission table) are passed here so that their rules are
+        counted too. The call counter is not locked: a few calls may be lost
+        to concurrent increments, which only shifts the sampling.
+        :param mask: Role mask of the user (see role_mask)
+        :param method: Http method of the request
+        :param path: Path of the request
+        """
+        if not self.sample_rate:
+            return
+        self._decisions += 1
+        if self._decisions % self.sample_rate:
+            return
+        hits = []
+        for role, bit in self._role_order:
+            if not mask & bit:
+                continue
+            regexes, werkzeug_rules = self._role_matchers(role)
+            for rule, matcher in regexes.get(method, ()):
+                regex_object = matcher.match(path)
+                if regex_object and regex_object.end() == len(path):
+                    hits.append((role, method, rule))
+            if werkzeug_rules is not None:
+                rule = werkzeug_rules.match_rule(method, path)
+                if rule is not None:
+                    hits.append((role, method, rule))
+        with self._stats_lock:
+            self._sampled_decisions += 1
+            for key in hits:
+                self._rule_hits[key] = self._rule_hits.get(key, 0) + 1
+            for role in set(key[0] for key in hits):
+                self._role_hits[role] = self._role_hits.get(role, 0) + 1
+            if self._sampled_decisions % REORDER_INTERVAL == 0:
+                self._reorder()
+
+    def _reorder(self):
+        """Try the most matched roles and rules first. Called with the stats
+        lock held; the new orders replace the old ones in single
+        assignments, so concurrent decisions see one or the other.
+        """
+        role_hits = self._role_hits
+        self._role_order = tuple(sorted(
+            self.role_bits.items(),
+            key=lambda item: (-role_hits.get(item[0], 0), item[0])
+        ))
+        rule_hits = self._rule_hits
+        for role, (regexes, werkzeug_rules) in list(self._matchers.items()):
+            self._matchers[role] = (dict(
+                (method, tuple(sorted(
+                    matchers, key=lambda entry: (
+                        -rule_hits.get((role, method, entry[0]), 0),
+                        entry[0]
+                    )
+                )))
+                for method, matchers in regexes.items()
+            ), werkzeug_rules)
+
+    def rule_usage(self, reset=False):
+        """
+        Return the usage statistics of the rules since the start of the
+        window (the creation of the policy or the last reset).
+        :param reset: start a new window
+        Output:
+            dict with the start of the window (since, a timestamp), the
+            number of sampled_decisions, the role_hits and rule_hits (keyed by
+            (role, method, rule)) of the sampled decisions, and the
+            dead_rules, never matched in the window, sorted
+        """
+        with self._stats_lock:
+            rule_hits = dict(self._rule_hits)
+            usage = {
+                'since': self._stats_since,
+                'sampled_decisions': self._sampled_decisions,
+                'role_hits': dict(self._role_hits),
+                'rule_hits': rule_hits,
+                'dead_rules': sorted(
+                    (role, method, rule)
+                    for role, method_map in self.role_route_map.items()
+                    for method, rules in method_map.items()
+                    for rule in rules
+                    if (role, method, rule) not in rule_hits
+                )
+            }
+            if reset:
+                self.reset_rule_stats()
+        return usage
+
+    def build_endpoint_table(self, url_rules, method_alternates):
+        """
+        Return the allowed role mask of every argument-less url rule, as a
+        dict of (method, path) -> role mask.
+        :param url_rules: iterable of werkzeug rules (app.url_map.iter_rules())
+        :param method_alternates: dict of method -> equivalent method
+        """
+        table = {}
+        for rule in url_rules:
+            if rule.arguments:
+                continue
+            for method in rule.methods or ():
+                method = method_alternates.get(method, method)
+                if (method, rule.rule) not in table:
+                    table[(method, rule.rule)] = self.match_mask(
+                        method, rule.rule
+                    )
+        return table
+
+
+def shared_policy(
+    role_route_map, anonymous_role_name, lazy=False, engine='re', guard=None,
+    minimize=False, sample_rate=0, role_hierarchy=None
+):
+    """
+    Return the compiled policy for a role route map, reusing the compiled
+    policy of an identical map (same fingerprint and rule options) while it
+    is alive.
+
+    Input:
+        :param role_route_map: (type: dict) role -> method -> rules
+        :param anonymous_role_name: (type: str) Name of the Anonymous Role
+        :param lazy: (type: bool) compile the rules of every role on first use
+        :param engine: (type: str) regex rule engine, 're' or 'dfa'
+        :param guard: (type: str) None, 'warn' or 'reject' unsafe regex rules
+        :param minimize: (type: bool) remove the rules which cannot change a
+        decision
+        :param sample_rate: (type: int) count the matching rules of one
+        decision in that many, 0 for none
+        :param role_hierarchy: (type: dict) role -> roles it includes
+    Output:
+        CompiledPolicy
+    """
+    key = (
+        policy_fingerprint(
+            canonicalize_role_route_map(role_route_map), anonymous_role_name
+        ),
+        engine, guard, minimize, sample_rate,
+        canonicalize_role_hierarchy(role_hierarchy)
+    )
+    with _shared_policies_lock:
+        policy = _shared_policies.get(key)
+        if policy is None:
+            policy = CompiledPolicy(
+                role_route_map, anonymous_role_name, lazy=lazy, engine=engine,
+                guard=guard, minimize=minimize, sample_rate=sample_rate,
+                role_hierarchy=role_hierarchy
+            )
+            _shared_policies[key] = policy
+    if not lazy:
+        policy.compile_all()
+    return policy
+
+
+def reset_shared_policy_lock():
+    """Create a new lock for the shared policies, e.g. in a forked worker.
+    """
+    global _shared_policies_lock
+    _shared_policies_lock = threading.Lock()
+
+
+class RouteMatrix(object):
+    """Allowed role mask of every (rule, method) of an application.
+
+    The routes accessible with a role mask are computed once per distinct
+    mask and cached, so users with the same set of roles share the result.
+    A rule with variables is allowed for the roles which can access one of
+    its sample paths (see matching.sample_paths), e.g. a `/orders/[0-9]+`
+    policy rule allows `/orders/<int:order_id>`.
+    :param policy: CompiledPolicy the masks are computed with
+    :param app_routes: dict of rule -> methods (see get_app_routes)
+    :param max_cached_masks: maximum number of distinct role masks cached
+    """
+
+    def __init__(self, policy, app_routes, max_cached_masks=1024):
+        self.policy = policy
+        self.max_cached_masks = max_cached_masks
+        self.entries = tuple(
+            (rule, method, self._rule_mask(method, rule))
+            for rule, methods in sorted(app_routes.items())
+            for method in sorted(methods)
+        )
+        self._routes_by_mask = {}
+
+    def _rule_mask(self, method, rule):
+        """Return the mask of the roles allowed on the rule itself or on one
+        of its sample paths.
+        """
+        mask = self.policy.match_mask(method, rule)
+        for path in sample_paths(rule):
+            if path != rule:
+                mask |= self.policy.match_mask(method, path)
+        return mask
+
+    def accessible_routes(self, mask):
+        """
+        Return the rules accessible with the role mask, with their methods.
+        :param mask: Role mask (see CompiledPolicy.role_mask)
+        Output:
+            dict of rule -> frozenset of methods, shared by all the callers
+            with the same mask (do not modify it)
+        """
+        routes = self._routes_by_mask.get(mask)
+        if routes is None:
+            methods_by_rule = {}
+            for rule, method, allowed_mask in self.entries:
+                if mask & allowed_mask:
+                    methods_by_rule.setdefault(rule, set()).add(method)
+            routes = dict(
+                (rule, frozenset(methods))
+                for rule, methods in methods_by_rule.items()
+            )
+            if len(self._routes_by_mask) >= self.max_cached_masks:
+                self._routes_by_mask.clear()
+            self._routes_by_mask[mask] = routes
+        return routes
@@ -0,0 +1,452 @@
+# -*-coding: utf-8
+"""
+    flask_rrbac.safe_regex
+    ~~~~~~~~~~~~~
+    Detection of rules prone to catastrophic backtracking, and a linear-time
+    matching engine for a subset of the regex syntax
+"""
+
+import re
+import threading
+import warnings
+
+try:
+    # Python 3.11+, where the sre_* modules are deprecated aliases
+    from re import _constants as sre_constants, _parser as sre_parse
+except ImportError:
+    import sre_constants
+    import sre_parse
+
+RULE_ENGINES = ('re', 'dfa')
+RULE_GUARDS = (None, 'warn', 'reject')
+
+# Limits of the linear-time engine
+_MAX_NFA_STATES = 5000
+_MAX_CACHED_TRANSITIONS = 100000
+
+# Compiled rules used by compile_rule_cached
+_compiled_rules = {}
+_compiled_rules_lock = threading.Lock()
+_MAX_COMPILED_RULES = 10000
+
+
+class UnsafeRuleError(ValueError):
+    """A rule is prone to catastrophic backtracking."""
+
+
+class UnsafeRuleWarning(UserWarning):
+    """A rule is prone to catastrophic backtracking."""
+
+
+class UnsupportedRuleError(ValueError):
+    """A rule uses syntax the linear-time engine does not support."""
+
+
+_REPEATS = (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT)
+
+# Any character, for _first_characters
+_ANY = object()
+
+
+def _body(subpattern_av):
+    # (group, pattern) before Python 3.6, (group, add, del, pattern) after
+    return subpattern_av[-1]
+
+
+def _first_characters(items):
+    """Return the set of character codes the items can start with, _ANY when
+    it may be any character, or None when it is not known.
+    """
+    for op, av in items:
+        if op == sre_constants.LITERAL:
+            return frozenset([av])
+        if op == sre_constants.SUBPATTERN:
+            return _first_characters(_body(av))
+        if op in _REPEATS and av[0] > 0:
+            return _first_characters(av[2])
+        if op == sre_constants.ANY:
+            return _ANY
+        if op == sre_constants.IN:
+            codes = set()
+            for in_op, in_av in av:
+                if in_op == sre_constants.LITERAL:
+                    codes.add(in_av)
+                elif in_op == sre_constants.RANGE and \
+                        in_av[1] - in_av[0] < 256:
+                    codes.update(range(in_av[0], in_av[1] + 1))
+                elif in_op == sre_constants.CATEGORY and \
+                        str(in_av).lower() in _ASCII_CATEGORIES:
+                    codes.update(_ASCII_CATEGORIES[str(in_av).lower()])
+                else:
+                    return _ANY
+            return frozenset(codes)
+        return None
+    return None
+
+
+def _flatten(items):
+    for op, av in items:
+        if op == sre_constants.SUBPATTERN:
+            for item in _flatten(_body(av)):
+                yield item
+        else:
+            yield op, av
+
+
+def _only_repeats(items):
+    """Return whether the items are only quantified expressions, one of them
+    repeated more than once, so a string can be split between them in many
+    ways (`a+`, `a+b*`).
+    """
+    items = list(_flatten(items))
+    return bool(items) and all(op in _REPEATS for op, _ in items) and \
+        any(av[1] > 1 for _, av in items)
+
+
+def _has_overlapping_branch(items):
+    for op, av in _flatten(items):
+        if op == sre_constants.BRANCH:
+            seen = set()
+            for branch in av[1]:
+                first = _first_characters(branch)
+                if first is None:
+                    continue
+                if first is _ANY:
+                    if seen:
+                        return True
+                    seen = _ANY
+                elif seen is _ANY or first & seen:
+                    return True
+                else:
+                    seen |= first
+    return False
+
+
+def _find_hazard(items):
+    for op, av in items:
+        if op in _REPEATS:
+            low, high, body = av
+            if high == sre_constants.MAXREPEAT:
+                if _only_repeats(body):
+                    return 'nested quantifier'
+                if _has_overlapping_branch(body):
+                    return 'quantified alternation of overlapping branches'
+            hazard = _find_hazard(body)
+            if hazard:
+                return hazard
+        elif op == sre_constants.SUBPATTERN:
+            hazard = _find_hazard(_body(av))
+            if hazard:
+                return hazard
+        elif op == sre_constants.BRANCH:
+            for branch in av[1]:
+                hazard = _find_hazard(branch)
+                if hazard:
+                    return hazard
+    return None
+
+
+def find_backtracking_hazard(rule):
+    """
+    Return why a regex rule may take exponential time with a backtracking
+    engine, or None. This is a heuristic: it looks for an unbounded
+    quantifier applied to quantified expressions only (`(a+)+`, `(\\d*\\w*)*`)
+    or to alternatives which can start with the same character
+    (`(aa|\\w\\w)*`).
+    :param rule: regex rule
+    """
+    try:
+        return _find_hazard(sre_parse.parse(rule))
+    except (sre_constants.error, RuntimeError):
+        return None
+
+
+def check_rule(rule, guard):
+    """
+    Apply the guard to a regex rule: warn (UnsafeRuleWarning) or raise
+    UnsafeRuleError when it is prone to catastrophic backtracking.
+    :param rule: regex rule
+    :param guard: None, 'warn' or 'reject'
+    """
+    if guard is None:
+        return
+    hazard = find_backtracking_hazard(rule)
+    if hazard is None:
+        return
+    message = 'Rule {0!r} is prone to catastrophic backtracking: {1}'.format(
+        rule, hazard
+    )
+    if guard == 'reject':
+        raise UnsafeRuleError(message)
+    warnings.warn(message, UnsafeRuleWarning, stacklevel=3)
+
+
+_DIGITS = frozenset(range(ord('0'), ord('9') + 1))
+_WORDS = _DIGITS | frozenset(
+    list(range(ord('a'), ord('z') + 1)) +
+    list(range(ord('A'), ord('Z') + 1)) + [ord('_')]
+)
+_SPACES = frozenset(ord(space) for space in ' \t\n\r\f\v')
+_ASCII_CATEGORIES = {
+    'category_digit': _DIGITS,
+    'category_word': _WORDS,
+    'category_space': _SPACES
+}
+
+
+def _category(name, unicode_flag):
+    if unicode_flag:
+        tests = {
+            'digit': lambda code: _unichr(code).isdigit(),
+            'word': lambda code: (
+                _unichr(code).isalnum() or code == ord('_')
+            ),
+            'space': lambda code: _unichr(code).isspace()
+        }
+    else:
+        tests = {
+            'digit': _DIGITS.__contains__,
+            'word': _WORDS.__contains__,
+            'space': _SPACES.__contains__
+        }
+    for kind, test in tests.items():
+        if name == 'category_' + kind:
+            return test
+        if name == 'category_not_' + kind:
+            return lambda code, test=test: not test(code)
+    raise UnsupportedRuleError('Unsupported category {0}'.format(name))
+
+
+try:
+    _unichr = unichr
+except NameError:
+    _unichr = chr
+
+
+class _FullMatch(object):
+    """Result of LinearRule.match, with the part of the match API the
+    policy uses.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def end(self):
+        return len(self.path)
+
+    def group(self):
+        return self.path
+
+
+class LinearRule(object):
+    """A regex rule compiled to an NFA which is matched as a lazily built
+    DFA, so matching takes time linear in the length of the path whatever
+    the rule.
+
+    The supported subset is literals, `.`, character classes, `\\d \\w \\s`,
+    groups, alternation, greedy or lazy `* + ? {m,n}`, and `^`/`$` at the
+    ends of the rule. Back references, lookarounds, other anchors and
+    flags other than `(?s)` raise UnsupportedRuleError. A rule matches when
+    it can match the whole path (re, which stops at the first match found,
+    can miss some of these, e.g. `/a|/ab` for `/ab`).
+    :param rule: regex rule
+    """
+
+    def __init__(self, rule):
+        self.rule = rule
+        try:
+            parsed = sre_parse.parse(rule)
+        except sre_constants.error as error:
+            raise UnsupportedRuleError(str(error))
+        state = getattr(parsed, 'state', None) or parsed.pattern
+        flags = state.flags
+        if flags & (sre_constants.SRE_FLAG_IGNORECASE |
+                    sre_constants.SRE_FLAG_LOCALE):
+            raise UnsupportedRuleError('Unsupported flags in ' + rule)
+        self._dotall = bool(flags & sre_constants.SRE_FLAG_DOTALL)
+        self._unicode = bool(flags & sre_constants.SRE_FLAG_UNICODE)
+        items = list(parsed)
+        if items and items[0][0] == sre_constants.AT and items[0][1] in (
+            sre_constants.AT_BEGINNING, sre_constants.AT_BEGINNING_STRING
+        ):
+            items = items[1:]
+        if items and items[-1][0] == sre_constants.AT and items[-1][1] in (
+            sre_constants.AT_END, sre_constants.AT_END_STRING
+        ):
+            items = items[:-1]
+        # NFA states: [predicate or None, out, alternative out]. A state
+        # with a predicate consumes one character; one without is a split;
+        # the match state is 0.
+        self._states = [[None, None, None]]
+        start = self._build_sequence(items, 0)
+        self._start = self._closure([start])
+        self._transitions = {}
+        self._cached_transitions = 0
+
+    def _new_state(self, predicate=None, out=None, alternative=None):
+        if len(self._states) >= _MAX_NFA_STATES:
+            raise UnsupportedRuleError('Rule too large: ' + self.rule)
+        self._states.append([predicate, out, alternative])
+        return len(self._states) - 1
+
+    def _build_sequence(self, items, out):
+        for op, av in reversed(list(items)):
+            out = self._build(op, av, out)
+        return out
+
+    def _build(self, op, av, out):
+        if op == sre_constants.LITERAL:
+            return self._new_state(lambda code, av=av: code == av, out)
+        if op == sre_constants.NOT_LITERAL:
+            return self._new_state(lambda code, av=av: code != av, out)
+        if op == sre_constants.ANY:
+            if self._dotall:
+                return self._new_state(lambda code: True, out)
+            return self._new_state(lambda code: code != 10, out)
+        if op == sre_constants.IN:
+            return self._new_state(self._class_predicate(av), out)
+        if op == sre_constants.SUBPATTERN:
+            return self._build_sequence(_body(av), out)
+        if op == sre_constants.BRANCH:
+            starts = [self._build_sequence(branch, out) for branch in av[1]]
+            start = starts[-1]
+            for branch_start in reversed(starts[:-1]):
+                start = self._new_state(None, branch_start, start)
+            return start
+        if op in _REPEATS:
+            low, high, body = av
+            if high == sre_constants.MAXREPEAT:
+                loop = self._new_state(None, None, out)
+                self._states[loop][1] = self._build_sequence(body, loop)
+                start = loop
+            else:
+                start = out
+                for _ in range(high - low):
+                    start = self._new_state(
+                        None, self._build_sequence(body, start), out
+                    )
+            for _ in range(low):
+                start = self._build_sequence(body, start)
+            return start
+        raise UnsupportedRuleError(
+            'Unsupported {0} in {1!r}'.format(op, self.rule)
+        )
+
+    def _class_predicate(self, items):
+        negate = False
+        tests = []
+        for op, av in items:
+            if op == sre_constants.NEGATE:
+                negate = True
+            elif op == sre_constants.LITERAL:
+                tests.append(lambda code, av=av: code == av)
+            elif op == sre_constants.RANGE:
+                tests.append(lambda code, av=av: av[0] <= code <= av[1])
+            elif op == sre_constants.CATEGORY:
+                tests.append(_category(str(av).lower(), self._unicode))
+            else:
+                raise UnsupportedRuleError(
+                    'Unsupported {0} in {1!r}'.format(op, self.rule)
+                )
+        tests = tuple(tests)
+        if negate:
+            return lambda code: not any(test(code) for test in tests)
+        return lambda code: any(test(code) for test in tests)
+
+    def _closure(self, states):
+        """Return the set of states reachable from states through splits."""
+        closure = set()
+        stack = list(states)
+        while stack:
+            index = stack.pop()
+            if index is None or index in closure:
+                continue
+            closure.add(index)
+            predicate, out, alternative = self._states[index]
+            if predicate is None and index != 0:
+                stack.append(out)
+                stack.append(alternative)
+        return frozenset(closure)
+
+    def _step(self, current, character):
+        code = ord(character)
+        following = []
+        for index in current:
+            predicate, out, _ = self._states[index]
+            if predicate is not None and predicate(code):
+                following.append(out)
+        return self._closure(following)
+
+    def match(self, path):
+        """
+        Return a match object when the rule matches the whole path, else
+        None.
+        :param path: Path to match
+        """
+        current = self._start
+        transitions = self._transitions
+        for character in path:
+            state_transitions = transitions.get(current)
+            if state_transitions is None:
+                if self._cached_transitions >= _MAX_CACHED_TRANSITIONS:
+                    transitions.clear()
+                    self._cached_transitions = 0
+                state_transitions = transitions[current] = {}
+            following = state_transitions.get(character)
+            if following is None:
+                following = self._step(current, character)
+                state_transitions[character] = following
+                self._cached_transitions += 1
+            if not following:
+                return None
+            current = following
+        if 0 in current:
+            return _FullMatch(path)
+        return None
+
+
+def compile_rule(rule, engine='re', guard=None):
+    """
+    Compile a regex rule for matching paths.
+
+    Input:
+        :param rule: (type: str) regex rule
+        :param engine: (type: str) 're', or 'dfa' for the linear-time engine.
+        Rules it does not support are compiled with re, with a warning.
+        :param guard: (type: str) None, 'warn' or 'reject' rules prone to
+        catastrophic backtracking (see check_rule). With the dfa engine only
+        the rules falling back to re are checked.
+    Output:
+        object with a match(path) method, as a compiled regex
+    """
+    if engine == 'dfa':
+        try:
+            return LinearRule(rule)
+        except UnsupportedRuleError as error:
+            warnings.warn(
+                '{0}; rule matched with re'.format(error), UnsafeRuleWarning,
+                stacklevel=2
+            )
+    check_rule(rule, guard)
+    return re.compile(rule)
+
+
+def reset_compiled_rules_lock():
+    """Create a new lock for the compiled rules, e.g. in a forked worker."""
+    global _compiled_rules_lock
+    _compiled_rules_lock = threading.Lock()
+
+
+def compile_rule_cached(rule, engine='re', guard=None):
+    """
+    Same as compile_rule, keeping up to _MAX_COMPILED_RULES compiled rules.
+    """
+    key = (rule, engine, guard)
+    compiled = _compiled_rules.get(key)
+    if compiled is None:
+        compiled = compile_rule(rule, engine, guard)
+        with _compiled_rules_lock:
+            if len(_compiled_rules) >= _MAX_COMPILED_RULES:
+                _compiled_rules.clear()
+            _compiled_rules[key] = compiled
+    return compiled
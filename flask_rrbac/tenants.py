@@ -0,0 +1,158 @@
+# -*-coding: utf-8
+"""
+    flask_rrbac.tenants
+    ~~~~~~~~~~~~~
+    Bounded cache of the compiled policies of tenants
+"""
+
+import os
+import re
+import sys
+import threading
+from collections import OrderedDict
+
+# Rough memory of a compiled rule besides its string: compiled pattern (or
+# its share of a Werkzeug map), tuple slot and rule index entry
+RULE_OVERHEAD = 1024
+
+# Tenant ids usable as file names
+_TENANT_FILE_NAME = re.compile(r'^[A-Za-z0-9_-][A-Za-z0-9_.-]*$')
+
+
+def estimate_policy_size(policy):
+    """
+    Return an estimate, in bytes, of the memory held by a compiled policy
+    once every role is compiled: its role route map plus RULE_OVERHEAD per
+    rule.
+    :param policy: CompiledPolicy
+    """
+    role_route_map = policy.role_route_map
+    size = sys.getsizeof(role_route_map)
+    for role, method_map in role_route_map.items():
+        size += sys.getsizeof(role) + sys.getsizeof(method_map)
+        for rules in method_map.values():
+            size += sys.getsizeof(rules)
+            for rule in rules:
+                size += sys.getsizeof(rule) + RULE_OVERHEAD
+    return size
+
+
+def tenant_policy_path(directory, tenant):
+    """
+    Return the path of the policy document of a tenant in a directory:
+    `<directory>/<tenant>.json`. Tenant ids which are not plain file names
+    raise ValueError.
+    :param directory: directory of the policy documents
+    :param tenant: id of the tenant
+    """
+    tenant = u'{0}'.format(tenant)
+    if not _TENANT_FILE_NAME.match(tenant):
+        raise ValueError('Invalid tenant id {0!r}'.format(tenant))
+    return os.path.join(directory, tenant + '.json')
+
+
+class TenantPolicyCache(object):
+    """Least recently used cache of tenant id -> compiled policy, bounded by
+    a number of tenants and by the estimated memory of their policies (see
+    estimate_policy_size). The policy just loaded is always kept, even when
+    it exceeds max_bytes on its own.
+
+    It is shared by all the threads of a process, so every access is made
+    under a lock. Policies are loaded outside of the lock; a tenant missed
+    by several threads at once is loaded by one of them, the others wait
+    for it.
+    :param max_tenants: maximum number of tenants kept
+    :param max_bytes: maximum estimated memory of the policies kept, None for
+    no limit
+    """
+
+    def __init__(self, max_tenants, max_bytes=None):
+        self.max_tenants = max_tenants
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size_bytes = 0
+        self._entries = OrderedDict()
+        self.reset_lock()
+
+    def reset_lock(self):
+        """Create new locks, e.g. in a forked worker."""
+        self._lock = threading.Lock()
+        self._loading = {}
+
+    def get(self, tenant, load):
+        """
+        Return the compiled policy of a tenant, loading it with load(tenant)
+        when it is not cached.
+        :param tenant: id of the tenant
+        :param load: function of the tenant id returning a CompiledPolicy
+        """
+        with self._lock:
+            entry = self._entries.pop(tenant, None)
+            if entry is not None:
+                self._entries[tenant] = entry
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            loading = self._loading.get(tenant)
+            if loading is None:
+                loading = self._loading[tenant] = threading.Lock()
+        with loading:
+            with self._lock:
+                entry = self._entries.get(tenant)
+            if entry is not None:
+                return entry[0]
+            try:
+                policy = load(tenant)
+                self._add(tenant, policy)
+            finally:
+                with self._lock:
+                    if self._loading.get(tenant) is loading:
+                        del self._loading[tenant]
+        return policy
+
+    def _add(self, tenant, policy):
+        size = estimate_policy_size(policy)
+        with self._lock:
+            previous = self._entries.pop(tenant, None)
+            if previous is not None:
+                self.size_bytes -= previous[1]
+            self._entries[tenant] = (policy, size)
+            self.size_bytes += size
+            while len(self._entries) > 1 and (
+                len(self._entries) > self.max_tenants or (
+                    self.max_bytes is not None and
+                    self.size_bytes > self.max_bytes
+                )
+            ):
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.size_bytes -= evicted_size
+                self.evictions += 1
+
+    def invalidate(self, tenant=None):
+        """
+        Drop the policy of a tenant, or of every tenant.
+        :param tenant: id of the tenant, None for every tenant
+        """
+        with self._lock:
+            if tenant is None:
+                self._entries.clear()
+                self.size_bytes = 0
+            else:
+                entry = self._entries.pop(tenant, None)
+                if entry is not None:
+                    self.size_bytes -= entry[1]
+
+    def stats(self):
+        """Return the number of tenants, their estimated bytes, hits, misses
+        and evictions.
+        """
+        with self._lock:
+            return {
+                'tenants': len(self._entries),
+                'bytes': self.size_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
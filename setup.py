@@ -20,8 +20,10 @@ setup(
     include_package_data=True,
     platforms="any",
     install_requires=["Flask>=0.10"],
+    extras_require={"db": ["SQLAlchemy"], "async": ["Flask[async]>=2.0"]},
     keywords='flask access control acl rbac',
-    python_requires='~=2.6',
+    python_requires='>=2.6, !=3.0.*, !=3.1.*, !=3.2.*, !=3.3.*, !=3.4.*, '
+                    '!=3.5.*, !=3.6.*',
     classifiers=[
         "Framework :: Flask",
         "Environment :: Web Environment",
@@ -30,6 +32,13 @@ setup(
         "Programming Language :: Python :: 2",
         "Programming Language :: Python :: 2.6",
         "Programming Language :: Python :: 2.7",
+        "Programming Language :: Python :: 3",
+        "Programming Language :: Python :: 3.7",
+        "Programming Language :: Python :: 3.8",
+        "Programming Language :: Python :: 3.9",
+        "Programming Language :: Python :: 3.10",
+        "Programming Language :: Python :: 3.11",
+        "Programming Language :: Python :: 3.12",
         "Development Status :: 3 - Alpha",
         "Intended Audience :: Developers",
         'Topic :: Software Development :: Build Tools',
@@ -0,0 +1,17 @@
+from flask import g
+
+
+def set_current_user(request_ctx, user):
+    """Make user the current_user of Flask-Login in a request context: it is
+    read from the request context before Flask-Login 0.6 and from g since.
+    g outlives the request context when an app context was already pushed,
+    so a user set by an earlier request is dropped when user is None.
+    """
+    if user is None:
+        if hasattr(request_ctx, 'user'):
+            del request_ctx.user
+        if hasattr(g, '_login_user'):
+            del g._login_user
+    else:
+        request_ctx.user = user
+        g._login_user = user
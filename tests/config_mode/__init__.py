@@ -1,13 +1,18 @@
+import os
+
 from flask import Flask, Response
 from flask_rrbac import RoleRouteBasedACL
 from flask_sqlalchemy import SQLAlchemy
-from flask.ext.login import LoginManager
-from flask.ext.login import current_user
+from flask_login import LoginManager
+from flask_login import current_user
 
 
 app = Flask(__name__)
 app.debug = True
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///test_app_1.db'
+# Next to this module, where newer Flask-SQLAlchemy would not look for it
+app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///{}'.format(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_app_1.db')
+)
 app.config['SECRET_KEY'] = 'sqlite:///test_app_1.db'
 app.config['DEBUG'] = True
 app.config['TESTING'] = True
@@ -37,10 +42,32 @@ def number_covered_route():
     return Response('hi')
 
 
-for mod, func in app.view_functions.iteritems():
+for mod, func in app.view_functions.items():
     app.view_functions[mod] = rrbac._authenticate(func)
 
 
+def make_app(import_name):
+    """
+    Creates another app sharing the database of the test app, registered
+    with Flask-SQLAlchemy as newer versions only query for registered apps
+    """
+    other_app = Flask(import_name)
+    other_app.config['SQLALCHEMY_DATABASE_URI'] = \
+        app.config['SQLALCHEMY_DATABASE_URI']
+    db.init_app(other_app)
+    return other_app
+
+
+def init_login(other_app):
+    """
+    Sets up Flask-Login for another app, with the user loader that newer
+    versions require; the users of these apps are all anonymous
+    """
+    other_login_manager = LoginManager()
+    other_login_manager.user_loader(lambda user_id: None)
+    other_login_manager.init_app(other_app)
+
+
 def tear_down():
     db.session.close()
     db.drop_all()
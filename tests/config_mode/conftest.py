@@ -1,4 +1,4 @@
-from models import (
+from .models import (
     Role, User, UserRoleMap
 )
 import pytest
@@ -80,7 +80,7 @@ def config_data_setup_regex():
             'POST': {'.+'}
         },
         base_role.name: {
-            'GET': {'/covered_route/\d+', '/covered_route'},
+            'GET': {r'/covered_route/\d+', '/covered_route'},
             'POST': {'/covered_route/1'}
         }
     }
@@ -89,6 +89,17 @@ def config_data_setup_regex():
     return app, base_user, admin_user
 
 
+@pytest.fixture(autouse=True)
+def app_context(request):
+    """
+    Keeps an application context around each test, which current
+    Flask-SQLAlchemy needs for its engine and its scoped session
+    """
+    context = app.app_context()
+    context.push()
+    request.addfinalizer(context.pop)
+
+
 @pytest.fixture(scope='function')
 def fixture_success(request):
     """
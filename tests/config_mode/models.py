@@ -4,7 +4,7 @@ from flask_rrbac import (
     ACLRoleMixin,
     ACLUserRoleMapMixin
 )
-from flask.ext.login import UserMixin
+from flask_login import UserMixin
 
 
 @rrbac.as_role_model
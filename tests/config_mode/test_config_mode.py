@@ -1,5 +1,19 @@
+import inspect
+import warnings
+
 import pytest
+from flask import (
+    Blueprint, Flask, Response, render_template_string, request
+)
 from werkzeug.exceptions import Forbidden
+from flask_rrbac import RoleRouteBasedACLMiddleware, matching, safe_regex
+from flask_rrbac.document import write_policy_document
+from flask_rrbac.mmap_store import MmapPolicyStore, write_policy_store
+from flask_rrbac.safe_regex import (
+    UnsafeRuleError, UnsafeRuleWarning, compile_rule, find_backtracking_hazard
+)
+from . import init_login, make_app, rrbac
+from .. import set_current_user
 
 
 class TestRRBAC2():
@@ -10,28 +24,820 @@ class TestRRBAC2():
         app = fixture_success[0]
         fixture_success = fixture_success[1]
         for index, data in enumerate(fixture_success):
-            print '\nScenario {} Started'.format(index + 1)
+            print('\nScenario {} Started'.format(index + 1))
+            with app.test_request_context(
+                data['input']['url_rule'], method=data['input']['method']
+            ) as request_ctx:
+                set_current_user(request_ctx, data['input']['user'])
+                output = data['input']['function']()
+                assert output.status_code == data['output']['status_code']
+                print('\nScenario {} Passed'.format(index + 1))
+
+    @pytest.mark.usefixtures("fixture_success")
+    def test_warmup(self, fixture_success):
+        app = fixture_success[0]
+        fixture_success = fixture_success[1]
+        state = rrbac.warmup(app)
+        module_locks = [
+            matching._compiled_rules_lock, safe_regex._compiled_rules_lock
+        ]
+        rrbac.post_fork(app)
+        # The module level locks are replaced as well
+        assert matching._compiled_rules_lock is not module_locks[0]
+        assert safe_regex._compiled_rules_lock is not module_locks[1]
+        assert ('GET', '/uncovered_route') in state.anonymous_decisions
+        assert ('GET', '/covered_route') not in state.anonymous_decisions
+        for index, data in enumerate(fixture_success):
+            print('\nScenario {} Started'.format(index + 1))
             with app.test_request_context(
                 data['input']['url_rule'], method=data['input']['method']
             ) as request_ctx:
-                if data['input']['user']:
-                    request_ctx.user = data['input']['user']
+                set_current_user(request_ctx, data['input']['user'])
                 output = data['input']['function']()
                 assert output.status_code == data['output']['status_code']
-                print '\nScenario {} Passed'.format(index + 1)
+                print('\nScenario {} Passed'.format(index + 1))
+
+    @pytest.mark.usefixtures("fixture_success")
+    def test_check_many(self, fixture_success):
+        app = fixture_success[0]
+        admin_user = fixture_success[1][2]['input']['user']
+        checks = [
+            ('GET', '/covered_route'),
+            ('POST', '/covered_route'),
+            ('HEAD', '/uncovered_route'),
+            ('GET', '/covered_route/1')
+        ]
+        assert rrbac.check_many(admin_user, checks) == [
+            True, False, True, False
+        ]
+        assert rrbac.check_many(None, checks) == [False, False, True, False]
+        with app.test_request_context('/') as request_ctx:
+            set_current_user(request_ctx, admin_user)
+            output = render_template_string(
+                "{% set allowed = rrbac_allowed_links("
+                "['/covered_route', ('POST', '/covered_route')]) %}"
+                "{{ allowed['/covered_route'] }} "
+                "{{ allowed[('POST', '/covered_route')] }}"
+            )
+            assert output == 'True False'
+
+    @pytest.mark.usefixtures("fixture_success")
+    def test_accessible_routes(self, fixture_success):
+        app = fixture_success[0]
+        admin_user = fixture_success[1][2]['input']['user']
+        super_admin_user = fixture_success[1][4]['input']['user']
+        state = rrbac.warmup(app)
+        assert state.route_matrix is not None
+        assert rrbac.accessible_routes(admin_user) == {
+            '/covered_route': set(['GET']),
+            '/uncovered_route': set(['GET'])
+        }
+        assert rrbac.accessible_routes(super_admin_user) == {
+            '/covered_route': set(['GET', 'POST']),
+            '/uncovered_route': set(['GET'])
+        }
+        assert rrbac.accessible_routes(None) == {
+            '/uncovered_route': set(['GET'])
+        }
+
+    @pytest.mark.usefixtures("fixture_success")
+    def test_check_batch(self, fixture_success):
+        app = fixture_success[0]
+        admin_user = fixture_success[1][2]['input']['user']
+        super_admin_user = fixture_success[1][4]['input']['user']
+        checks = [
+            (admin_user, 'GET', '/covered_route'),
+            (admin_user, 'POST', '/covered_route'),
+            (None, 'HEAD', '/uncovered_route'),
+            (super_admin_user, 'POST', '/covered_route'),
+            (None, 'GET', '/covered_route')
+        ] * 3
+        expected = [True, False, True, True, False] * 3
+        assert list(rrbac.check_batch(checks, app, chunk_size=4)) == expected
+        # Role names instead of users, evaluated in a process pool
+        role_checks = [
+            (['admin'], 'GET', '/covered_route'),
+            (['admin'], 'POST', '/covered_route'),
+            ([], 'HEAD', '/uncovered_route'),
+            (['super_admin'], 'POST', '/covered_route'),
+            ([], 'GET', '/covered_route')
+        ] * 3
+        assert list(rrbac.check_batch(
+            role_checks, app, processes=2, chunk_size=2, with_roles=True
+        )) == expected
+
+    @pytest.mark.usefixtures("fixture_success")
+    def test_roles_for_route(self, fixture_success):
+        assert rrbac.roles_for_route('POST', '/covered_route') == set([
+            'super_admin'
+        ])
+        assert rrbac.roles_for_route('GET', '/covered_route/1') == set()
+        assert rrbac.roles_for_route('GET', '/uncovered_route') == set([
+            'admin', 'super_admin', 'Anon'
+        ])
+
+    @pytest.mark.usefixtures("fixture_success")
+    def test_role_cache(self, fixture_success):
+        app = fixture_success[0]
+        admin_user = fixture_success[1][2]['input']['user']
+        app.config['RRBAC_ROLE_CACHE_TTL'] = 60
+        try:
+            rrbac.init_app(app)
+            assert rrbac.can(admin_user, 'GET', '/covered_route')
+            assert not rrbac.can(admin_user, 'POST', '/covered_route')
+            assert app.extensions['rrbac'].role_cache.stats() == {
+                'size': 1, 'hits': 1, 'misses': 1
+            }
+        finally:
+            app.config['RRBAC_ROLE_CACHE_TTL'] = 0
+            rrbac.init_app(app)
+
+    @pytest.mark.usefixtures("fixture_success")
+    def test_multiple_apps(self, fixture_success):
+        app = fixture_success[0]
+        other_app = make_app('other_app')
+        other_app.config['RRBAC_ROLE_ROUTE_MAP'] = dict(
+            app.config['RRBAC_ROLE_ROUTE_MAP']
+        )
+        other_app.config['RRBAC_ANONYMOUS_ROLE'] = 'Anon'
+        rrbac.init_app(other_app)
+        state = rrbac.warmup(app)
+        other_state = rrbac.warmup(other_app)
+        assert other_state is not state
+        assert other_state is other_app.extensions['rrbac']
+        # Identical policies are compiled once
+        assert other_state.policy is state.policy
+        with other_app.test_request_context('/'):
+            assert rrbac.get_app() is other_app
+        assert rrbac.get_app() is app
+
+    @pytest.mark.usefixtures("fixture_success")
+    def test_allow_static(self, fixture_success, tmpdir):
+        app = fixture_success[0]
+        tmpdir.join('app.css').write('body {}')
+        tmpdir.mkdir('blueprint').join('blueprint.css').write('p {}')
+        static_app = Flask(
+            'static_app', static_folder=str(tmpdir), static_url_path='/static'
+        )
+        static_app.register_blueprint(Blueprint(
+            'blueprint', __name__,
+            static_folder=str(tmpdir.join('blueprint')),
+            static_url_path='/blueprint_static'
+        ))
+        static_app.config['RRBAC_ROLE_ROUTE_MAP'] = dict(
+            app.config['RRBAC_ROLE_ROUTE_MAP']
+        )
+        static_app.config['RRBAC_ALLOW_STATIC'] = True
+        rrbac.init_app(static_app)
+        for endpoint, func in static_app.view_functions.items():
+            static_app.view_functions[endpoint] = rrbac._authenticate(func)
+        assert rrbac.get_static_endpoints(static_app) == set([
+            'static', 'blueprint.static'
+        ])
+        # Static files are not part of the policy
+        assert not rrbac.can(None, 'GET', '/static/app.css', static_app)
+        for path, endpoint, filename in [
+            ('/static/app.css', 'static', 'app.css'),
+            ('/blueprint_static/blueprint.css', 'blueprint.static',
+             'blueprint.css')
+        ]:
+            with static_app.test_request_context(path):
+                output = static_app.view_functions[endpoint](
+                    filename=filename
+                )
+                print('\n{} {}'.format(path, output.status_code))
+                assert output.status_code == 200
+
+    @pytest.mark.usefixtures("fixture_success")
+    def test_enforce(self, fixture_success):
+        app = fixture_success[0]
+        enforced_app = make_app('enforced_app')
+        enforced_app.config['RRBAC_ROLE_ROUTE_MAP'] = dict(
+            app.config['RRBAC_ROLE_ROUTE_MAP']
+        )
+        enforced_app.config['RRBAC_ANONYMOUS_ROLE'] = 'Anon'
+        enforced_app.config['RRBAC_ENFORCE'] = True
+        enforced_app.config['SECRET_KEY'] = 'enforced_app'
+        init_login(enforced_app)
+        rrbac.init_app(enforced_app)
+        # Registered after init_app, and not decorated
+        blueprint = Blueprint('blueprint', __name__)
+        blueprint.add_url_rule(
+            '/uncovered_route', 'uncovered_route', lambda: 'uncovered'
+        )
+        blueprint.add_url_rule(
+            '/covered_route', 'covered_route', lambda: 'covered'
+        )
+        enforced_app.register_blueprint(blueprint)
+        state = enforced_app.extensions['rrbac']
+        assert not state.validated
+        client = enforced_app.test_client()
+        for path, status_code in [
+            ('/uncovered_route', 200),
+            ('/covered_route', 403),
+            ('/missing_route', 404)
+        ]:
+            response = client.get(path)
+            print('\n{} {}'.format(path, response.status_code))
+            assert response.status_code == status_code
+        assert state.validated
+
+    @pytest.mark.usefixtures("fixture_success")
+    def test_middleware(self, fixture_success):
+        app = fixture_success[0]
+        protected_app = make_app('protected_app')
+        protected_app.config['RRBAC_ROLE_ROUTE_MAP'] = dict(
+            app.config['RRBAC_ROLE_ROUTE_MAP']
+        )
+        protected_app.config['RRBAC_ANONYMOUS_ROLE'] = 'Anon'
+        reached = []
+
+        @protected_app.route('/uncovered_route')
+        @protected_app.route('/covered_route', methods=['GET', 'POST'])
+        def protected_view():
+            reached.append(request.path)
+            return 'reached'
+
+        # Not in the policy: decided by the declared roles
+        @protected_app.route('/health')
+        @rrbac.allow_anonymous
+        def health():
+            reached.append(request.path)
+            return 'ok'
+
+        @protected_app.route('/reports/<int:report_id>', methods=['DELETE'])
+        @rrbac.allow_roles('super_admin')
+        def delete_report(report_id):
+            reached.append(request.path)
+            return 'deleted'
+
+        rrbac.init_app(protected_app)
+        protected_app.wsgi_app = RoleRouteBasedACLMiddleware(
+            protected_app.wsgi_app, rrbac, protected_app,
+            identify=lambda environ: (
+                environ.get('HTTP_X_ROLES', '').split(',')
+                if 'HTTP_X_ROLES' in environ else ()
+            )
+        )
+        # Without its cookie jar, which newer Werkzeug sends in place of the
+        # Cookie headers of the requests
+        client = protected_app.test_client(use_cookies=False)
+        for path, method, headers, status_code in [
+            ('/uncovered_route', 'HEAD', {}, 200),
+            ('/covered_route', 'GET', {}, 403),
+            ('/covered_route', 'GET', {'X-Roles': 'admin'}, 200),
+            ('/covered_route', 'POST', {'X-Roles': 'admin'}, 403),
+            ('/covered_route', 'POST', {'X-Roles': 'super_admin'}, 200),
+            ('/health', 'GET', {}, 200),
+            ('/reports/1', 'DELETE', {}, 403),
+            ('/reports/1', 'DELETE', {'X-Roles': 'admin'}, 403),
+            ('/reports/1', 'DELETE', {'X-Roles': 'super_admin'}, 200),
+            # Paths no url rule matches are left to the app
+            ('/missing', 'GET', {}, 404)
+        ]:
+            response = client.open(path, method=method, headers=headers)
+            print('\n{} {} {}'.format(method, path, response.status_code))
+            assert response.status_code == status_code
+        # Rejected requests never reached Flask
+        assert reached == [
+            '/uncovered_route', '/covered_route', '/covered_route', '/health',
+            '/reports/1'
+        ]
+
+        # By default callers with a session or remember cookie are left to
+        # the app, e.g. for Flask-Login to restore a remembered user
+        protected_app.config['REMEMBER_COOKIE_NAME'] = 'remember_me'
+        protected_app.wsgi_app = RoleRouteBasedACLMiddleware(
+            protected_app.wsgi_app.wsgi_app, rrbac, protected_app
+        )
+        del reached[:]
+        for headers, status_code in [
+            ({}, 403),
+            ({'Cookie': 'remember_me=1|abc'}, 200),
+            ({'Cookie': 'session=abc'}, 200),
+            ({'Authorization': 'Bearer abc'}, 200)
+        ]:
+            response = client.get('/covered_route', headers=headers)
+            print('\n{} {}'.format(headers, response.status_code))
+            assert response.status_code == status_code
+        assert len(reached) == 3
+
+    @pytest.mark.usefixtures("fixture_success")
+    def test_allow_roles(self, fixture_success):
+        app = fixture_success[0]
+        admin_user = fixture_success[1][2]['input']['user']
+        super_admin_user = fixture_success[1][4]['input']['user']
+        declared_app = make_app('declared_app')
+        declared_app.config['RRBAC_ROLE_ROUTE_MAP'] = dict(
+            app.config['RRBAC_ROLE_ROUTE_MAP']
+        )
+        declared_app.config['RRBAC_ANONYMOUS_ROLE'] = 'Anon'
+        declared_app.config['SECRET_KEY'] = 'declared_app'
+        init_login(declared_app)
+
+        # Not in the policy at all
+        @declared_app.route('/reports/<int:report_id>', methods=['DELETE'])
+        @rrbac.allow_roles('super_admin')
+        def delete_report(report_id):
+            return Response('deleted')
+
+        @declared_app.route('/health')
+        @rrbac.allow_anonymous
+        def health():
+            return Response('ok')
+
+        rrbac.init_app(declared_app)
+        for endpoint, func in declared_app.view_functions.items():
+            declared_app.view_functions[endpoint] = rrbac._authenticate(func)
+        assert rrbac.get_endpoint_roles(declared_app) == {
+            'delete_report': frozenset(['super_admin']),
+            'health': True
+        }
+        for path, method, user, status_code in [
+            ('/reports/1', 'DELETE', super_admin_user, 200),
+            ('/reports/1', 'DELETE', admin_user, 403),
+            ('/reports/1', 'DELETE', None, 403),
+            ('/health', 'GET', None, 200)
+        ]:
+            with declared_app.test_request_context(
+                path, method=method
+            ) as request_ctx:
+                set_current_user(request_ctx, user)
+                try:
+                    view = declared_app.view_functions[request.endpoint]
+                    status = view(**request.view_args).status_code
+                except Forbidden:
+                    status = 403
+                print('\n{} {} {}'.format(method, path, status))
+                assert status == status_code
+
+    @pytest.mark.usefixtures("fixture_success")
+    def test_werkzeug_rules(self, fixture_success):
+        admin_user = fixture_success[1][2]['input']['user']
+        werkzeug_app = make_app('werkzeug_app')
+        werkzeug_app.config['RRBAC_ROLE_ROUTE_MAP'] = {
+            'admin': {
+                'GET': {'/covered_route/<int:number>', '/files/<path:name>'},
+                'POST': {'/covered_route/[0-9]+'}
+            },
+            'Anon': {'GET': {'/uncovered_route'}}
+        }
+        werkzeug_app.config['RRBAC_ANONYMOUS_ROLE'] = 'Anon'
+        rrbac.init_app(werkzeug_app)
+        for method, path, allowed in [
+            ('GET', '/covered_route/12', True),
+            ('HEAD', '/covered_route/12', True),
+            ('GET', '/covered_route/twelve', False),
+            ('GET', '/covered_route/12/', False),
+            ('GET', '/files/a/b.txt', True),
+            # Regex rules keep working alongside
+            ('POST', '/covered_route/12', True),
+            ('POST', '/files/a/b.txt', False)
+        ]:
+            print('\n{} {} {}'.format(method, path, allowed))
+            assert rrbac.can(admin_user, method, path, werkzeug_app) == \
+                allowed
+        assert not rrbac.can(None, 'GET', '/covered_route/12', werkzeug_app)
+        assert rrbac.roles_for_route(
+            'GET', '/covered_route/12', werkzeug_app
+        ) == set(['admin'])
+        assert rrbac.is_rule_matched('/orders/12', '/orders/<int:order_id>')
+        assert not rrbac.is_rule_matched('/orders/a', '/orders/<int:order_id>')
+        assert rrbac.is_rule_matched('/orders/12', '/orders/(?P<id>[0-9]+)')
+
+    @pytest.mark.usefixtures("fixture_success")
+    def test_rule_engine(self, fixture_success):
+        admin_user = fixture_success[1][2]['input']['user']
+        role_route_map = {
+            'admin': {
+                'GET': {'/covered_route/[0-9]+', '/files/(\\w+/?)+'},
+                'POST': {'/a|/ab', '^/orders/(?:[a-z]{2,4}|x)$'}
+            },
+            'Anon': {'GET': {'/uncovered_route'}}
+        }
+        for engine in ('re', 'dfa'):
+            print('\nEngine {}'.format(engine))
+            engine_app = make_app('engine_app')
+            engine_app.config['RRBAC_ROLE_ROUTE_MAP'] = role_route_map
+            engine_app.config['RRBAC_ANONYMOUS_ROLE'] = 'Anon'
+            engine_app.config['RRBAC_RULE_ENGINE'] = engine
+            engine_app.config['RRBAC_UNSAFE_RULES'] = None
+            rrbac.init_app(engine_app)
+            for method, path, allowed in [
+                ('GET', '/covered_route/12', True),
+                ('GET', '/covered_route/12a', False),
+                ('GET', '/files/a/b_c/', True),
+                ('GET', '/files/' + 'a' * 40 + '!', False),
+                ('POST', '/orders/abc', True),
+                ('POST', '/orders/abcdef', False),
+                ('POST', '/a', True)
+            ]:
+                assert rrbac.can(admin_user, method, path, engine_app) == \
+                    allowed
+            assert rrbac.is_rule_matched(
+                '/orders/12', '/orders/[0-9]+', engine
+            )
+        # The DFA finds full matches re misses after its first match
+        assert rrbac.is_rule_matched('/ab', '/a|/ab', 'dfa')
+        assert not rrbac.is_rule_matched('/ab', '/a|/ab')
+
+        assert find_backtracking_hazard('/files/(\\w+/?)+') == \
+            'nested quantifier'
+        assert find_backtracking_hazard('/x/(aa|\\w\\w)*') is not None
+        assert find_backtracking_hazard('/users/([0-9]+/)*') is None
+        assert find_backtracking_hazard('/x/(/a|/b)*') is None
+        unsafe_app = make_app('unsafe_app')
+        unsafe_app.config['RRBAC_ROLE_ROUTE_MAP'] = role_route_map
+        unsafe_app.config['RRBAC_ANONYMOUS_ROLE'] = 'Anon'
+        rrbac.init_app(unsafe_app)
+        # The check is opt-in
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            assert rrbac.can(admin_user, 'GET', '/files/a', unsafe_app)
+        assert not any(
+            issubclass(warning.category, UnsafeRuleWarning)
+            for warning in caught
+        )
+        unsafe_app.config['RRBAC_UNSAFE_RULES'] = 'reject'
+        rrbac.init_app(unsafe_app)
+        with pytest.raises(UnsafeRuleError):
+            rrbac.can(admin_user, 'GET', '/files/a', unsafe_app)
+        unsafe_app.config['RRBAC_UNSAFE_RULES'] = 'warn'
+        rrbac.init_app(unsafe_app)
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            assert rrbac.can(admin_user, 'GET', '/files/a', unsafe_app)
+        assert any(
+            issubclass(warning.category, UnsafeRuleWarning)
+            for warning in caught
+        )
+        # Unsupported syntax falls back to re
+        with warnings.catch_warnings(record=True):
+            warnings.simplefilter('always')
+            assert not hasattr(compile_rule(r'/(a)\1', 'dfa'), 'rule')
+        # Unknown settings are refused rather than falling back to re
+        for key, value in [
+            ('RRBAC_RULE_ENGINE', 'DFA'), ('RRBAC_UNSAFE_RULES', 'raise')
+        ]:
+            misconfigured_app = make_app('misconfigured_app')
+            misconfigured_app.config[key] = value
+            with pytest.raises(ValueError):
+                rrbac.init_app(misconfigured_app)
+
+    @pytest.mark.usefixtures("fixture_success")
+    def test_minimize_policy(self, fixture_success):
+        admin_user = fixture_success[1][2]['input']['user']
+        minimized_app = make_app('minimized_app')
+        minimized_app.config['RRBAC_ROLE_ROUTE_MAP'] = {
+            'admin': {
+                'GET': [
+                    '/covered_route', '/covered_route', '/orders',
+                    '/orders(/[0-9]+)?', '/uncovered_route',
+                    '/files/<path:name>', '/files/a\\.txt'
+                ],
+                'POST': ['/orders', '/uncovered_route']
+            },
+            'Anon': {'GET': ['/uncovered_route', '/public/.*']}
+        }
+        minimized_app.config['RRBAC_ANONYMOUS_ROLE'] = 'Anon'
+        minimized_app.config['RRBAC_MINIMIZE_POLICY'] = True
+        rrbac.init_app(minimized_app)
+        policy = rrbac.warmup(minimized_app).policy
+        report = policy.minimize_report
+        print('\n{}'.format(report))
+        assert policy.role_route_map['admin'] == {
+            'GET': (
+                '/covered_route', '/files/<path:name>', '/orders(/[0-9]+)?'
+            ),
+            'POST': ('/orders', '/uncovered_route')
+        }
+        assert sorted(report['removed']) == [
+            ('admin', 'GET', '/files/a\\.txt', 'covered'),
+            ('admin', 'GET', '/orders', 'covered'),
+            ('admin', 'GET', '/uncovered_route', 'anonymous')
+        ]
+        assert report['duplicate_rules'] == 1
+        assert report['rules'] == (11, 7)
+        assert report['rules_per_role_method'][1] < \
+            report['rules_per_role_method'][0]
+        for method, path, allowed in [
+            ('GET', '/orders', True),
+            ('GET', '/orders/3', True),
+            ('GET', '/files/a.txt', True),
+            ('GET', '/uncovered_route', True),
+            ('POST', '/uncovered_route', True),
+            ('GET', '/public/x', True),
+            ('POST', '/orders/3', False)
+        ]:
+            assert rrbac.can(admin_user, method, path, minimized_app) == \
+                allowed
+        assert not rrbac.can(None, 'GET', '/orders', minimized_app)
+        assert rrbac.roles_for_route(
+            'GET', '/uncovered_route', minimized_app
+        ) == set(['Anon'])
+
+        # Rules a role gets from the roles it includes are removed, but the
+        # roles of a cycle keep theirs
+        hierarchy_app = make_app('minimized_hierarchy_app')
+        hierarchy_app.config.update({
+            'RRBAC_ROLE_ROUTE_MAP': {
+                'editor': {'GET': ['/orders', '/reports']},
+                'viewer': {'GET': ['/orders(/[0-9]+)?']},
+                'owner': {'GET': ['/reports']},
+                'partner': {'GET': ['/reports']}
+            },
+            'RRBAC_ROLE_HIERARCHY': {
+                'editor': ['viewer'], 'owner': ['partner'],
+                'partner': ['owner']
+            },
+            'RRBAC_ANONYMOUS_ROLE': 'Anon',
+            'RRBAC_MINIMIZE_POLICY': True
+        })
+        rrbac.init_app(hierarchy_app)
+        policy = rrbac.warmup(hierarchy_app).policy
+        assert policy.minimize_report['removed'] == [
+            ('editor', 'GET', '/orders', 'inherited')
+        ]
+        assert policy.minimize_report['inherited_rules'] == 1
+        for role in ('owner', 'partner'):
+            assert policy.role_route_map[role] == {'GET': ('/reports',)}
+        for role, path in [
+            ('editor', '/orders'), ('editor', '/reports'),
+            ('owner', '/reports'), ('partner', '/reports')
+        ]:
+            assert rrbac.can(None, 'GET', path, hierarchy_app, roles=[role])
+
+    @pytest.mark.usefixtures("fixture_success")
+    def test_rule_usage(self, fixture_success, monkeypatch):
+        admin_user = fixture_success[1][2]['input']['user']
+        monkeypatch.setattr('flask_rrbac.policy.REORDER_INTERVAL', 4)
+        usage_app = make_app('usage_app')
+
+        @usage_app.route('/covered_route')
+        def covered_route():
+            return Response('Covered')
+        usage_app.config['RRBAC_ROLE_ROUTE_MAP'] = {
+            'admin': {
+                'GET': {
+                    '/covered_route', '/orders/[0-9]+', '/orders/.*',
+                    '/never'
+                },
+                'POST': {'/files/<path:name>'}
+            },
+            'Anon': {'GET': {'/uncovered_route'}}
+        }
+        usage_app.config['RRBAC_ANONYMOUS_ROLE'] = 'Anon'
+        usage_app.config['RRBAC_RULE_STATS_SAMPLE_RATE'] = 1
+        rrbac.init_app(usage_app)
+        assert rrbac.rule_usage(usage_app)['sampled_decisions'] == 0
+        for method, path in [
+            ('GET', '/orders/x'), ('GET', '/orders/x'), ('GET', '/orders/1'),
+            ('GET', '/covered_route'), ('POST', '/files/a'),
+            ('GET', '/uncovered_route')
+        ]:
+            assert rrbac.can(admin_user, method, path, usage_app)
+        usage = rrbac.rule_usage(usage_app, reset=True)
+        print('\n{}'.format(usage))
+        assert usage['sampled_decisions'] == 6
+        assert usage['rule_hits'][('admin', 'GET', '/orders/.*')] == 3
+        assert usage['rule_hits'][('admin', 'GET', '/covered_route')] == 1
+        assert usage['role_hits'] == {'admin': 5, 'Anon': 1}
+        assert usage['dead_rules'] == [('admin', 'GET', '/never')]
+        # Reordered after 4 sampled decisions, most matched first
+        policy = usage_app.extensions['rrbac'].policy
+        assert policy._role_order[0][0] == 'admin'
+        assert [
+            rule for rule, _ in policy._role_matchers('admin')[0]['GET']
+        ] == ['/orders/.*', '/covered_route', '/orders/[0-9]+', '/never']
+        assert rrbac.rule_usage(usage_app)['sampled_decisions'] == 0
+
+    @pytest.mark.usefixtures("fixture_success")
+    def test_tenant_policies(self, fixture_success, tmpdir):
+        app = fixture_success[0]
+        admin_user = fixture_success[1][2]['input']['user']
+        tenant_policies = {
+            'acme': {'admin': {'GET': ['/covered_route']}},
+            'globex': {'Anon': {'GET': ['/covered_route']}},
+            'initech': {'admin': {'POST': ['/covered_route']}}
+        }
+        for tenant, role_route_map in tenant_policies.items():
+            with open(str(tmpdir.join(tenant + '.json')), 'w') as output:
+                write_policy_document(
+                    output, sorted(role_route_map.items()), 'Anon'
+                )
+        app.config['RRBAC_TENANT_POLICY_DIR'] = str(tmpdir)
+        app.config['RRBAC_TENANT_CACHE_SIZE'] = 2
+        rrbac.set_tenant_resolver(lambda: request.headers.get('X-Tenant'))
+        try:
+            rrbac.init_app(app)
+            for tenant, user, allowed in [
+                ('acme', admin_user, True),
+                ('acme', None, False),
+                ('globex', None, True),
+                ('initech', admin_user, False),
+                ('unknown', admin_user, False),
+                # The policy of the app without a tenant
+                (None, admin_user, True)
+            ]:
+                print('\nTenant {} {}'.format(tenant, allowed))
+                headers = {'X-Tenant': tenant} if tenant else {}
+                with app.test_request_context(
+                    '/covered_route', headers=headers
+                ) as request_ctx:
+                    set_current_user(request_ctx, user)
+                    try:
+                        response = app.view_functions['covered_route']()
+                        assert response.status_code == 200 and allowed
+                    except Forbidden:
+                        assert not allowed
+            stats = rrbac.tenant_stats(app)
+            print('\n{}'.format(stats))
+            assert stats['tenants'] == 2
+            assert stats['evictions'] == 2
+            assert stats['misses'] == 4 and stats['hits'] == 1
+            assert stats['bytes'] > 0
+            with pytest.raises(ValueError):
+                rrbac.get_tenant_policy('../acme', app)
+            # The least recently used tenant is dropped first
+            app.config['RRBAC_TENANT_CACHE_SIZE'] = 10
+            app.config['RRBAC_TENANT_CACHE_MAX_BYTES'] = 1
+            rrbac.init_app(app)
+            rrbac.get_tenant_policy('acme', app)
+            rrbac.get_tenant_policy('globex', app)
+            assert rrbac.tenant_stats(app)['tenants'] == 1
+            assert rrbac.get_tenant_policy('globex', app).is_allowed(
+                0, 'GET', '/covered_route'
+            ) is False
+            rrbac.refresh_tenant_policy(app=app)
+            assert rrbac.tenant_stats(app)['tenants'] == 0
+        finally:
+            rrbac.set_tenant_resolver(None)
+            for key in (
+                'RRBAC_TENANT_POLICY_DIR', 'RRBAC_TENANT_CACHE_SIZE',
+                'RRBAC_TENANT_CACHE_MAX_BYTES'
+            ):
+                app.config.pop(key, None)
+            rrbac.init_app(app)
+
+    @pytest.mark.usefixtures("fixture_success")
+    def test_async_checks(self, fixture_success):
+        asyncio = pytest.importorskip('asyncio')
+        app = fixture_success[0]
+        admin_user = fixture_success[1][2]['input']['user']
+        loop = asyncio.new_event_loop()
+        loads = []
+
+        def load_roles(user):
+            loads.append(user.id)
+            return asyncio.sleep(0, result=['admin'])
+
+        def run_without_suspending(coroutine):
+            try:
+                coroutine.send(None)
+            except StopIteration as stop:
+                return stop.value
+            coroutine.close()
+            raise AssertionError('the check left the event loop')
+        try:
+            rrbac.warmup(app)
+            # Anonymous routes are decided without suspending
+            assert run_without_suspending(rrbac.check_permission_async(
+                None, 'GET', '/uncovered_route'
+            ))
+            # Roles loaded with the ORM in the executor
+            assert loop.run_until_complete(rrbac.check_permission_async(
+                admin_user, 'GET', '/covered_route'
+            ))
+            assert not loop.run_until_complete(rrbac.check_permission_async(
+                None, 'GET', '/covered_route'
+            ))
+            rrbac.set_async_role_loader(load_roles)
+            app.config['RRBAC_ROLE_CACHE_TTL'] = 60
+            rrbac.init_app(app)
+            # Concurrent checks of the same user share one load
+            decisions = loop.run_until_complete(asyncio.gather(*[
+                loop.create_task(
+                    rrbac.check_permission_async(admin_user, method, path)
+                )
+                for method, path in [
+                    ('GET', '/covered_route'), ('POST', '/covered_route'),
+                    ('GET', '/covered_route')
+                ]
+            ]))
+            assert decisions == [True, False, True]
+            assert loads == [admin_user.id]
+            # and then the cached roles are used without suspending
+            assert run_without_suspending(rrbac.check_permission_async(
+                admin_user, 'GET', '/covered_route'
+            ))
+            assert loads == [admin_user.id]
+        finally:
+            loop.close()
+            rrbac.set_async_role_loader(None)
+            app.config['RRBAC_ROLE_CACHE_TTL'] = 0
+            rrbac.init_app(app)
+
+    @pytest.mark.usefixtures("fixture_success")
+    def test_async_views(self, fixture_success):
+        asyncio = pytest.importorskip('asyncio')
+        pytest.importorskip('asgiref')
+        app = fixture_success[0]
+        if not hasattr(app, 'ensure_sync'):
+            pytest.skip('async views need Flask 2')
+        async_app = make_app('async_app')
+        async_app.config['RRBAC_ROLE_ROUTE_MAP'] = dict(
+            app.config['RRBAC_ROLE_ROUTE_MAP']
+        )
+        async_app.config['RRBAC_ANONYMOUS_ROLE'] = 'Anon'
+        async_app.config['SECRET_KEY'] = 'async_app'
+        init_login(async_app)
+
+        @async_app.route('/uncovered_route')
+        @rrbac.authenticate_async
+        def uncovered_route():
+            return asyncio.sleep(0, result='uncovered')
+
+        @async_app.route('/covered_route')
+        @rrbac.authenticate_async
+        def covered_route():
+            return 'covered'
+
+        rrbac.init_app(async_app)
+        # Run by Flask as async views on every Python 3 version
+        assert inspect.iscoroutinefunction(uncovered_route)
+        client = async_app.test_client()
+        for path, status_code, data in [
+            ('/uncovered_route', 200, b'uncovered'),
+            ('/covered_route', 403, None)
+        ]:
+            response = client.get(path)
+            print('\n{} {}'.format(path, response.status_code))
+            assert response.status_code == status_code
+            if data is not None:
+                assert response.data == data
+
+    @pytest.mark.usefixtures("fixture_success")
+    def test_policy_store(self, fixture_success, tmpdir):
+        app = fixture_success[0]
+        fixture_success = fixture_success[1]
+        admin_user = fixture_success[2]['input']['user']
+        store_path = str(tmpdir.join('rrbac.store'))
+        rrbac.write_policy_store(store_path, app)
+        app.config['RRBAC_POLICY_STORE_PATH'] = store_path
+        app.config['RRBAC_POLICY_STORE_CHECK_INTERVAL'] = 0
+        try:
+            rrbac.init_app(app)
+            store = app.extensions['rrbac'].policy_store
+            assert store.get_roles(admin_user.id) == set(['admin'])
+            for index, data in enumerate(fixture_success):
+                print('\nScenario {} Started'.format(index + 1))
+                with app.test_request_context(
+                    data['input']['url_rule'], method=data['input']['method']
+                ) as request_ctx:
+                    set_current_user(request_ctx, data['input']['user'])
+                    output = data['input']['function']()
+                    assert output.status_code == \
+                        data['output']['status_code']
+                    print('\nScenario {} Passed'.format(index + 1))
+
+            # User ids are looked up as integers; unknown users have no role
+            assert store.get_roles(str(admin_user.id)) == set(['admin'])
+            assert store.get_roles(10 ** 6) == set()
+            with pytest.raises(ValueError):
+                store.get_roles('admin')
+
+            # Another writer replaces the file: readers keep the file they
+            # mapped until their next check
+            reader = MmapPolicyStore(store_path, check_interval=60)
+            write_policy_store(
+                store_path, {'auditor': {'GET': ['/uncovered_route']}},
+                [(admin_user.id, 'auditor')], 'Anon'
+            )
+            assert not reader.refresh()
+            assert reader.get_roles(admin_user.id) == set(['admin'])
+            assert reader.refresh(force=True)
+            assert reader.get_roles(admin_user.id) == set(['auditor'])
+            assert not reader.refresh(force=True)
+            # The app checks on every use here, and rebuilds its policy
+            assert not rrbac.can(admin_user, 'GET', '/covered_route', app)
+            assert rrbac.can(admin_user, 'GET', '/uncovered_route', app)
+            assert not rrbac.can(None, 'GET', '/uncovered_route', app)
+        finally:
+            app.config['RRBAC_POLICY_STORE_PATH'] = None
+            app.config.pop('RRBAC_POLICY_STORE_CHECK_INTERVAL')
+            rrbac.init_app(app)
 
     @pytest.mark.usefixtures("fixture_failure")
     def test_failure(self, fixture_failure):
         app = fixture_failure[0]
         fixture_failure = fixture_failure[1]
         for index, data in enumerate(fixture_failure):
-            print '\nScenario {} Started'.format(index + 1)
+            print('\nScenario {} Started'.format(index + 1))
             with app.test_request_context(
                 data['input']['url_rule'],
                 method=data['input']['method']
             ) as request_ctx:
-                if data['input']['user']:
-                    request_ctx.user = data['input']['user']
+                set_current_user(request_ctx, data['input']['user'])
                 try:
                     result = 0
                     data['input']['function']()
@@ -39,7 +845,72 @@ class TestRRBAC2():
                     result = 1
                 finally:
                     assert result
-                    print '\nScenario {} Passed'.format(index + 1)
+                    print('\nScenario {} Passed'.format(index + 1))
+
+    @pytest.mark.usefixtures("fixture_failure")
+    def test_role_loader(self, fixture_failure):
+        app = fixture_failure[0]
+        fixture_failure = fixture_failure[1]
+        role_names = {
+            fixture_failure[0]['input']['user'].id: ['admin'],
+            fixture_failure[1]['input']['user'].id: ['base']
+        }
+        rrbac.set_role_loader(lambda user: role_names[user.id])
+        try:
+            for index, data in enumerate(fixture_failure):
+                print('\nScenario {} Started'.format(index + 1))
+                with app.test_request_context(
+                    data['input']['url_rule'],
+                    method=data['input']['method']
+                ) as request_ctx:
+                    set_current_user(request_ctx, data['input']['user'])
+                    try:
+                        result = 0
+                        data['input']['function']()
+                    except Forbidden:
+                        result = 1
+                    finally:
+                        assert result
+                        print('\nScenario {} Passed'.format(index + 1))
+        finally:
+            rrbac.set_role_loader(None)
+
+    @pytest.mark.usefixtures("fixture_failure")
+    def test_lazy_compile(self, fixture_failure):
+        app = fixture_failure[0]
+        fixture_failure = fixture_failure[1]
+        app.config['RRBAC_LAZY_COMPILE'] = True
+        # A role nobody has, so that the policy is not shared with the
+        # (already compiled) policy of the other tests
+        app.config['RRBAC_ROLE_ROUTE_MAP']['lazy_only'] = {
+            'GET': {'/covered_route'}
+        }
+        try:
+            rrbac.init_app(app)
+            for index, data in enumerate(fixture_failure):
+                print('\nScenario {} Started'.format(index + 1))
+                with app.test_request_context(
+                    data['input']['url_rule'],
+                    method=data['input']['method']
+                ) as request_ctx:
+                    set_current_user(request_ctx, data['input']['user'])
+                    try:
+                        result = 0
+                        data['input']['function']()
+                    except Forbidden:
+                        result = 1
+                    finally:
+                        assert result
+                        print('\nScenario {} Passed'.format(index + 1))
+            # super_admin and lazy_only are never used
+            assert rrbac.policy_stats() == {
+                'roles': 4, 'compiled_roles': 2, 'lazily_compiled_roles': 2
+            }
+            rrbac.warmup(app)
+            assert rrbac.policy_stats()['compiled_roles'] == 4
+        finally:
+            app.config['RRBAC_LAZY_COMPILE'] = False
+            rrbac.init_app(app)
 
     @pytest.mark.usefixtures("fixture_regex_success")
     def test_regex_success(
@@ -48,28 +919,26 @@ class TestRRBAC2():
         app = fixture_regex_success[0]
         fixture_success = fixture_regex_success[1]
         for index, data in enumerate(fixture_success):
-            print '\nScenario {} Started'.format(index + 1)
+            print('\nScenario {} Started'.format(index + 1))
             with app.test_request_context(
                 data['input']['url_rule'], method=data['input']['method']
             ) as request_ctx:
-                if data['input']['user']:
-                    request_ctx.user = data['input']['user']
+                set_current_user(request_ctx, data['input']['user'])
                 output = data['input']['function']()
                 assert output.status_code == data['output']['status_code']
-                print '\nScenario {} Passed'.format(index + 1)
+                print('\nScenario {} Passed'.format(index + 1))
 
     @pytest.mark.usefixtures("fixture_regex_failure")
     def test_regex_failure(self, fixture_regex_failure):
         app = fixture_regex_failure[0]
         fixture_regex_failure = fixture_regex_failure[1]
         for index, data in enumerate(fixture_regex_failure):
-            print '\nScenario {} Started'.format(index + 1)
+            print('\nScenario {} Started'.format(index + 1))
             with app.test_request_context(
                 data['input']['url_rule'],
                 method=data['input']['method']
             ) as request_ctx:
-                if data['input']['user']:
-                    request_ctx.user = data['input']['user']
+                set_current_user(request_ctx, data['input']['user'])
                 try:
                     result = 0
                     data['input']['function']()
@@ -77,4 +946,4 @@ class TestRRBAC2():
                     result = 1
                 finally:
                     assert result
-                    print '\nScenario {} Passed'.format(index + 1)
+                    print('\nScenario {} Passed'.format(index + 1))
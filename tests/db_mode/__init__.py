@@ -1,13 +1,18 @@
+import os
+
 from flask import Flask, Response, request
 from flask_rrbac import RoleRouteBasedACL
 from flask_sqlalchemy import SQLAlchemy
-from flask.ext.login import LoginManager
-from flask.ext.login import current_user
+from flask_login import LoginManager
+from flask_login import current_user
 
 
 app = Flask(__name__)
 app.debug = True
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///test_app_1.db'
+# Next to this module, where newer Flask-SQLAlchemy would not look for it
+app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///{}'.format(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_app_1.db')
+)
 app.config['SECRET_KEY'] = 'sqlite:///test_app_1.db'
 app.config['RRBAC_ANONYMOUS_ROLE'] = 'Anon'
 app.config['DEBUG'] = True
@@ -38,7 +43,7 @@ def number_covered_route():
     return Response('{}'.format(request.method))
 
 
-for mod, func in app.view_functions.iteritems():
+for mod, func in app.view_functions.items():
     app.view_functions[mod] = rrbac._authenticate(func)
 
 
@@ -1,4 +1,4 @@
-from models import (
+from .models import (
     Role, User, UserRoleMap, Route, RoleRouteMap
 )
 import pytest
@@ -54,6 +54,17 @@ def db_data_setup():
     return [base_user, admin_user, super_admin_user]
 
 
+@pytest.fixture(autouse=True)
+def app_context(request):
+    """
+    Keeps an application context around each test, which current
+    Flask-SQLAlchemy needs for its engine and its scoped session
+    """
+    context = app.app_context()
+    context.push()
+    request.addfinalizer(context.pop)
+
+
 @pytest.fixture(scope='function')
 def fixture_success(request):
     """
@@ -316,7 +327,7 @@ def db_data_setup_regex():
     all_post_route = Route(rule='.+', method='POST')
 
     # Route for get of all covered route with ids
-    int_route = Route(rule='/covered_route/\d+', method='GET')
+    int_route = Route(rule=r'/covered_route/\d+', method='GET')
     # Route for posting on covered_route, id: 1
     specific_id_route = Route(rule='/covered_route/1', method='POST')
 
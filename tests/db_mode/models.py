@@ -6,7 +6,7 @@ from flask_rrbac import (
     ACLRouteMixin,
     ACLUserRoleMapMixin
 )
-from flask.ext.login import UserMixin
+from flask_login import UserMixin
 
 
 @rrbac.as_role_model
@@ -15,6 +15,10 @@ class Role(db.Model, ACLRoleMixin):
 
     id = db.Column(db.Integer, nullable=False, primary_key=True)
     name = db.Column(db.String(128), nullable=False)
+    parent_id = db.Column(
+        db.Integer, db.ForeignKey('roles.id'), nullable=True
+    )
+    tenant_id = db.Column(db.String(64), nullable=True)
     deleted_at = db.Column(db.DateTime, default=None, nullable=True)
 
 
@@ -1,5 +1,22 @@
+import json
+import time
+from datetime import datetime, timedelta
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
 import pytest
-from . import app
+from flask import Flask, request
+from sqlalchemy import event
+from flask_rrbac.document import write_policy_document
+from flask_rrbac.export import write_access_matrix
+from flask_rrbac.invalidation import InvalidationLog
+from flask_rrbac.mmap_store import MmapPolicyStore
+from flask_rrbac.safe_regex import UnsafeRuleError
+from . import app, db, rrbac
+from .. import set_current_user
+from .models import Role, RoleRouteMap, Route, UserRoleMap
 from werkzeug.exceptions import Forbidden
 
 
@@ -7,26 +24,535 @@ class TestRRBAC():
     @pytest.mark.usefixtures("fixture_success")
     def test_success(self, fixture_success):
         for index, data in enumerate(fixture_success):
-            print '\nScenario {} Started'.format(index + 1)
+            print('\nScenario {} Started'.format(index + 1))
             with app.test_request_context(
                 data['input']['url_rule'], method=data['input']['method']
             ) as request_ctx:
-                if data['input']['user']:
-                    request_ctx.user = data['input']['user']
+                set_current_user(request_ctx, data['input']['user'])
                 output = data['input']['function']()
                 assert output.status_code == data['output']['status_code']
-                print '\nScenario {} Passed'.format(index + 1)
+                print('\nScenario {} Passed'.format(index + 1))
+
+    @pytest.mark.usefixtures("fixture_success")
+    def test_cached_policy(self, fixture_success):
+        app.config['RRBAC_CACHE_DB_POLICY'] = True
+        try:
+            rrbac.init_app(app)
+            state = rrbac.warmup(app)
+            rrbac.post_fork(app)
+            assert ('GET', '/uncovered_route') in state.anonymous_decisions
+            for index, data in enumerate(fixture_success):
+                print('\nScenario {} Started'.format(index + 1))
+                with app.test_request_context(
+                    data['input']['url_rule'], method=data['input']['method']
+                ) as request_ctx:
+                    set_current_user(request_ctx, data['input']['user'])
+                    output = data['input']['function']()
+                    assert output.status_code == \
+                        data['output']['status_code']
+                    print('\nScenario {} Passed'.format(index + 1))
+        finally:
+            app.config['RRBAC_CACHE_DB_POLICY'] = False
+            rrbac.init_app(app)
+
+    @pytest.mark.usefixtures("fixture_success")
+    def test_check_many(self, fixture_success):
+        admin_user = fixture_success[2]['input']['user']
+        super_admin_user = fixture_success[4]['input']['user']
+        checks = [
+            ('GET', '/covered_route'),
+            ('POST', '/covered_route'),
+            ('HEAD', '/uncovered_route'),
+            ('GET', '/covered_route/1')
+        ]
+        assert rrbac.check_many(admin_user, checks) == [
+            True, False, True, False
+        ]
+        assert rrbac.check_many(super_admin_user, checks) == [
+            True, True, True, False
+        ]
+        assert rrbac.check_many(None, checks) == [False, False, True, False]
+
+    @pytest.mark.usefixtures("fixture_success")
+    def test_can(self, fixture_success):
+        admin_user = fixture_success[2]['input']['user']
+        # No request context is needed
+        assert rrbac.can(admin_user, 'GET', '/covered_route', app=app)
+        assert not rrbac.can(admin_user, 'POST', '/covered_route', app=app)
+        # Pre-resolved roles skip the user entirely
+        assert rrbac.can(None, 'POST', '/covered_route', roles=['super_admin'])
+        assert rrbac.allowed_routes(admin_user) == {
+            '/covered_route': set(['GET']),
+            '/uncovered_route': set(['GET'])
+        }
+
+    @pytest.mark.usefixtures("fixture_success")
+    def test_check_permission_async(self, fixture_success):
+        asyncio = pytest.importorskip('asyncio')
+        admin_user = fixture_success[2]['input']['user']
+        super_admin_user = fixture_success[4]['input']['user']
+        loop = asyncio.new_event_loop()
+        try:
+            # Without a cached policy the rules are queried in the executor
+            for user, method, path, allowed in [
+                (admin_user, 'GET', '/covered_route', True),
+                (admin_user, 'POST', '/covered_route', False),
+                (super_admin_user, 'POST', '/covered_route', True),
+                (None, 'GET', '/uncovered_route', True),
+                (None, 'GET', '/covered_route', False)
+            ]:
+                assert loop.run_until_complete(rrbac.check_permission_async(
+                    user, method, path, app
+                )) == allowed
+        finally:
+            loop.close()
+
+    @pytest.mark.usefixtures("fixture_success")
+    def test_users_for_route(self, fixture_success):
+        assert rrbac.roles_for_route('GET', '/covered_route') == set([
+            'admin', 'super_admin'
+        ])
+        assert set(
+            user.name for user in rrbac.users_for_route(
+                'GET', '/covered_route', chunk_size=1
+            )
+        ) == set(['admin', 'super_admin'])
+        # Everyone holds the Anonymous Role
+        assert rrbac.roles_for_route('HEAD', '/uncovered_route') == set([
+            'Anon'
+        ])
+        assert len(list(rrbac.users_for_route('GET', '/uncovered_route'))) == 3
+        assert list(rrbac.users_for_route('DELETE', '/covered_route')) == []
+
+    def test_export_matrix(self, fixture_success):
+        output = StringIO()
+        assert rrbac.export_matrix(output, chunk_size=2) == 3
+        rows = [json.loads(line) for line in output.getvalue().splitlines()]
+        assert len(rows) == 3
+        for row in rows:
+            print('\nUser {} routes {}'.format(row['user_id'], row['routes']))
+            assert 'GET' in row['routes']['/uncovered_route']
+        assert sum(
+            'GET' in row['routes'].get('/covered_route', ()) for row in rows
+        ) == 2
+
+        # Same rows in CSV, role sets evaluated in a process pool
+        csv_output = StringIO()
+        assert rrbac.export_matrix(
+            csv_output, output_format='csv', chunk_size=1, processes=2
+        ) == 3
+        assert len(csv_output.getvalue().splitlines()) == sum(
+            len(methods) for row in rows for methods in row['routes'].values()
+        )
+
+        # An export running while another one is in progress in the same
+        # process does not replace the policy of the first one
+        anonymous_roles = frozenset(['Anon'])
+        app_routes = {'/a': set(['GET']), '/b': set(['GET'])}
+
+        def user_role_sets():
+            yield [(1, anonymous_roles)]
+            write_access_matrix(
+                StringIO(), [[(1, anonymous_roles)]],
+                {'Anon': {'GET': ['/b']}}, 'Anon', app_routes
+            )
+            yield [(2, anonymous_roles | frozenset(['admin']))]
+        output = StringIO()
+        write_access_matrix(
+            output, user_role_sets(), {'Anon': {'GET': ['/a']}}, 'Anon',
+            app_routes
+        )
+        assert [
+            json.loads(line)['routes']
+            for line in output.getvalue().splitlines()
+        ] == [{'/a': ['GET']}, {'/a': ['GET']}]
+
+        # Rules with variables are matched with sample values
+        output = StringIO()
+        write_access_matrix(
+            output, [[(1, anonymous_roles)]],
+            {'Anon': {'GET': ['/a/[0-9]+', '/b/<int:id>']}}, 'Anon', {
+                '/a/<int:id>': set(['GET']), '/b/<id>': set(['GET']),
+                '/c/<path:name>': set(['GET'])
+            }
+        )
+        assert json.loads(output.getvalue())['routes'] == {
+            '/a/<int:id>': ['GET'], '/b/<id>': ['GET']
+        }
+
+    def test_unsafe_rules(self, fixture_success):
+        admin_user = fixture_success[2]['input']['user']
+        # Written directly in the DB, e.g. from an admin UI
+        db.session.add(RoleRouteMap(
+            role=Role.query.filter(Role.name == 'admin').one(),
+            route=Route(rule='/files/(\\w+/?)+', method='GET')
+        ))
+        db.session.commit()
+        app.config['RRBAC_UNSAFE_RULES'] = 'reject'
+        try:
+            rrbac.init_app(app)
+            with pytest.raises(UnsafeRuleError):
+                rrbac.can(admin_user, 'GET', '/files/a')
+            with pytest.raises(UnsafeRuleError):
+                rrbac.roles_for_route('GET', '/files/a')
+            with pytest.raises(UnsafeRuleError):
+                rrbac.export_matrix(StringIO())
+        finally:
+            app.config.pop('RRBAC_UNSAFE_RULES')
+            rrbac.init_app(app)
+
+    def test_import_policy(self, fixture_success):
+        app.config['RRBAC_CACHE_DB_POLICY'] = True
+        try:
+            rrbac.init_app(app)
+            assert not rrbac.can(None, 'GET', '/covered_route')
+            document = {
+                'admin': {'GET': ['/covered_route']},
+                'super_admin': {
+                    'GET': ['/covered_route'], 'POST': ['/covered_route']
+                },
+                'Anon': {'GET': ['/uncovered_route', '/covered_route']},
+                'auditor': {'GET': ['/covered_route/[0-9]+']}
+            }
+            counts = rrbac.import_policy(document, chunk_size=1)
+            print('\nImported {}'.format(counts))
+            assert counts == {
+                'roles': 1, 'routes': 1, 'role_routes': 2,
+                'removed_role_routes': 0
+            }
+            # The cached policy has been dropped
+            assert rrbac.can(None, 'GET', '/covered_route')
+            assert rrbac.roles_for_route('GET', '/covered_route/1') == set([
+                'auditor'
+            ])
+            # Routes with variables match with sample values
+            assert rrbac.allowed_routes(None, roles=['auditor']) == {
+                '/covered_route': set(['GET']),
+                '/covered_route/<int>': set(['GET']),
+                '/uncovered_route': set(['GET'])
+            }
+            # Nothing left to write
+            assert rrbac.import_policy(document) == {
+                'roles': 0, 'routes': 0, 'role_routes': 0,
+                'removed_role_routes': 0
+            }
+            del document['super_admin']['POST']
+            assert rrbac.import_policy(document, prune=True)[
+                'removed_role_routes'
+            ] == 1
+            assert not rrbac.roles_for_route('POST', '/covered_route')
+        finally:
+            app.config.pop('RRBAC_CACHE_DB_POLICY')
+            rrbac.init_app(app)
+        # Same routes from the DB without a cached policy
+        assert rrbac.allowed_routes(None, roles=['auditor']) == {
+            '/covered_route': set(['GET']),
+            '/covered_route/<int>': set(['GET']),
+            '/uncovered_route': set(['GET'])
+        }
+
+    def test_policy_document(self, fixture_success, tmpdir):
+        path = str(tmpdir.join('policy.json'))
+        with open(path, 'w') as output:
+            content_hash = rrbac.export_policy_document(output)
+        with open(path) as document_file:
+            text = document_file.read()
+        document = json.loads(text)
+        print('\nPolicy document {}'.format(text))
+        assert text == json.dumps(document, sort_keys=True) + '\n'
+        assert document['sha1'] == content_hash
+        assert document['role_route_map'] == {
+            'Anon': {'GET': ['/uncovered_route']},
+            'admin': {'GET': ['/covered_route']},
+            'super_admin': {
+                'GET': ['/covered_route'], 'POST': ['/covered_route']
+            }
+        }
+        # Back into the DB: nothing changes
+        assert rrbac.import_policy_document(path, prune=True) == {
+            'roles': 0, 'routes': 0, 'role_routes': 0,
+            'removed_role_routes': 0
+        }
+
+        # Into the config of an app without DB, skipped when unchanged
+        edge_app = Flask('edge')
+        edge_app.config['RRBAC_ANONYMOUS_ROLE'] = 'Anon'
+        rrbac.init_app(edge_app)
+        assert rrbac.load_policy_document(path, edge_app)
+        assert not rrbac.load_policy_document(path, edge_app)
+        assert rrbac.can(None, 'GET', '/uncovered_route', edge_app)
+        assert not rrbac.can(None, 'GET', '/covered_route', edge_app)
+
+        # The hash covers the Anonymous Role, which has to be the app's
+        other_app = Flask('other_edge')
+        other_app.config['RRBAC_ANONYMOUS_ROLE'] = 'Guest'
+        rrbac.init_app(other_app)
+        with pytest.raises(ValueError):
+            rrbac.load_policy_document(path, other_app)
+        with open(path, 'w') as output:
+            output.write(text.replace('"Anon"', '"Guest"', 1))
+        with pytest.raises(ValueError):
+            rrbac.load_policy_document(path, other_app)
+
+    def test_cli(self, fixture_success, tmpdir):
+        if not hasattr(app, 'test_cli_runner'):
+            pytest.skip('Flask < 1.0 has no CLI test runner')
+        runner = app.test_cli_runner()
+        matrix_path = str(tmpdir.join('matrix.csv'))
+        result = runner.invoke(args=[
+            'rrbac', 'export-matrix', '--format', 'csv', '--chunk-size', '2',
+            '-o', matrix_path
+        ])
+        print('\n{}'.format(result.output))
+        assert result.exit_code == 0
+        assert 'Exported 3 users' in result.output
+        with open(matrix_path) as matrix_file:
+            rows = matrix_file.read().splitlines()
+        assert sum(row.endswith(',/covered_route,GET') for row in rows) == 2
+
+        document_path = str(tmpdir.join('policy.json'))
+        result = runner.invoke(args=[
+            'rrbac', 'export-policy', '-o', document_path
+        ])
+        assert result.exit_code == 0
+        with open(document_path) as document_file:
+            text = document_file.read()
+        document = json.loads(text)
+        assert 'Exported policy {}'.format(document['sha1']) in result.output
+
+        # Importing the exported document changes nothing
+        result = runner.invoke(args=['rrbac', 'import-policy', document_path])
+        assert result.exit_code == 0
+        assert json.loads(result.output) == {
+            'roles': 0, 'routes': 0, 'role_routes': 0,
+            'removed_role_routes': 0
+        }
+        # A document whose content does not match its hash is refused
+        with open(document_path, 'w') as output:
+            output.write(text.replace('/uncovered_route', '/covered_route'))
+        result = runner.invoke(args=['rrbac', 'import-policy', document_path])
+        assert result.exit_code == 1
+        assert 'does not match its content hash' in result.output
+        # So is a document written for another Anonymous Role
+        with open(document_path, 'w') as output:
+            write_policy_document(
+                output, sorted(document['role_route_map'].items()), 'Guest'
+            )
+        result = runner.invoke(args=['rrbac', 'import-policy', document_path])
+        assert result.exit_code == 1
+        assert 'Anonymous Role Guest, not Anon' in result.output
+        # A bare RRBAC_ROLE_ROUTE_MAP is imported without a hash
+        map_path = str(tmpdir.join('role_route_map.json'))
+        with open(map_path, 'w') as output:
+            json.dump({'auditor': {'GET': ['/covered_route']}}, output)
+        result = runner.invoke(args=[
+            'rrbac', 'import-policy', '--chunk-size', '1', map_path
+        ])
+        assert result.exit_code == 0
+        assert json.loads(result.output) == {
+            'roles': 1, 'routes': 0, 'role_routes': 1,
+            'removed_role_routes': 0
+        }
+        assert rrbac.roles_for_route('GET', '/covered_route') == set([
+            'admin', 'auditor', 'super_admin'
+        ])
+
+    def test_grant_and_attach(self, fixture_success, tmpdir):
+        base_user = fixture_success[0]['input']['user']
+        log_path = str(tmpdir.join('rrbac.log'))
+        app.config.update({
+            'RRBAC_CACHE_DB_POLICY': True,
+            'RRBAC_ROLE_CACHE_TTL': 60,
+            'RRBAC_INVALIDATION_LOG_PATH': log_path
+        })
+        try:
+            rrbac.init_app(app)
+            other_process = InvalidationLog(log_path)
+            assert not rrbac.can(base_user, 'GET', '/covered_route')
+            assert rrbac.grant_role(base_user, 'admin') == [base_user.id]
+            assert rrbac.grant_role([base_user], 'admin') == []
+            assert rrbac.can(base_user, 'GET', '/covered_route')
+            assert rrbac.revoke_role(base_user, 'admin') == [base_user.id]
+            assert not rrbac.can(base_user, 'GET', '/covered_route')
+            rrbac.grant_role(
+                base_user, 'admin', datetime.utcnow() - timedelta(days=1)
+            )
+            assert not rrbac.can(base_user, 'GET', '/covered_route')
+            rrbac.grant_role(
+                base_user, 'admin', datetime.utcnow() + timedelta(days=1)
+            )
+            assert rrbac.can(base_user, 'GET', '/covered_route')
+            # A permanent grant replaces the expiry of a temporary one
+            assert rrbac.grant_role(base_user, 'admin') == [base_user.id]
+            assert rrbac.grant_role(base_user, 'admin') == []
+            assert [
+                deleted_at for (deleted_at,) in UserRoleMap.query.join(
+                    Role
+                ).filter(Role.name == 'admin').filter(
+                    UserRoleMap.user_id == base_user.id
+                ).filter(UserRoleMap.is_deleted == (False)).with_entities(
+                    UserRoleMap.deleted_at
+                )
+            ] == [None]
+
+            # The changes are committed in their own session: pending work
+            # of the caller is neither committed nor expired
+            db.session.add(Role(name='pending'))
+            assert rrbac.revoke_role(base_user, 'admin') == [base_user.id]
+            assert 'name' in base_user.__dict__
+            db.session.rollback()
+            assert Role.query.filter(Role.name == 'pending').count() == 0
+            rrbac.grant_role(base_user, 'admin')
+
+            assert not rrbac.can(base_user, 'POST', '/covered_route')
+            assert len(rrbac.attach_route(
+                'base', 'post', ['/covered_route', '/covered_route/[0-9]+']
+            )) == 2
+            assert rrbac.can(base_user, 'POST', '/covered_route/1')
+            assert rrbac.detach_route('base', 'POST', '/covered_route/[0-9]+')
+            assert rrbac.can(base_user, 'POST', '/covered_route')
+            assert not rrbac.can(base_user, 'POST', '/covered_route/1')
+
+            # The changes reach the other processes through the log
+            user_ids, policy_changed, everything = other_process.poll(True)
+            print('\nInvalidated users {}'.format(user_ids))
+            assert user_ids == set([base_user.id])
+            assert policy_changed and not everything
+            assert other_process.poll(True) is None
+        finally:
+            for key in (
+                'RRBAC_CACHE_DB_POLICY', 'RRBAC_ROLE_CACHE_TTL',
+                'RRBAC_INVALIDATION_LOG_PATH'
+            ):
+                app.config.pop(key)
+            rrbac.init_app(app)
+
+    @pytest.mark.usefixtures("fixture_success")
+    def test_route_expiry(self, fixture_success, tmpdir):
+        base_user = fixture_success[0]['input']['user']
+        store_path = str(tmpdir.join('policy.store'))
+        app.config['RRBAC_CACHE_DB_POLICY'] = True
+        try:
+            rrbac.init_app(app)
+            rrbac.warmup(app)
+            expires_at = datetime.utcnow() + timedelta(seconds=1)
+            assert rrbac.attach_route(
+                'base', 'POST', '/covered_route', expires_at
+            )
+            assert rrbac.can(base_user, 'POST', '/covered_route')
+            # A later revocation does not extend the access
+            assert rrbac.detach_route(
+                'base', 'POST', '/covered_route',
+                expires_at + timedelta(days=1)
+            ) == []
+            rrbac.write_policy_store(store_path, app)
+            assert MmapPolicyStore(store_path).rule_expiries == {
+                ('base', 'POST', '/covered_route'): expires_at
+            }
+            assert rrbac.can(base_user, 'POST', '/covered_route')
+            time.sleep(
+                (expires_at - datetime.utcnow()).total_seconds() + 0.1
+            )
+            # The compiled policies drop the route once it has expired
+            assert not rrbac.can(base_user, 'POST', '/covered_route')
+            app.config['RRBAC_POLICY_STORE_PATH'] = store_path
+            rrbac.init_app(app)
+            assert not rrbac.can(base_user, 'POST', '/covered_route')
+        finally:
+            app.config.pop('RRBAC_POLICY_STORE_PATH', None)
+            app.config['RRBAC_CACHE_DB_POLICY'] = False
+            rrbac.init_app(app)
+
+    @pytest.mark.usefixtures("fixture_success")
+    def test_role_hierarchy(self, fixture_success):
+        base_user = fixture_success[0]['input']['user']
+        assert not rrbac.can(base_user, 'GET', '/covered_route')
+        # The hierarchy is not queried again on each check
+        statements = []
+
+        def count(*args):
+            statements.append(args[2])
+        engine = db.engine
+        event.listen(engine, 'before_cursor_execute', count)
+        try:
+            assert not rrbac.can(base_user, 'GET', '/covered_route')
+        finally:
+            event.remove(engine, 'before_cursor_execute', count)
+        assert len(statements) == 1
+        # base includes its parent, admin
+        base_role = Role.query.filter_by(name='base').one()
+        base_role.parent_id = Role.query.filter_by(name='admin').one().id
+        db.session.commit()
+        # The hierarchy is read once, until the policy is refreshed
+        assert not rrbac.can(base_user, 'GET', '/covered_route')
+        rrbac.refresh_policy()
+        try:
+            assert rrbac.can(base_user, 'GET', '/covered_route')
+            assert not rrbac.can(base_user, 'POST', '/covered_route')
+            assert 'base' in rrbac.roles_for_route('GET', '/covered_route')
+            app.config['RRBAC_CACHE_DB_POLICY'] = True
+            rrbac.init_app(app)
+            assert rrbac.can(base_user, 'GET', '/covered_route')
+            assert rrbac.roles_for_route('GET', '/covered_route') == set(
+                ['admin', 'base', 'super_admin']
+            )
+            # The config takes precedence over the parent_id column
+            app.config['RRBAC_ROLE_HIERARCHY'] = {'base': ['super_admin']}
+            rrbac.init_app(app)
+            assert rrbac.can(base_user, 'POST', '/covered_route')
+        finally:
+            app.config.pop('RRBAC_CACHE_DB_POLICY', None)
+            app.config.pop('RRBAC_ROLE_HIERARCHY', None)
+            base_role.parent_id = None
+            db.session.commit()
+            rrbac.init_app(app)
+
+    def test_tenant_roles(self, fixture_success):
+        base_user = fixture_success[0]['input']['user']
+        route = Route.query.filter_by(
+            rule='/covered_route', method='GET'
+        ).one()
+        tenant_roles = {}
+        for tenant in ('acme', 'globex'):
+            tenant_roles[tenant] = Role(name='admin', tenant_id=tenant)
+            db.session.add(
+                RoleRouteMap(role=tenant_roles[tenant], route=route)
+            )
+        # base is an admin of acme only
+        db.session.add(UserRoleMap(user=base_user, role=tenant_roles['acme']))
+        db.session.commit()
+        app.config['RRBAC_ROLE_CACHE_TTL'] = 60
+        rrbac.set_tenant_resolver(lambda: request.headers.get('X-Tenant'))
+        try:
+            rrbac.init_app(app)
+            for tenant, allowed in [
+                ('acme', True), ('globex', False), ('acme', True),
+                ('globex', False)
+            ]:
+                print('\nTenant {} {}'.format(tenant, allowed))
+                with app.test_request_context(
+                    '/covered_route', headers={'X-Tenant': tenant}
+                ) as request_ctx:
+                    set_current_user(request_ctx, base_user)
+                    try:
+                        response = app.view_functions['covered_route']()
+                        assert response.status_code == 200 and allowed
+                    except Forbidden:
+                        assert not allowed
+        finally:
+            rrbac.set_tenant_resolver(None)
+            app.config.pop('RRBAC_ROLE_CACHE_TTL')
+            rrbac.init_app(app)
 
     @pytest.mark.usefixtures("fixture_failure")
     def test_failure(self, fixture_failure):
         for index, data in enumerate(fixture_failure):
-            print '\nScenario {} Started'.format(index + 1)
+            print('\nScenario {} Started'.format(index + 1))
             with app.test_request_context(
                 data['input']['url_rule'],
                 method=data['input']['method']
             ) as request_ctx:
-                if data['input']['user']:
-                    request_ctx.user = data['input']['user']
+                set_current_user(request_ctx, data['input']['user'])
                 try:
                     result = 0
                     data['input']['function']()
@@ -34,31 +560,29 @@ class TestRRBAC():
                     result = 1
                 finally:
                     assert result
-                    print '\nScenario {} Passed'.format(index + 1)
+                    print('\nScenario {} Passed'.format(index + 1))
 
     @pytest.mark.usefixtures("fixture_regex_success")
     def test_regex_success(self, fixture_regex_success):
         for index, data in enumerate(fixture_regex_success):
-            print '\nScenario {} Started'.format(index + 1)
+            print('\nScenario {} Started'.format(index + 1))
             with app.test_request_context(
                 data['input']['url_rule'], method=data['input']['method']
             ) as request_ctx:
-                if data['input']['user']:
-                    request_ctx.user = data['input']['user']
+                set_current_user(request_ctx, data['input']['user'])
                 output = data['input']['function']()
                 assert output.status_code == data['output']['status_code']
-                print '\nScenario {} Passed'.format(index + 1)
+                print('\nScenario {} Passed'.format(index + 1))
 
     @pytest.mark.usefixtures("fixture_regex_failure")
     def test_regex_failure(self, fixture_regex_failure):
         for index, data in enumerate(fixture_regex_failure):
-            print '\nScenario {} Started'.format(index + 1)
+            print('\nScenario {} Started'.format(index + 1))
             with app.test_request_context(
                 data['input']['url_rule'],
                 method=data['input']['method']
             ) as request_ctx:
-                if data['input']['user']:
-                    request_ctx.user = data['input']['user']
+                set_current_user(request_ctx, data['input']['user'])
                 try:
                     result = 0
                     data['input']['function']()
@@ -66,4 +590,4 @@ class TestRRBAC():
                     result = 1
                 finally:
                     assert result
-                    print '\nScenario {} Passed'.format(index + 1)
+                    print('\nScenario {} Passed'.format(index + 1))
@@ -0,0 +1,44 @@
+import os
+import subprocess
+import sys
+
+# Flask and Flask-Login are imported first: newer Flask loads csv itself
+IMPORT_BENCHMARK = '''
+import sys
+import time
+import flask
+import flask_login
+preloaded = set(sys.modules)
+started_at = time.time()
+import flask_rrbac
+loaded = set(sys.modules) - preloaded
+print('%f %d %d' % (
+    time.time() - started_at, 'sqlalchemy' in loaded,
+    any(name in loaded for name in ('multiprocessing', 'csv', 'mmap'))
+))
+'''
+
+
+class TestLazyImport():
+    def test_import_does_not_load_sqlalchemy(self):
+        output = subprocess.check_output(
+            [sys.executable, '-c', IMPORT_BENCHMARK],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        )
+        import_time, sqlalchemy_loaded, batch_modules_loaded = \
+            output.decode().split()
+        print('\nflask_rrbac imported in {} seconds'.format(import_time))
+        assert sqlalchemy_loaded == '0'
+        # The batch, export and policy store modules are imported on use
+        assert batch_modules_loaded == '0'
+
+    def test_model_mixins_are_imported_on_access(self):
+        import flask_rrbac
+
+        assert 'ACLRoleMixin' in dir(flask_rrbac)
+        from flask_rrbac import ACLRoleMixin
+        from flask_rrbac.models import ACLRoleMixin as model_mixin
+        assert ACLRoleMixin is model_mixin
+        if sys.version_info >= (3, 7):
+            # The module __getattr__ (PEP 562) replaces the module swap
+            assert type(flask_rrbac) is type(sys)